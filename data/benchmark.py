@@ -0,0 +1,362 @@
+"""主要な処理のベンチマーク（結果は JSON で出力し、コミット間で比較できる）
+
+    python benchmark.py [-o 結果.json] [--compare 比較元.json] [--only 名前の一部 ...] [--quick]
+
+アプリと同じく data/ ディレクトリで、実際のカードリスト (cardlist_filtered.csv / cardlist_p_only.csv) を使って測る。
+
+- load: CSV からのカードテーブルの構築、スナップショットからの読み込み
+- filter: 代表的な検索条件での filter_cards（キャッシュなし / キャッシュあり）とファセットの件数
+- deck: デッキテキストの解析・書き出し、レギュレーションの検証
+- qr: デッキコード（短縮形式・テキスト形式）の作成・解析、QRコード画像の読み取り
+- image: デッキ画像の描画（カード画像なし / サムネイル作成済み）と出力形式ごとのエンコード
+  （スタブのカード画像は単色なので、写真の入った実際の画像より PNG は小さく速く出る）
+
+カード画像は同じプロセスで起動するローカルの HTTP サーバー（決まった色の PNG を返す）から取得し、
+画像キャッシュ・サムネイル・スナップショットは一時ディレクトリに作るので、オフラインで何度でも同じ条件で測れる。
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+
+# スタブサーバーが返すカード画像の大きさ（公式画像と同じ縦横比）
+STUB_IMAGE_SIZE = (600, 838)
+
+# 検索のベンチマークに使う条件。(名前, filter_cards の引数)
+FILTER_QUERIES = [
+    ("all_normal", {}),
+    ("color_red", {"colors": ["赤"]}),
+    ("colors_cost", {"colors": ["青", "黄"], "costs": [3, 4, 5]}),
+    ("feature", {"feature_selected": ["麦わらの一味"]}),
+    ("free_words", {"free_words": "登場時 ドン"}),
+    ("free_words_rare", {"free_words": "トラッシュ ブロッカー 速攻"}),
+    ("parallel_only", {"parallel_mode": "parallel"}),
+    ("parallel_both_type", {"types": ["CHARACTER"], "parallel_mode": "both"}),
+    ("deck_mode", {"leader_colors": ["赤", "緑"], "types": ["CHARACTER", "EVENT"], "counters": [1000, 2000]}),
+]
+
+
+# ===============================
+# カード画像のスタブサーバー
+# ===============================
+class _StubImageHandler(BaseHTTPRequestHandler):
+    """パスごとに決まった色の PNG を返す（ETag 付き、If-None-Match には 304）"""
+
+    def do_GET(self):
+        server = self.server
+        if server.delay:
+            time.sleep(server.delay)
+        content = server.image_for(self.path)
+        etag = '"%s"' % hashlib.md5(content).hexdigest()
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubImageServer(ThreadingHTTPServer):
+    """カード画像の代わりの HTTP サーバー。with で使うと裏のスレッドで起動・停止する"""
+
+    daemon_threads = True
+
+    def __init__(self, delay=0.0):
+        super().__init__(("127.0.0.1", 0), _StubImageHandler)
+        self.delay = delay
+        self._images = {}
+        self._images_lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return "http://%s:%d" % self.server_address[:2]
+
+    def image_for(self, path):
+        with self._images_lock:
+            content = self._images.get(path)
+            if content is None:
+                from PIL import Image
+                color = tuple(hashlib.md5(path.encode()).digest()[:3])
+                buf = io.BytesIO()
+                Image.new("RGB", STUB_IMAGE_SIZE, color).save(buf, format="PNG")
+                content = self._images[path] = buf.getvalue()
+            return content
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class RedirectAdapter(HTTPAdapter):
+    """すべてのリクエストを、パスはそのままで base_url のサーバーに送る（外部のURLへは接続しない）"""
+
+    def __init__(self, base_url, **kwargs):
+        super().__init__(**kwargs)
+        self.base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        request.url = urlunsplit((self.base.scheme, self.base.netloc, url.path, url.query, ""))
+        return super().send(request, **kwargs)
+
+
+def redirect_session(session, base_url):
+    """requests のセッションの通信先をすべてスタブサーバーにする"""
+    adapter = RedirectAdapter(base_url)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+# ===============================
+# 計測
+# ===============================
+def measure(func, repeat=5, number=1, setup=None):
+    """func を number 回呼ぶ計測を repeat 回行い、1回あたりの秒数の統計を返す（setup は各計測の前に呼ぶ）"""
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "repeat": repeat,
+        "number": number,
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "max": max(times),
+    }
+
+
+def sample_decks(df, card_index, count, seed=0):
+    """リーダーの色のカードで作った、ルールどおりの50枚のデッキ（(デッキ名, リーダーID, {カードID: 枚数})）を count 個作る"""
+    rng = random.Random(seed)
+    lookup = card_index.lookup
+    card_ids = df["カードID"].to_numpy()
+    leaders = sorted(card_id for card_id, record in lookup.preferred.items() if record["タイプ"] == "LEADER")
+    decks = []
+    while len(decks) < count:
+        leader_id = rng.choice(leaders)
+        colors = [c.strip() for c in str(lookup[leader_id]["色"]).split("/") if c.strip()]
+        positions = card_index.filter_positions(leader_colors=colors, types=["CHARACTER", "EVENT", "STAGE"])
+        candidates = sorted(set(card_ids[positions]))
+        if len(candidates) < 13:
+            continue
+        picked = rng.sample(candidates, 13)
+        cards = {card_id: 4 for card_id in picked[:12]}
+        cards[picked[12]] = 2
+        decks.append((f"ベンチマーク{len(decks) + 1}", leader_id, cards))
+    return decks
+
+
+def check_parsed_decks(parsed, decks):
+    """読み込んだ DeckList の列が sample_decks のデッキと（名前・リーダー・カードの順まで）一致しなければ RuntimeError"""
+    if [(d.name, d.leader_id, d.cards, d.errors) for d in parsed] != [(n, l, dict(c), []) for n, l, c in decks]:
+        raise RuntimeError("デッキの一括読み込みの結果が元のデッキと一致しません。")
+
+
+def run_benchmarks(selected=None, quick=False):
+    """ベンチマークを実行して {名前: 統計} を返す。selected は名前に含まれる文字列のリスト（省略時はすべて）"""
+    from card_data import CardTable
+    from card_image_cache import CardImageCache
+    from card_thumbnails import ThumbnailStore
+    from deck_codec import encode_deck_code, decode_deck_code, format_deck_text, iter_decks, parse_deck_text
+    from deck_engine import DeckEngine
+    from deck_image import render_qr_code
+    from deck_image_encode import OUTPUT_FORMATS, encode_image
+    from deck_qr import decode_qr_image
+    from deck_rules import get_regulation_table, get_validator
+
+    repeat = 3 if quick else 7
+    results = {}
+
+    def want(name):
+        return not selected or any(s in name for s in selected)
+
+    def record(name, stats, **params):
+        if params:
+            stats["params"] = params
+        results[name] = stats
+        print(f"{name:<36} median {stats['median'] * 1000:10.3f} ms  (min {stats['min'] * 1000:.3f} ms)", file=sys.stderr)
+
+    with tempfile.TemporaryDirectory(prefix="deck_bench_") as tmp, StubImageServer() as server:
+        # --- load ---
+        if want("load.csv"):
+            record("load.csv", measure(lambda: CardTable.load(use_snapshot=False), repeat=max(2, repeat // 2)))
+        snapshot_path = os.path.join(tmp, "card_snapshot.npz")
+        table = CardTable.load(snapshot_path=snapshot_path)
+        if want("load.snapshot"):
+            record("load.snapshot", measure(lambda: CardTable.load(snapshot_path=snapshot_path), repeat=repeat))
+        df, card_index = table.state
+        card_lookup = card_index.lookup
+
+        # --- filter ---
+        engine = DeckEngine(card_table=table)
+        for name, query in FILTER_QUERIES:
+            if want(f"filter.{name}"):
+                hits = len(engine.filter_cards(**query))
+                # キャッシュなしは1回ごとにキャッシュを空にする（setup は計測ごとに呼ばれるので number=1）
+                record(f"filter.{name}", measure(lambda: engine.filter_cards(**query), repeat=repeat * 5,
+                                                 setup=card_index.clear_filter_cache), hits=hits, **query)
+                record(f"filter.{name}.cached", measure(lambda: engine.filter_cards(**query), repeat=repeat, number=50))
+        if want("filter.facet_counts"):
+            record("filter.facet_counts", measure(lambda: card_index.facet_counts(colors=["赤"], free_words="ドン"), repeat=repeat, number=20))
+
+        # --- deck ---
+        decks = sample_decks(df, card_index, 200 if quick else 1000)
+        name, leader_id, cards = decks[0]
+        deck_text = format_deck_text(name, leader_id, cards, card_lookup)
+        batch_text = "\n\n".join(format_deck_text(n, l, c, card_lookup) for n, l, c in decks)
+        if want("deck.parse"):
+            record("deck.parse", measure(lambda: parse_deck_text(deck_text, known_ids=card_lookup), repeat=repeat, number=200))
+        if want("deck.format"):
+            record("deck.format", measure(lambda: format_deck_text(name, leader_id, cards, card_lookup), repeat=repeat, number=200))
+        if want("deck.parse_batch"):
+            # 読み込んだデッキが元のデッキと一致するか確かめる（入力を間違えると別のものを測ってしまう）
+            check_parsed_decks(iter_decks(batch_text.splitlines(), known_ids=card_lookup), decks)
+            record("deck.parse_batch", measure(lambda: list(iter_decks(batch_text.splitlines(), known_ids=card_lookup)), repeat=repeat),
+                   decks=len(decks))
+        if want("deck.validate_batch"):
+            validator = get_validator(get_regulation_table().get(), card_lookup)
+            batch = [(l, c) for _, l, c in decks]
+            record("deck.validate_batch", measure(lambda: validator.validate_many(batch), repeat=repeat), decks=len(decks))
+
+        # --- qr ---
+        compact_code = encode_deck_code(name, leader_id, cards, card_lookup, compact=True)
+        text_code = encode_deck_code(name, leader_id, cards, card_lookup, compact=False)
+        if want("qr.encode_compact"):
+            record("qr.encode_compact", measure(lambda: encode_deck_code(name, leader_id, cards, card_lookup, compact=True), repeat=repeat, number=200))
+        if want("qr.decode_compact"):
+            record("qr.decode_compact", measure(lambda: decode_deck_code(compact_code, card_lookup), repeat=repeat, number=200))
+        if want("qr.render"):
+            for label, code in (("compact", compact_code), ("text", text_code)):
+                record(f"qr.render_{label}", measure(lambda: render_qr_code.__wrapped__(code, 300), repeat=repeat, number=5),
+                       chars=len(code))
+
+        # --- image ---
+        # 描画のたびに新しい（空の）画像キャッシュ・サムネイルを使う engine を作れるようにする
+        current = {}
+
+        def fresh_engine():
+            from deck_image import clear_deck_header_cache, layout_name_plate, render_background
+            for func in (render_background, layout_name_plate, render_qr_code):
+                func.cache_clear()
+            clear_deck_header_cache()
+            directory = tempfile.mkdtemp(dir=tmp)
+            image_cache = CardImageCache(cache_dir=os.path.join(directory, "image_cache"))
+            redirect_session(image_cache.session, server.base_url)
+            thumbnail_store = ThumbnailStore(image_cache, thumb_dir=os.path.join(directory, "thumbnails"))
+            current["engine"] = DeckEngine(card_table=table, thumbnail_store=thumbnail_store)
+
+        def render():
+            return current["engine"].render_deck_image(leader_id, cards, name)
+
+        if want("image.render_cold"):
+            record("image.render_cold", measure(render, repeat=max(2, repeat // 2), setup=fresh_engine))
+        fresh_engine()
+        render()
+        if want("image.render_warm"):
+            record("image.render_warm", measure(render, repeat=repeat))
+        if want("image.encode"):
+            deck_img = render()
+            for output_format in OUTPUT_FORMATS:
+                size = len(encode_image(deck_img, output_format).data)
+                record(f"image.encode_{output_format}", measure(lambda: encode_image(deck_img, output_format), repeat=repeat),
+                       bytes=size)
+        if want("qr.decode_image"):
+            buf = io.BytesIO()
+            render().convert("RGB").save(buf, format="PNG")
+            png = buf.getvalue()
+            if not decode_qr_image(png):
+                raise RuntimeError("デッキ画像のQRコードを読み取れませんでした。")
+            record("qr.decode_image", measure(lambda: decode_qr_image(png), repeat=repeat))
+    return results
+
+
+def environment():
+    """結果と一緒に保存する実行環境（比較するときに条件が同じか確かめる）"""
+    import numpy
+    import pandas
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": numpy.__version__,
+        "pandas": pandas.__version__,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(base, current):
+    """2つの結果の median を並べて表示する（比 = 今回 / 比較元。1 より小さければ速くなった）"""
+    print(f"{'':<36} {'比較元':>12} {'今回':>12} {'比':>7}")
+    for name, stats in current["results"].items():
+        old = base["results"].get(name)
+        if old is None:
+            print(f"{name:<36} {'-':>12} {stats['median'] * 1000:10.3f}ms {'':>7}")
+            continue
+        ratio = stats["median"] / old["median"] if old["median"] else float("inf")
+        print(f"{name:<36} {old['median'] * 1000:10.3f}ms {stats['median'] * 1000:10.3f}ms {ratio:7.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="カードテーブル・検索・デッキ・QRコード・デッキ画像のベンチマーク")
+    parser.add_argument("-o", "--output", help="結果の JSON の保存先（省略時は標準出力）")
+    parser.add_argument("--compare", metavar="JSON", help="比較元の結果（別のコミットで保存したもの）")
+    parser.add_argument("--only", nargs="+", metavar="名前", help="名前にこの文字列を含むベンチマークだけ実行する")
+    parser.add_argument("--quick", action="store_true", help="繰り返し回数を減らす")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists("cardlist_filtered.csv"):
+        print("cardlist_filtered.csv が見つかりません。data/ ディレクトリで実行してください。", file=sys.stderr)
+        return 1
+
+    output = {"environment": environment(), "results": run_benchmarks(args.only, args.quick)}
+    text = json.dumps(output, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), output)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
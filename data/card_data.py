@@ -0,0 +1,505 @@
+"""カードテーブルの構築とバイナリスナップショット
+
+メイン/カスタム/パラレルの3つのCSVを読み込み、派生列（特徴リスト・シリーズID・ソートキーなど）と
+CardIndex を作る。構築結果は列ごとの NumPy 配列 (.npz) に保存し、元のCSVが変わっていなければ
+次回以降はそこから読み込む（CSVのパースと派生列の計算を省ける）。
+Streamlit に依存しない純粋なモジュール。
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+
+import numpy as np
+import pandas as pd
+
+import card_index as card_index_module
+import ngram_index as ngram_index_module
+from card_index import CardIndex
+
+# ===============================
+# 📄 元データのファイル名
+# ===============================
+MAIN_CARDS_CSV = "cardlist_filtered.csv"
+# 💡 追加: カスタムカードCSVのファイル名
+CUSTOM_CARDS_CSV = "custom_cards.csv"
+# 💡 追加: パラレルカードCSVのファイル名
+PARALLEL_CARDS_CSV = "cardlist_p_only.csv"
+SOURCE_CSVS = [MAIN_CARDS_CSV, CUSTOM_CARDS_CSV, PARALLEL_CARDS_CSV]
+
+# スナップショットの保存先と形式のバージョン（形式を変えたら上げる）
+SNAPSHOT_PATH = "card_snapshot.npz"
+SNAPSHOT_VERSION = 2
+
+# ===============================
+# 🧩 並び順設定
+# ===============================
+color_order = ["赤", "緑", "青", "紫", "黒", "黄"]
+color_priority = {c: i for i, c in enumerate(color_order)}
+type_priority = {"LEADER": 0, "CHARACTER": 1, "EVENT": 2, "STAGE": 3}
+
+# 💡 修正: ソートキーはタプルの object 列ではなく4つの整数列で持つ
+# (色順位, タイプ順位, 副色順位, 多色フラグ) の順に並べると従来のソートキーと同じ順序になる
+SORT_KEY_COLUMNS = ["色順位", "タイプ順位", "副色順位", "多色フラグ"]
+
+
+def color_sort_parts(text):
+    """「色」の文字列から (色順位, 副色順位, 多色フラグ) を返す。色が無い場合は 999"""
+    text = str(text)
+    if text.strip() == "-" or text.strip() == "":
+        return (999, 999, 999)
+
+    found_colors = [c for c in color_order if c in text]
+    if not found_colors:
+        return (999, 999, 999)
+
+    first_color = found_colors[0]
+    base_priority = color_priority[first_color]
+
+    is_multi = "/" in text or "／" in text
+    sub_colors = [c for c in color_order if c in text and c != first_color]
+    sub_priority = color_order.index(sub_colors[0]) + 1 if is_multi and sub_colors else 0
+    multi_flag = 1 if is_multi else 0
+
+    return (base_priority, sub_priority, multi_flag)
+
+
+def add_sort_key_columns(df):
+    """ソートキーの4列を追加する。色の判定はユニークな「色」の値ごとに1回だけ行う"""
+    color_text = df["色"].astype(str)
+    parts = {text: color_sort_parts(text) for text in color_text.unique()}
+    df["色順位"] = color_text.map({text: p[0] for text, p in parts.items()}).astype(int)
+    df["副色順位"] = color_text.map({text: p[1] for text, p in parts.items()}).astype(int)
+    df["多色フラグ"] = color_text.map({text: p[2] for text, p in parts.items()}).astype(int)
+    # 色が無いカードはタイプ順位も 999（従来の (999, 999, 999, 999) と同じ）
+    type_rank = df["タイプ"].map(type_priority).fillna(9).astype(int)
+    df["タイプ順位"] = type_rank.where(df["色順位"] != 999, 999)
+    return df
+
+
+# ===============================
+# 🧠 CSVからの構築
+# ===============================
+# テーブル内での並び順（この順に連結する）
+SOURCE_ORDER = [MAIN_CARDS_CSV, CUSTOM_CARDS_CSV, PARALLEL_CARDS_CSV]
+
+# derive_columns が追加する列（CSV由来の列と区別するため）
+DERIVED_COLUMNS = ["特徴リスト", "属性リスト", "コスト数値", "シリーズID"] + SORT_KEY_COLUMNS
+
+
+def read_main_cards():
+    """メインカードリストを読み込む。ファイルが無い場合は None"""
+    if not os.path.exists(MAIN_CARDS_CSV):
+        # ❌ 修正: st.error()を削除
+        return None
+        
+    df_main = pd.read_csv(MAIN_CARDS_CSV)
+    
+    # 💡 修正: カスタムカードとの統合を容易にするため、不足している列を追加（空値でOK）
+    if '画像URL' not in df_main.columns:
+        df_main['画像URL'] = None
+    
+    # 💡 追加: パラレルカードフラグの追加
+    df_main['is_parallel'] = False 
+    return df_main
+
+
+def read_custom_cards(required_cols):
+    """カスタムカードリストを読み込み、メインDFと同じ列構造に揃える"""
+    df_custom = pd.DataFrame()
+    if os.path.exists(CUSTOM_CARDS_CSV):
+        try:
+            # メインDFと同じ列構造を期待
+            df_custom = pd.read_csv(CUSTOM_CARDS_CSV)
+            
+        except Exception as e:
+            df_custom = pd.DataFrame() # 読み込みに失敗した場合は空にする
+
+    # 結合前の列チェックと調整 (カスタムカード)
+    if not df_custom.empty:
+        missing_cols = [col for col in required_cols if col not in df_custom.columns]
+        for col in missing_cols:
+            df_custom[col] = "-" # 欠損列を埋める
+        df_custom['is_parallel'] = False # カスタムカードは通常パラレルではないと仮定
+        df_custom = df_custom[required_cols] # 列順を揃える
+    return df_custom
+
+
+def read_parallel_cards(required_cols):
+    """パラレルカードリストを読み込み、メインDFと同じ列構造に揃える"""
+    df_parallel = pd.DataFrame()
+    if os.path.exists(PARALLEL_CARDS_CSV):
+        try:
+            df_parallel = pd.read_csv(PARALLEL_CARDS_CSV)
+            if '画像URL' not in df_parallel.columns:
+                df_parallel['画像URL'] = None
+            df_parallel['is_parallel'] = True # パラレルカードにフラグを立てる
+        except Exception as e:
+            df_parallel = pd.DataFrame() # 読み込みに失敗した場合は空にする
+            
+    # 結合前の列チェックと調整 (パラレルカード)
+    if not df_parallel.empty:
+        missing_cols = [col for col in required_cols if col not in df_parallel.columns]
+        for col in missing_cols:
+            df_parallel[col] = "-" 
+        df_parallel = df_parallel[required_cols] 
+    return df_parallel
+
+
+def derive_columns(df):
+    """欠損値を埋め、派生列（特徴リスト/属性リスト/コスト数値/シリーズID/ソートキー）を追加する
+
+    すべて行ごとに完結する処理なので、CSVごとの部分テーブルに個別に適用してから連結してよい。
+    """
+    df = df.fillna("-")
+    
+    # 特徴と属性の処理を統一（全角/半角スラッシュ対応）
+    df["特徴リスト"] = df["特徴"].apply(lambda x: [f.strip() for f in str(x).replace("／", "/").split("/") if f.strip() and f.strip() != "-"])
+    df["属性リスト"] = df["属性"].apply(lambda x: [f.strip() for f in str(x).replace("／", "/").split("/") if f.strip() and f.strip() != "-"])
+    df["コスト数値"] = df["コスト"].replace("-", 0).astype(int)
+    
+    # 修正: 入手情報から【】内のシリーズ番号のみを抽出
+    def extract_series_id(info):
+        match = re.search(r'【(.*?)】', str(info))
+        if match:
+            return match.group(1).strip()
+        return "その他" if str(info).strip() not in ["-", ""] else "-"
+        
+    df["シリーズID"] = df["入手情報"].apply(extract_series_id)
+    
+    # 💡 修正: ソートキーもキャッシュ内で計算する（カードID → レコードの辞書に含めるため）
+    # 行ごとの apply ではなく、ユニークな色の値ごとの計算 + map で整数列を作る
+    df = add_sort_key_columns(df)
+    
+    return df
+
+
+def read_source_slice(path, required_cols):
+    """カスタム/パラレルのCSV1つ分を読み込み、派生列まで計算した部分テーブルを返す（空の場合あり）"""
+    if path == CUSTOM_CARDS_CSV:
+        df_slice = read_custom_cards(required_cols)
+    elif path == PARALLEL_CARDS_CSV:
+        df_slice = read_parallel_cards(required_cols)
+    else:
+        raise ValueError(f"部分的に読み直せないファイルです: {path}")
+    if df_slice.empty:
+        return None
+    return derive_columns(df_slice)
+
+
+def normalize_dtypes(df):
+    """object 列の dtype を値だけから決まるもの（すべて文字列なら str、すべて整数なら int64 など）にそろえる
+
+    pd.concat の結果の dtype は連結した部分の dtype の組み合わせで変わるため、全体の構築・差分の差し込み・
+    スナップショットの読み込みのどれでも同じ表になるように、連結した後に必ず通す。
+    """
+    return df.infer_objects()
+
+
+def build_card_slices():
+    """CSVからカードテーブルを構築し、(df, slices) を返す
+
+    slices は {CSVファイル名: (開始行, 終了行)}。メインCSVが無い場合は (空のDF, {})。
+    """
+    df_main = read_main_cards()
+    if df_main is None:
+        return pd.DataFrame(), {}
+            
+    # 必須列のリストを定義 (パラレルカードフラグも含む)
+    required_cols = list(df_main.columns)
+
+    # データの結合（メイン → カスタム → パラレル）
+    # メインカードと重複するものは除外しない（同じカードIDで別バージョンのため）
+    df_list = [derive_columns(df_main)]
+    for path in SOURCE_ORDER[1:]:
+        df_slice = read_source_slice(path, required_cols)
+        df_list.append(df_slice)
+
+    slices = {}
+    start = 0
+    for path, df_slice in zip(SOURCE_ORDER, df_list):
+        stop = start + (len(df_slice) if df_slice is not None else 0)
+        slices[path] = (start, stop)
+        start = stop
+
+    df = normalize_dtypes(pd.concat([d for d in df_list if d is not None], ignore_index=True))
+    return df, slices
+
+
+def build_card_table():
+    """CSVからカードテーブル (DataFrame) を構築する。メインCSVが無い場合は空のDFを返す"""
+    df, _ = build_card_slices()
+    return df
+
+
+# ===============================
+# 💾 スナップショット
+# ===============================
+def _file_sha256(path):
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def source_signature(paths=SOURCE_CSVS):
+    """スナップショットの有効性を判定する署名
+
+    元CSVの内容ハッシュに加え、派生列やインデックスを作るコード自体のハッシュも含める
+    （コードを変えたら古いスナップショットは自動的に使われなくなる）。
+    """
+    signature = {path: _file_sha256(path) for path in paths}
+    signature["__code__"] = [
+        _file_sha256(module.__file__)
+        for module in (card_index_module, ngram_index_module)
+    ] + [_file_sha256(__file__)]
+    signature["__version__"] = SNAPSHOT_VERSION
+    return signature
+
+
+def _encode_strings(values):
+    """文字列のリストを (UTF-8バイト列, 文字単位のオフセット) に変換する"""
+    lengths = np.fromiter((len(v) for v in values), dtype=np.int64, count=len(values))
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    blob = np.frombuffer("".join(values).encode("utf-8"), dtype=np.uint8)
+    return blob, offsets
+
+
+def _decode_strings(blob, offsets):
+    # 全体を一度だけデコードし、文字単位のオフセットで切り出す
+    text = blob.tobytes().decode("utf-8")
+    offsets = offsets.tolist()
+    return [text[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+
+
+def _encode_column(name, series, arrays, i):
+    """1列分を arrays に追加し、列のメタ情報を返す
+
+    - 数値/真偽値の列: NumPy 配列をそのまま保存
+    - 文字列の列: 連結したバイト列 + オフセット
+    - リストの列（特徴リストなど）: 要素の文字列 + 要素オフセット + 行オフセット
+    - それ以外（数値と文字列が混在する列など）: 各値を JSON にした文字列
+    """
+    meta = {"name": name, "dtype": str(series.dtype)}
+    values = series.tolist()
+    if series.dtype.kind in "biuf":
+        meta["kind"] = "array"
+        arrays[f"c{i}"] = series.to_numpy()
+    elif all(isinstance(v, str) for v in values):
+        meta["kind"] = "str"
+        arrays[f"c{i}_blob"], arrays[f"c{i}_offsets"] = _encode_strings(values)
+    elif all(isinstance(v, list) and all(isinstance(x, str) for x in v) for v in values):
+        meta["kind"] = "list"
+        flat = [x for v in values for x in v]
+        arrays[f"c{i}_blob"], arrays[f"c{i}_offsets"] = _encode_strings(flat)
+        row_offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in values], out=row_offsets[1:])
+        arrays[f"c{i}_rows"] = row_offsets
+    else:
+        meta["kind"] = "json"
+        encoded = [json.dumps(v, ensure_ascii=False) for v in values]
+        arrays[f"c{i}_blob"], arrays[f"c{i}_offsets"] = _encode_strings(encoded)
+    return meta
+
+
+def _decode_column(meta, npz, i):
+    kind = meta["kind"]
+    if kind == "array":
+        return pd.Series(npz[f"c{i}"])
+    values = _decode_strings(npz[f"c{i}_blob"], npz[f"c{i}_offsets"])
+    if kind == "list":
+        rows = npz[f"c{i}_rows"].tolist()
+        values = [values[rows[r]:rows[r + 1]] for r in range(len(rows) - 1)]
+        return pd.Series(values, dtype=object)
+    if kind == "json":
+        return pd.Series([json.loads(v) for v in values], dtype=object)
+    return pd.Series(values, dtype=meta["dtype"])
+
+
+def save_snapshot(df, card_index, signature, path=SNAPSHOT_PATH, slices=None):
+    """カードテーブルと CardIndex をスナップショットに保存する（一時ファイル + os.replace で原子的に置き換え）"""
+    arrays = {}
+    columns = [_encode_column(name, df[name], arrays, i) for i, name in enumerate(df.columns)]
+    # 💡 修正: CardIndex も配列と JSON で保存する（pickle を読み込むと、書き換えられたファイルで任意のコードが動く）
+    index_arrays, index_meta = card_index.to_arrays()
+    for name, values in index_arrays.items():
+        arrays[f"ix_{name}"] = values
+    meta = {
+        "signature": signature, "columns": columns, "rows": len(df), "slices": slices or {}, "index": index_meta
+    }
+    arrays["__meta__"] = np.array(json.dumps(meta, ensure_ascii=False))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_snapshot(signature, path=SNAPSHOT_PATH):
+    """署名が一致するスナップショットがあれば (df, card_index, slices) を返す。無効なら None"""
+    try:
+        with np.load(path, allow_pickle=False) as npz:
+            meta = json.loads(str(npz["__meta__"]))
+            if meta["signature"] != signature:
+                return None
+            df = normalize_dtypes(pd.DataFrame({
+                column["name"]: _decode_column(column, npz, i)
+                for i, column in enumerate(meta["columns"])
+            }))
+            index_arrays = {name[3:]: npz[name] for name in npz.files if name.startswith("ix_")}
+            card_index = CardIndex.from_arrays(df, index_arrays, meta["index"])
+    except Exception:
+        # 壊れている・古い形式などの場合は作り直す
+        return None
+    if len(df) != meta["rows"]:
+        return None
+    slices = {path: tuple(bounds) for path, bounds in meta["slices"].items()}
+    return df, card_index, slices
+
+
+# ===============================
+# 🔄 共有テーブルと差分リロード
+# ===============================
+def _stat_sources():
+    """元CSVの (mtime, サイズ)。変更の有無を安く判定するために使う"""
+    stats = {}
+    for path in SOURCE_CSVS:
+        try:
+            st = os.stat(path)
+            stats[path] = (st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            stats[path] = None
+    return stats
+
+
+class CardTable:
+    """プロセス内で共有するカードテーブル (df + CardIndex)
+
+    refresh() で元CSVの変更を検知し、カスタム/パラレルのCSVが変わった場合は
+    そのCSVの部分だけを読み直して df と CardIndex に差し込む（メインCSVが変わった場合は全体を作り直す）。
+    差し込みは新しいオブジェクトを作って state を置き換えるため、参照中の古い (df, CardIndex) は壊れない。
+    """
+
+    def __init__(self, df, card_index, slices, signature, use_snapshot=True, snapshot_path=SNAPSHOT_PATH):
+        self.state = (df, card_index)
+        self.slices = slices
+        self.signature = signature
+        self.use_snapshot = use_snapshot
+        self.snapshot_path = snapshot_path
+        self._stats = _stat_sources()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, use_snapshot=True, snapshot_path=SNAPSHOT_PATH):
+        """スナップショット（無ければCSV）からテーブルを読み込む"""
+        signature = source_signature()
+        if signature[MAIN_CARDS_CSV] is None:
+            return cls(pd.DataFrame(), None, {}, signature, use_snapshot, snapshot_path)
+
+        loaded = load_snapshot(signature, snapshot_path) if use_snapshot else None
+        if loaded is not None:
+            df, card_index, slices = loaded
+        else:
+            df, slices = build_card_slices()
+            card_index = CardIndex(df)
+        table = cls(df, card_index, slices, signature, use_snapshot, snapshot_path)
+        if loaded is None:
+            table._save()
+        return table
+
+    @property
+    def df(self):
+        return self.state[0]
+
+    @property
+    def index(self):
+        return self.state[1]
+
+    def _save(self):
+        if not self.use_snapshot or self.index is None:
+            return
+        try:
+            save_snapshot(self.df, self.index, self.signature, self.snapshot_path, self.slices)
+        except OSError:
+            pass # 書き込めない環境ではスナップショットなしで動かす
+
+    def refresh(self, paths=None):
+        """元CSVの変更を確認し、変わったCSVの部分だけを差し替える。差し替えたCSVのリストを返す
+
+        paths を指定すると、内容が変わっていなくてもそのCSVを読み直す（明示的なリロード）。
+        """
+        if paths is None and _stat_sources() == self._stats:
+            return []
+        with self._lock:
+            stats = _stat_sources()
+            signature = source_signature()
+            changed = [path for path in SOURCE_CSVS if signature[path] != self.signature.get(path)]
+            for path in paths or []:
+                if path not in changed:
+                    changed.append(path)
+            self._stats = stats
+            if not changed:
+                self.signature = signature
+                return []
+
+            df, card_index = self.state
+            if MAIN_CARDS_CSV in changed or card_index is None:
+                # メインCSVが変わった場合（または未読み込みの場合）は全体を作り直す
+                if signature[MAIN_CARDS_CSV] is None:
+                    df, card_index, slices = pd.DataFrame(), None, {}
+                else:
+                    df, slices = build_card_slices()
+                    card_index = CardIndex(df)
+            else:
+                slices = dict(self.slices)
+                required_cols = [col for col in df.columns if col not in DERIVED_COLUMNS]
+                for path in SOURCE_ORDER:
+                    if path in changed:
+                        df, card_index = self._replace_slice(df, card_index, slices, path, required_cols)
+
+            self.state = (df, card_index)
+            self.slices = slices
+            self.signature = signature
+            self._save()
+            return changed
+
+    @staticmethod
+    def _replace_slice(df, card_index, slices, path, required_cols):
+        """path のCSVを読み直し、その行範囲を差し替えた (df, card_index) を返す。slices も更新する"""
+        start, stop = slices[path]
+        df_slice = read_source_slice(path, required_cols)
+        parts = [df.iloc[:start]]
+        if df_slice is not None:
+            parts.append(df_slice)
+        parts.append(df.iloc[stop:])
+        # 💡 修正: 連結後の dtype を全体の構築と同じ規則でそろえる（差し替えた部分の dtype で変わらないように）
+        new_df = normalize_dtypes(pd.concat(parts, ignore_index=True))
+        card_index = card_index.replace_rows(start, stop, new_df)
+
+        # 後ろにあるCSVの行範囲をずらす
+        delta = len(new_df) - len(df)
+        for other, (other_start, other_stop) in slices.items():
+            if other_start >= stop and other != path:
+                slices[other] = (other_start + delta, other_stop + delta)
+        slices[path] = (start, stop + delta)
+        return new_df, card_index
+
+
+def load_card_table(use_snapshot=True, snapshot_path=SNAPSHOT_PATH):
+    """(カードDF, CardIndex) を返す。メインCSVが無い場合は (空のDF, None)
+
+    元CSVが変わっていなければスナップショットから読み込み、変わっていればCSVから構築して保存し直す。
+    """
+    return CardTable.load(use_snapshot, snapshot_path).state
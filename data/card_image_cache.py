@@ -0,0 +1,288 @@
+"""カード画像のディスクキャッシュ（サイズ上限・LRU削除・ETag/Last-Modified 再検証付き）
+
+Streamlit に依存しない純粋なモジュール。プロセス再起動後もキャッシュが残るため、
+デッキ画像生成のたびに公式サイトへリクエストを送らずに済む。
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# キャッシュの保存先（アプリの作業ディレクトリからの相対パス）
+IMAGE_CACHE_DIR = "image_cache"
+# キャッシュ全体のサイズ上限 (バイト)
+IMAGE_CACHE_MAX_BYTES = 512 * 1024 * 1024
+# この秒数を過ぎたエントリは条件付きGETで再検証する
+IMAGE_CACHE_REVALIDATE_SECONDS = 24 * 3600
+
+# 上限を超えたとき、この割合まで削ってから書き込みを続ける（削除の頻発を防ぐ）
+_EVICT_LOW_WATERMARK = 0.9
+
+# 並列ダウンロードの同時実行数（= HTTPコネクションプールのサイズ）
+IMAGE_FETCH_MAX_WORKERS = 8
+
+
+def _threads_available():
+    """スレッドが使える環境か判定する（Pyodide などでは False）"""
+    if sys.platform == "emscripten":
+        return False
+    try:
+        import _thread # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+THREADS_AVAILABLE = _threads_available()
+
+
+def content_digest(content):
+    """画像バイト列の版を表す短いハッシュ（サムネイルが元画像のどの版から作られたかの照合に使う）"""
+    return hashlib.sha256(content).hexdigest()[:16]
+
+
+def make_session(pool_size=IMAGE_FETCH_MAX_WORKERS):
+    """Keep-Alive で接続を使い回す共有セッションを作る"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def run_concurrently(func, items, max_workers=IMAGE_FETCH_MAX_WORKERS):
+    """items の各要素に func を適用し、結果を入力順のリストで返す
+
+    通常の CPython ではスレッドプールで並列実行し、
+    スレッドが使えない環境 (Pyodide/Streamlit Cloud の一部) では従来通り逐次実行する。
+    """
+    items = list(items)
+    if not THREADS_AVAILABLE or max_workers <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            return list(executor.map(func, items))
+    except RuntimeError:
+        # スレッドを起動できなかった場合は逐次処理にフォールバック
+        return [func(item) for item in items]
+
+
+class CardImageCache:
+    """カードID + 画像URL をキーにした画像バイト列のディスクキャッシュ
+
+    - 本体は ``<key>.bin``、ETag などのメタ情報は ``<key>.json`` に保存する
+    - LRU の時刻には本体ファイルの mtime を使う（ヒットのたびに更新）
+    - 書き込みは一時ファイル + os.replace で行うため、複数プロセスから共有しても壊れない
+    """
+
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_bytes=IMAGE_CACHE_MAX_BYTES,
+                 revalidate_after=IMAGE_CACHE_REVALIDATE_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.revalidate_after = revalidate_after
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._total_bytes = sum(size for _, _, size in self._scan_entries())
+        # 全ダウンロードで共有する Keep-Alive セッション
+        self.session = make_session()
+
+    # ------------------------------
+    # キーとパス
+    # ------------------------------
+    @staticmethod
+    def make_key(card_id, url):
+        """カードIDとURLからキャッシュキー（SHA-256）を作る"""
+        return hashlib.sha256(f"{card_id}\n{url}".encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key)
+        return base + ".bin", base + ".json"
+
+    def _scan_entries(self):
+        """(key, mtime, size) のリストを返す"""
+        entries = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            return entries
+        for name in names:
+            if not name.endswith(".bin"):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue # 他プロセスが削除した
+            entries.append((name[:-4], stat.st_mtime, stat.st_size))
+        return entries
+
+    def _atomic_write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    # ------------------------------
+    # 読み書き
+    # ------------------------------
+    def get(self, card_id, url):
+        """キャッシュ済みの (content, meta) を返す。無ければ (None, None)"""
+        bin_path, meta_path = self._paths(self.make_key(card_id, url))
+        try:
+            with open(bin_path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None, None
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, ValueError):
+            meta = {}
+        return content, meta
+
+    def get_meta(self, card_id, url):
+        """キャッシュ済みのメタ情報（本体は読まない）。無ければ None"""
+        _, meta_path = self._paths(self.make_key(card_id, url))
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def is_fresh(self, meta):
+        """メタ情報が再検証の期限内か"""
+        return time.time() - meta.get("checked_at", 0) < self.revalidate_after
+
+    def put(self, card_id, url, content, etag=None, last_modified=None):
+        """画像バイト列を保存し、必要ならLRU削除を行う"""
+        key = self.make_key(card_id, url)
+        bin_path, meta_path = self._paths(key)
+        meta = {
+            "card_id": card_id,
+            "url": url,
+            "etag": etag,
+            "last_modified": last_modified,
+            "digest": content_digest(content),
+            "checked_at": time.time(),
+        }
+        with self._lock:
+            try:
+                old_size = os.path.getsize(bin_path)
+            except OSError:
+                old_size = 0
+            self._atomic_write(bin_path, content)
+            self._atomic_write(meta_path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+            self._total_bytes += len(content) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+
+    def _touch(self, key, meta=None):
+        """LRU時刻を更新する（再検証した場合はメタ情報も更新）"""
+        bin_path, meta_path = self._paths(key)
+        try:
+            os.utime(bin_path)
+            if meta is not None:
+                self._atomic_write(meta_path, json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+        except OSError:
+            pass
+
+    def evict(self):
+        """サイズ上限を超えていれば古いエントリから削除する"""
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        # 他プロセスの書き込みも反映するため、ディレクトリを走査し直して合計を求める
+        entries = self._scan_entries()
+        total = sum(size for _, _, size in entries)
+        if total > self.max_bytes:
+            target = int(self.max_bytes * _EVICT_LOW_WATERMARK)
+            entries.sort(key=lambda e: e[1]) # mtimeが古い順
+            for key, _, size in entries:
+                if total <= target:
+                    break
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+        self._total_bytes = total
+
+    # ------------------------------
+    # 取得（キャッシュ → 再検証 → ダウンロード）
+    # ------------------------------
+    def fetch(self, card_id, url, timeout=5, session=None):
+        """画像バイト列を返す。取得できなければ None
+
+        - 新しいキャッシュはそのまま返す
+        - 古いキャッシュは If-None-Match / If-Modified-Since で再検証し、304なら再利用
+        - 通信に失敗した場合は古いキャッシュでも返す
+        """
+        key = self.make_key(card_id, url)
+        content, meta = self.get(card_id, url)
+
+        if content is not None and self.is_fresh(meta):
+            self._touch(key)
+            metrics.incr("image_cache_hits")
+            return content
+
+        headers = {}
+        if content is not None:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        # 計測: 再検証は revalidations、ダウンロードは misses・バイト数・所要時間（失敗は errors）
+        metrics.incr("image_cache_revalidations" if content is not None else "image_cache_misses")
+        started = metrics.clock()
+        try:
+            response = (session or self.session).get(url, headers=headers, timeout=timeout)
+        except requests.RequestException:
+            metrics.incr("image_download_errors")
+            return content
+        metrics.observe_since("image.download", started)
+
+        if response.status_code == 304 and content is not None:
+            meta["checked_at"] = time.time()
+            self._touch(key, meta)
+            metrics.incr("image_cache_not_modified")
+            return content
+
+        if response.status_code == 200:
+            metrics.incr("image_download_bytes", len(response.content))
+            self.put(
+                card_id, url, response.content,
+                etag=response.headers.get("ETag"),
+                last_modified=response.headers.get("Last-Modified"),
+            )
+            return response.content
+
+        return content
+
+    def fetch_many(self, items, timeout=5, max_workers=IMAGE_FETCH_MAX_WORKERS):
+        """(card_id, url) のリストをまとめて取得し、{card_id: bytes or None} を返す"""
+        items = list(items)
+        contents = run_concurrently(
+            lambda item: self.fetch(item[0], item[1], timeout=timeout),
+            items,
+            max_workers=max_workers,
+        )
+        return {card_id: content for (card_id, _), content in zip(items, contents)}
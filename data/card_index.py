@@ -0,0 +1,499 @@
+"""カードテーブルの列ごとの転置インデックス
+
+load_data() で一度だけ構築し、filter_cards() の各フィルタを
+「行番号配列の和集合（同じ項目内） → ビットマスクの積（項目間）」で処理する。
+DataFrame のコピーや行ごとの lambda を使わないため、再実行のたびに走る検索が軽くなる。
+Streamlit に依存しない純粋なモジュール。
+"""
+import copy
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+import numpy as np
+
+from ngram_index import NgramIndex, pack_postings, splice_postings, unpack_postings
+
+# フリーワード検索の対象列
+FREE_WORD_COLUMNS = ["カード名", "特徴", "テキスト", "トリガー"]
+
+# 部分一致で絞り込む「色」のうち、構築時に前計算しておく値
+INDEXED_COLORS = ["赤", "緑", "青", "紫", "黒", "黄"]
+
+# フリーワードのキーワードにこれらの文字が含まれていれば、従来の str.contains と同じく正規表現として扱う
+# （バイグラム索引は使えないので、候補行の4列を走査する）
+_REGEX_METACHARACTERS = frozenset(".^$*+?{}[]\\|()")
+
+# filter_positions の結果を覚えておく件数（正規化した条件 → 行番号配列の LRU）
+FILTER_CACHE_SIZE = 256
+
+# ファセット（フィルタの選択肢ごとの件数）を出す項目。キーは filter_positions の引数名、値はポスティングの属性名
+FACET_POSTINGS = {
+    "colors": "color_postings",
+    "types": "type_postings",
+    "costs": "cost_postings",
+    "counters": "counter_postings",
+    "attributes": "attribute_postings",
+    "blocks": "block_postings",
+    "series_ids": "series_postings",
+    "feature_selected": "feature_postings",
+}
+
+# ファセットの選択肢から除く値（空の属性・特徴、シリーズ不明）
+_FACET_EXCLUDED_VALUES = {"attributes": {""}, "feature_selected": {""}, "series_ids": {"-"}}
+
+# 値ごとのポスティングを持つ属性名（replace_rows で差し替える対象）
+_POSTING_ATTRS = [
+    "type_postings", "cost_postings", "counter_postings", "block_postings",
+    "series_postings", "attribute_postings", "feature_postings",
+]
+
+
+def _keyword_pattern(keyword):
+    """正規表現として扱うキーワードならコンパイルしたパターン、そのまま部分一致で探すものは None
+
+    正規表現として正しくない場合（"(" だけなど）も None（文字どおりに探す）。
+    """
+    if not _REGEX_METACHARACTERS.intersection(keyword):
+        return None
+    try:
+        return re.compile(keyword, re.IGNORECASE)
+    except re.error:
+        return None
+
+
+def _value_postings(values):
+    """値 → その値を持つ行番号（昇順の int32 配列）の辞書を作る"""
+    postings = {}
+    for pos, value in enumerate(values):
+        postings.setdefault(value, []).append(pos)
+    return {value: np.asarray(positions, dtype=np.int32) for value, positions in postings.items()}
+
+
+def _list_postings(lists):
+    """リスト列（特徴リスト/属性リスト）の各要素 → 行番号配列の辞書を作る"""
+    postings = {}
+    for pos, lst in enumerate(lists):
+        for value in set(lst):
+            postings.setdefault(value, []).append(pos)
+    return {value: np.asarray(positions, dtype=np.int32) for value, positions in postings.items()}
+
+
+# CardRecord に持たせる列（pos は df 上の行番号）
+RECORD_COLUMNS = ["カードID", "カード名", "タイプ", "色", "コスト数値", "画像URL", "is_parallel", "色順位", "タイプ順位"]
+
+# 検索結果の並び順（すべて昇順）。filter_positions はこの順に並べた行番号を返す
+RESULT_ORDER_COLUMNS = ["色順位", "タイプ順位", "副色順位", "多色フラグ", "コスト数値", "カードID", "is_parallel"]
+
+
+class CardRecord(namedtuple("CardRecord", ["pos"] + RECORD_COLUMNS)):
+    """カード1枚分の軽量レコード。row["カード名"] のように DataFrame の行と同じ書き方で読める"""
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in self._fields:
+                raise KeyError(key)
+            return getattr(self, key)
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        # getattr だと get("count") などが namedtuple のメソッドを返してしまうので、列名だけを引く
+        if key in self._fields:
+            return getattr(self, key)
+        return default
+
+
+class CardLookup:
+    """カードID → レコードの辞書（O(1) で引ける）
+
+    同じカードIDに通常版とパラレル版がある場合は、通常版 (is_parallel=False) を優先する。
+    これまでの「df[(カードID == id) & (is_parallel == False)]、無ければ df[カードID == id].iloc[0]」と同じ結果になる。
+    """
+
+    def __init__(self, df):
+        variants = {}
+        for pos, row in enumerate(df[RECORD_COLUMNS].itertuples(index=False, name=None)):
+            record = CardRecord(pos, *row)
+            variants.setdefault(record.カードID, []).append(record)
+        # 安定ソートなので、通常版・パラレル版それぞれの中では df の並び順が保たれる
+        self.variants = {
+            card_id: tuple(sorted(records, key=lambda r: bool(r.is_parallel)))
+            for card_id, records in variants.items()
+        }
+        self.preferred = {card_id: records[0] for card_id, records in self.variants.items()}
+
+    def __contains__(self, card_id):
+        return card_id in self.preferred
+
+    def __len__(self):
+        return len(self.preferred)
+
+    def __getitem__(self, card_id):
+        return self.preferred[card_id]
+
+    def get(self, card_id, default=None):
+        """優先レコード（通常版があれば通常版）を返す"""
+        return self.preferred.get(card_id, default)
+
+    def variants_of(self, card_id):
+        """通常版 → パラレル版の順に、そのカードIDの全レコードを返す"""
+        return self.variants.get(card_id, ())
+
+    def row(self, df, card_id):
+        """優先レコードに対応する df の行 (Series) を返す。無ければ None"""
+        record = self.preferred.get(card_id)
+        if record is None:
+            return None
+        return df.iloc[record.pos]
+
+
+class CardIndex:
+    """カードテーブル (df) の行番号に対する検索インデックス
+
+    行番号は df の位置 (iloc) と一致する。df の一部の行を差し替えた場合は replace_rows、
+    それ以外で行を増減・並べ替えた場合は作り直すこと。
+    filter_positions の結果はインスタンスごとの LRU に覚えるので、テーブルを読み直すと（新しい
+    CardIndex になるため）自動的に無効になる。
+    """
+
+    def __init__(self, df):
+        self.size = len(df)
+        # 各行の表示順位。検索結果は毎回 sort_values せず、この順位で並べ替える
+        self.rank = self._compute_rank(df)
+        self._build_postings(df)
+
+        # カードID → レコード（通常版優先）
+        self.lookup = CardLookup(df)
+
+        # フリーワード用: 4列を改行で連結したテキストのバイグラム索引（改行で列をまたいだ誤ヒットを防ぐ）
+        self.text_index = NgramIndex(self._free_word_texts(df))
+
+        self._build_facets()
+        self._reset_filter_cache()
+
+    # 💡 追加: 検索結果のキャッシュは pickle（プロセス間の受け渡しなど）に含めない
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_filter_cache", "_filter_cache_lock", "_filter_cache_stats"):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_filter_cache()
+
+    # 💡 追加: スナップショットには配列と JSON だけを保存する（pickle は使わない）
+    def to_arrays(self):
+        """スナップショット用の (配列の辞書, JSON にできるメタ情報)
+
+        カードIDの辞書とフリーワードのテキストは df から安く作り直せるので含めない。
+        """
+        arrays = {"rank": self.rank, "is_parallel": self.is_parallel, "is_leader": self.is_leader}
+        meta = {"postings": {}, "ngram_n": self.text_index.n}
+        for attr in ["color_postings"] + _POSTING_ATTRS:
+            meta["postings"][attr], arrays[f"{attr}_values"], arrays[f"{attr}_offsets"] = pack_postings(getattr(self, attr))
+        meta["text_keys"], arrays["text_values"], arrays["text_offsets"] = pack_postings(self.text_index.postings)
+        return arrays, meta
+
+    @classmethod
+    def from_arrays(cls, df, arrays, meta):
+        """to_arrays で保存したものと df から CardIndex を復元する"""
+        index = cls.__new__(cls)
+        index.size = len(df)
+        index.rank = arrays["rank"]
+        index.is_parallel = arrays["is_parallel"]
+        index.is_leader = arrays["is_leader"]
+        if not (len(index.rank) == len(index.is_parallel) == len(index.is_leader) == index.size):
+            raise ValueError("インデックスの行数が df と一致しません。")
+        index._color_texts = [str(c) for c in df["色"]]
+        for attr, keys in meta["postings"].items():
+            setattr(index, attr, unpack_postings(keys, arrays[f"{attr}_values"], arrays[f"{attr}_offsets"]))
+        index.lookup = CardLookup(df)
+        index.text_index = NgramIndex.from_postings(
+            cls._free_word_texts(df),
+            unpack_postings(meta["text_keys"], arrays["text_values"], arrays["text_offsets"]),
+            meta["ngram_n"]
+        )
+        index._build_facets()
+        index._reset_filter_cache()
+        return index
+
+    def _reset_filter_cache(self):
+        self._filter_cache = OrderedDict()
+        self._filter_cache_lock = threading.Lock()
+        self._filter_cache_stats = [0, 0] # [ヒット数, ミス数]
+
+    @staticmethod
+    def _free_word_texts(df):
+        return [
+            "\n".join(str(v) for v in row)
+            for row in df[FREE_WORD_COLUMNS].itertuples(index=False, name=None)
+        ]
+
+    def _build_postings(self, df):
+        self.is_parallel = df["is_parallel"].to_numpy(dtype=bool)
+        self.is_leader = (df["タイプ"] == "LEADER").to_numpy(dtype=bool)
+
+        # 色は「部分一致」（例: "赤/緑" は 赤 でも 緑 でもヒット）
+        self._color_texts = [str(c) for c in df["色"]]
+        self.color_postings = {c: self._substring_positions(c) for c in INDEXED_COLORS}
+
+        self.type_postings = _value_postings(df["タイプ"].tolist())
+        self.cost_postings = _value_postings(df["コスト数値"].tolist())
+        self.counter_postings = _value_postings(df["カウンター"].tolist())
+        self.block_postings = _value_postings(df["ブロックアイコン"].tolist())
+        self.series_postings = _value_postings(df["シリーズID"].tolist())
+        self.attribute_postings = _list_postings(df["属性リスト"])
+        self.feature_postings = _list_postings(df["特徴リスト"])
+
+    def _build_facets(self):
+        """ファセットごとの選択肢と、件数の集計に使う配列を前計算する
+
+        facet_options[facet] は選択肢（昇順）。_facet_layouts[facet] は (選択肢ごとのポスティングを連結した行番号,
+        各選択肢の先頭位置) で、マスクを行番号で引いて np.add.reduceat すれば全選択肢の件数が一度に求まる。
+        """
+        self.facet_options = {}
+        self._facet_layouts = {}
+        for facet, attr in FACET_POSTINGS.items():
+            postings = getattr(self, attr)
+            if facet == "colors":
+                values = [c for c in INDEXED_COLORS if len(postings.get(c, ()))]
+            else:
+                excluded = _FACET_EXCLUDED_VALUES.get(facet, set())
+                values = sorted(v for v, positions in postings.items() if v not in excluded and len(positions))
+            self.facet_options[facet] = values
+            lengths = np.array([len(postings[v]) for v in values], dtype=np.int64)
+            starts = np.zeros(len(values), dtype=np.int64)
+            np.cumsum(lengths[:-1], out=starts[1:])
+            rows = np.concatenate([postings[v] for v in values]) if values else np.zeros(0, dtype=np.int32)
+            self._facet_layouts[facet] = (rows, starts)
+
+    @staticmethod
+    def _compute_rank(df):
+        order = df.reset_index(drop=True).sort_values(by=RESULT_ORDER_COLUMNS, kind="stable").index.to_numpy()
+        rank = np.empty(len(df), dtype=np.int32)
+        rank[order] = np.arange(len(df), dtype=np.int32)
+        return rank
+
+    def replace_rows(self, start, stop, df):
+        """行 [start, stop) を差し替えた後の df に合わせた新しい CardIndex を返す
+
+        差し替えた行だけを索引し直し、それ以外のポスティングは行番号をずらして再利用する。
+        表示順位とカードIDの辞書は全体から作り直す（どちらも軽い処理）。元の CardIndex は変更しない。
+        """
+        part_size = len(df) - (self.size - (stop - start))
+        part = CardIndex.__new__(CardIndex)
+        part_df = df.iloc[start:start + part_size]
+        part._build_postings(part_df)
+
+        patched = copy.copy(self)
+        patched.size = len(df)
+        patched.rank = self._compute_rank(df)
+        patched.is_parallel = np.concatenate([self.is_parallel[:start], part.is_parallel, self.is_parallel[stop:]])
+        patched.is_leader = np.concatenate([self.is_leader[:start], part.is_leader, self.is_leader[stop:]])
+        patched._color_texts = self._color_texts[:start] + part._color_texts + self._color_texts[stop:]
+        patched.color_postings = splice_postings(
+            self.color_postings, start, stop,
+            {c: part._substring_positions(c) for c in self.color_postings}, part_size
+        )
+        for attr in _POSTING_ATTRS:
+            setattr(patched, attr, splice_postings(getattr(self, attr), start, stop, getattr(part, attr), part_size))
+        patched.lookup = CardLookup(df)
+        patched.text_index = self.text_index.replace_rows(start, stop, self._free_word_texts(part_df))
+        patched._build_facets()
+        # copy.copy で共有されたキャッシュは差し替え前の行番号なので、新しく作り直す
+        patched._reset_filter_cache()
+        return patched
+
+    def _substring_positions(self, token):
+        return np.asarray(
+            [pos for pos, text in enumerate(self._color_texts) if token in text], dtype=np.int32
+        )
+
+    # ------------------------------
+    # マスク演算
+    # ------------------------------
+    def _union_mask(self, postings, values):
+        """values のいずれかを持つ行を True にしたマスクを返す"""
+        mask = np.zeros(self.size, dtype=bool)
+        for value in values:
+            positions = postings.get(value)
+            if positions is not None:
+                mask[positions] = True
+        return mask
+
+    def _color_mask(self, colors):
+        mask = np.zeros(self.size, dtype=bool)
+        for color in colors:
+            positions = self.color_postings.get(color)
+            if positions is None:
+                # 前計算していない値は初回だけ走査して覚えておく
+                positions = self.color_postings[color] = self._substring_positions(color)
+            mask[positions] = True
+        return mask
+
+    # ------------------------------
+    # 検索
+    # ------------------------------
+    def sort_positions(self, positions):
+        """行番号を検索結果の表示順（RESULT_ORDER_COLUMNS の昇順）に並べ替える"""
+        positions = np.asarray(positions)
+        return positions[np.argsort(self.rank[positions], kind="stable")]
+
+    def _filter_masks(self, colors=None, types=None, costs=None, counters=None,
+                      attributes=None, blocks=None, feature_selected=None,
+                      series_ids=None, leader_colors=None, parallel_mode="normal"):
+        """(ファセット以外の条件のマスク, {ファセット: そのファセットの条件のマスク}) を返す（指定のある項目のみ）"""
+        if parallel_mode == "parallel":
+            base = self.is_parallel.copy()
+        elif parallel_mode == "normal":
+            base = ~self.is_parallel
+        else:
+            base = np.ones(self.size, dtype=bool)
+        if leader_colors:
+            base &= ~self.is_leader
+            base &= self._color_mask(leader_colors)
+
+        masks = {}
+        if colors:
+            masks["colors"] = self._color_mask(colors)
+        for facet, values in (
+            ("types", types), ("costs", costs), ("counters", counters), ("attributes", attributes),
+            ("blocks", blocks), ("series_ids", series_ids), ("feature_selected", feature_selected),
+        ):
+            if values:
+                masks[facet] = self._union_mask(getattr(self, FACET_POSTINGS[facet]), values)
+        return base, masks
+
+    @staticmethod
+    def filter_key(colors=None, types=None, costs=None, counters=None,
+                   attributes=None, blocks=None, feature_selected=None, free_words="",
+                   series_ids=None, leader_colors=None, parallel_mode="normal"):
+        """検索条件を正規化したハッシュ可能なキーにする
+
+        各項目の選択は順序・重複・None/[] の違いを無視し（項目内は OR なので結果は同じ）、
+        フリーワードは空白での区切りだけを見る。
+        """
+        return (
+            frozenset(colors or ()), frozenset(types or ()), frozenset(costs or ()),
+            frozenset(counters or ()), frozenset(attributes or ()), frozenset(blocks or ()),
+            frozenset(feature_selected or ()), tuple((free_words or "").split()),
+            frozenset(series_ids or ()), frozenset(leader_colors or ()), parallel_mode,
+        )
+
+    def filter_positions(self, colors=None, types=None, costs=None, counters=None,
+                         attributes=None, blocks=None, feature_selected=None, free_words="",
+                         series_ids=None, leader_colors=None, parallel_mode="normal"):
+        """条件に一致する行番号を表示順で返す。引数の意味は filter_cards と同じ
+
+        同じ条件の結果は LRU（FILTER_CACHE_SIZE 件、全セッションで共有）から返す。
+        返す配列は共有されるため書き込み不可にしてある。
+        """
+        key = self.filter_key(
+            colors, types, costs, counters, attributes, blocks, feature_selected,
+            free_words, series_ids, leader_colors, parallel_mode
+        )
+        with self._filter_cache_lock:
+            positions = self._filter_cache.get(key)
+            if positions is not None:
+                self._filter_cache.move_to_end(key)
+                self._filter_cache_stats[0] += 1
+                return positions
+            self._filter_cache_stats[1] += 1
+
+        positions = self._compute_positions(
+            colors, types, costs, counters, attributes, blocks, feature_selected,
+            free_words, series_ids, leader_colors, parallel_mode
+        )
+        positions.setflags(write=False)
+        with self._filter_cache_lock:
+            self._filter_cache[key] = positions
+            self._filter_cache.move_to_end(key)
+            while len(self._filter_cache) > FILTER_CACHE_SIZE:
+                self._filter_cache.popitem(last=False)
+        return positions
+
+    def clear_filter_cache(self):
+        """filter_positions のキャッシュを空にする（ベンチマークで毎回検索させる場合など。統計は残す）"""
+        with self._filter_cache_lock:
+            self._filter_cache.clear()
+
+    def filter_cache_info(self):
+        """filter_positions のキャッシュの (ヒット数, ミス数, 件数)"""
+        with self._filter_cache_lock:
+            return self._filter_cache_stats[0], self._filter_cache_stats[1], len(self._filter_cache)
+
+    def _compute_positions(self, colors, types, costs, counters, attributes, blocks,
+                           feature_selected, free_words, series_ids, leader_colors, parallel_mode):
+        mask, masks = self._filter_masks(
+            colors, types, costs, counters, attributes, blocks, feature_selected,
+            series_ids, leader_colors, parallel_mode
+        )
+        for facet_mask in masks.values():
+            mask &= facet_mask
+
+        positions = np.flatnonzero(mask)
+        if free_words and free_words.split():
+            positions = self._search_free_words(free_words, positions)
+        return self.sort_positions(positions)
+
+    # 💡 修正: 従来の str.contains(regex=True) と同じく、正規表現の記号を含むキーワードは正規表現として扱う
+    def _search_free_words(self, free_words, positions=None):
+        """空白区切りのキーワードをすべて含む行番号（AND 検索、大文字小文字は無視）
+
+        正規表現の記号を含むキーワード（"ドン|KO" など）は、4列のいずれかに正規表現が一致する行を探す。
+        それ以外はバイグラム索引の部分一致で探す。
+        """
+        result = positions
+        for keyword in free_words.split():
+            pattern = _keyword_pattern(keyword)
+            if pattern is None:
+                result = self.text_index.search(keyword, result)
+            else:
+                result = self._scan_pattern(pattern, result)
+            if result.size == 0:
+                break
+        if result is None:
+            return np.arange(self.size, dtype=np.int32)
+        return result
+
+    def _scan_pattern(self, pattern, positions=None):
+        # 索引のテキストは4列を改行で連結したもの（列の値に改行は無い）なので、列ごとに分けて照合する
+        texts = self.text_index.texts
+        rows = range(len(texts)) if positions is None else positions.tolist()
+        return np.asarray(
+            [pos for pos in rows if any(pattern.search(column) for column in texts[pos].split("\n"))],
+            dtype=np.int32
+        )
+
+    def facet_counts(self, facets=None, free_words="", **filters):
+        """ファセットごとに {選択肢: 件数} を返す。filters は filter_positions と同じ
+
+        件数は「そのファセット以外の条件」をすべて満たすカードの数（同じファセット内の選択は OR なので、
+        ほかの選択肢を追加したときに増える件数の目安になる）。facets を省略すると全ファセットを集計する。
+        """
+        base, masks = self._filter_masks(**filters)
+        if free_words and free_words.split():
+            text_mask = np.zeros(self.size, dtype=bool)
+            text_mask[self._search_free_words(free_words, np.flatnonzero(base))] = True
+            base = text_mask
+
+        counts = {}
+        for facet in facets or FACET_POSTINGS:
+            mask = base.copy()
+            for other, facet_mask in masks.items():
+                if other != facet:
+                    mask &= facet_mask
+            rows, starts = self._facet_layouts[facet]
+            values = self.facet_options[facet]
+            if not values:
+                counts[facet] = {}
+                continue
+            hits = np.add.reduceat(mask[rows].astype(np.int32), starts)
+            counts[facet] = dict(zip(values, hits.tolist()))
+        return counts
+
+    def search_text(self, free_words):
+        """フリーワードだけで検索し、一致する行番号（昇順）を返す"""
+        return self._search_free_words(free_words)
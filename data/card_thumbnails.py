@@ -0,0 +1,412 @@
+"""カード画像のサムネイル（サイズ違いの縮小画像）をディスクに保存して使い回す
+
+公式サイトのフルサイズ画像を1回だけデコードし、デッキ画像用・リーダー用・一覧表示用の
+固定サイズの縮小画像をまとめて作って保存する。以後は縮小済みの小さなファイルを読むだけで済む。
+
+- デッキ画像に貼る "deck" / "leader" は可逆WebPで保存する（その場でリサイズした場合と同じピクセルになる）
+- 一覧表示用の "grid" は非可逆WebPで保存する（ブラウザへの転送量を減らすため）
+
+Streamlit に依存しない純粋なモジュール。
+`python card_thumbnails.py` で、カードテーブルの全カード分を事前に作成できる。
+"""
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from io import BytesIO
+
+from PIL import Image, features
+
+import metrics
+from card_image_cache import CardImageCache, IMAGE_FETCH_MAX_WORKERS, THREADS_AVAILABLE, content_digest, run_concurrently
+
+# サムネイルの保存先（アプリの作業ディレクトリからの相対パス）
+THUMBNAIL_DIR = "thumbnails"
+# サムネイル全体のサイズ上限 (バイト)
+THUMBNAIL_MAX_BYTES = 256 * 1024 * 1024
+
+# 上限を超えたとき、この割合まで削ってから書き込みを続ける（CardImageCache と同じ）
+_EVICT_LOW_WATERMARK = 0.9
+
+# 公式カード画像のURL
+OFFICIAL_IMAGE_URL = "https://www.onepiece-cardgame.com/images/cardlist/card/{card_id}.png"
+
+# size: (幅, 高さ)、crop_top_half: 高さ2倍にリサイズしてから上半分を切り出す、lossless: 可逆圧縮で保存する
+ThumbnailSpec = namedtuple("ThumbnailSpec", ["size", "crop_top_half", "lossless"])
+
+THUMBNAIL_VARIANTS = {
+    # デッキ画像（deck_image.render_deck_image）のカードグリッド
+    "deck": ThumbnailSpec((215, 300), False, True),
+    # デッキ画像のリーダー（上部 548px の高さに合わせ、上半分を切り出す）
+    "leader": ThumbnailSpec((782, 548), True, True),
+    # 検索結果・カード追加画面の一覧表示
+    "grid": ThumbnailSpec((240, 335), False, False),
+}
+
+# 非可逆で保存するサムネイルの品質
+THUMBNAIL_QUALITY = 80
+
+# 一覧表示のついでに作っておくバリアント（一覧に出たカードはデッキ画像にも使われやすい）
+PREFETCH_VARIANTS = ["grid", "deck"]
+
+# バックグラウンド作成で元画像を取得できなかったカードは、この秒数が過ぎるまで再試行しない
+PREFETCH_RETRY_SECONDS = 300
+
+_FORMAT = "WEBP" if features.check("webp") else "PNG"
+_EXTENSION = ".webp" if _FORMAT == "WEBP" else ".png"
+
+
+def resolve_image_url(card_id, image_url=None):
+    """カスタムカード（画像URLが http/https で始まる）ならそのURL、それ以外は公式画像のURLを返す"""
+    if isinstance(image_url, str) and image_url.startswith(("http", "https")):
+        return image_url
+    return OFFICIAL_IMAGE_URL.format(card_id=card_id)
+
+
+def find_variant(size, crop_top_half=False):
+    """サイズと切り出し方が一致するバリアント名を返す。無ければ None"""
+    for name, spec in THUMBNAIL_VARIANTS.items():
+        if spec.size == tuple(size) and spec.crop_top_half == crop_top_half:
+            return name
+    return None
+
+
+def render_thumbnail(card_img, size, crop_top_half=False):
+    """RGBA のカード画像を指定サイズに縮小する（リーダーは上半分を切り出す）"""
+    width, height = size
+    if crop_top_half:
+        card_img = card_img.resize((width, height * 2), Image.LANCZOS)
+        return card_img.crop((0, 0, width, height))
+    return card_img.resize((width, height), Image.LANCZOS)
+
+
+def encode_thumbnail(img, lossless):
+    """サムネイルをファイルに保存するバイト列にする"""
+    buf = BytesIO()
+    if _FORMAT == "WEBP":
+        if lossless:
+            # 表示のたびに作ることもあるため、圧縮率より速度を優先する
+            img.save(buf, format="WEBP", lossless=True, exact=True, method=0)
+        else:
+            img.save(buf, format="WEBP", quality=THUMBNAIL_QUALITY, method=4)
+    else:
+        img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+class ThumbnailStore:
+    """カードID + 画像URL ごとのサムネイルのディスクキャッシュ（サイズ上限・LRU削除付き）
+
+    元画像の取得は CardImageCache に任せる。サムネイルごとに元画像の版（content_digest）を
+    ``<key>.json`` に記録し、プロセス内で再検証の期限（CardImageCache.revalidate_after）ごとに1回、
+    裏で元画像を再検証する。元画像が差し替わっていれば作り直す（それまでは古いサムネイルを返す）。
+    LRU の時刻にはサムネイルのファイルの mtime を使う（ヒットのたびに更新）。
+    """
+
+    def __init__(self, image_cache=None, thumb_dir=THUMBNAIL_DIR, variants=THUMBNAIL_VARIANTS,
+                 max_bytes=THUMBNAIL_MAX_BYTES):
+        self.image_cache = image_cache if image_cache is not None else CardImageCache()
+        self.thumb_dir = thumb_dir
+        self.variants = variants
+        self.max_bytes = max_bytes
+        os.makedirs(thumb_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._retry_after = {}
+        # (card_id, url) → 次に元画像を再検証する時刻（このプロセス内）
+        self._check_after = {}
+        self._queue = None
+        self._total_bytes = sum(size for _, _, size in self._scan_entries())
+
+    def _key_path(self, card_id, url, suffix):
+        key = CardImageCache.make_key(card_id, url)
+        return os.path.join(self.thumb_dir, key + suffix)
+
+    def _path(self, card_id, url, variant):
+        return self._key_path(card_id, url, f".{variant}{_EXTENSION}")
+
+    def _meta_path(self, card_id, url):
+        return self._key_path(card_id, url, ".json")
+
+    def _scan_entries(self):
+        """カードごとの (key, 最後に使われた mtime, サムネイルの合計サイズ) のリストを返す"""
+        entries = {}
+        try:
+            names = os.listdir(self.thumb_dir)
+        except FileNotFoundError:
+            return []
+        for name in names:
+            if not name.endswith(_EXTENSION):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.thumb_dir, name))
+            except FileNotFoundError:
+                continue # 他プロセスが削除した
+            key = name.split(".", 1)[0]
+            mtime, size = entries.get(key, (0, 0))
+            entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size)
+        return [(key, mtime, size) for key, (mtime, size) in entries.items()]
+
+    def _atomic_write(self, path, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.thumb_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    # ------------------------------
+    # 読み込み
+    # ------------------------------
+    def get_bytes(self, card_id, url, variant):
+        """保存済みのサムネイルのバイト列を返す。まだ無ければ None（取得はしない）
+
+        再検証の期限が来ていれば、元画像の再検証を裏で始める（返すのは今のサムネイル）。
+        """
+        path = self._path(card_id, url, variant)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+        except FileNotFoundError:
+            metrics.incr("thumbnail_misses")
+            return None
+        metrics.incr("thumbnail_hits")
+        try:
+            os.utime(path) # LRU の時刻
+        except OSError:
+            pass
+        self._schedule_check(card_id, url)
+        return content
+
+    def get_image(self, card_id, url, variant):
+        """サムネイルを RGBA の画像で返す。無ければ元画像から作成する。取得できなければ None"""
+        content = self.get_bytes(card_id, url, variant)
+        if content is None:
+            content = self.build(card_id, url, [variant]).get(variant)
+            if content is None:
+                return None
+        img = Image.open(BytesIO(content))
+        img.load()
+        return img.convert("RGBA")
+
+    # ------------------------------
+    # 作成
+    # ------------------------------
+    def build(self, card_id, url, variants=None, timeout=5, content=None):
+        """元画像を1回だけデコードして各バリアントを作成・保存し、{バリアント名: バイト列} を返す
+
+        variants を省略すると全バリアントを作る。content（元画像のバイト列）を省略すると CardImageCache から取得する。
+        元画像が取得できない・壊れている場合は空の辞書を返す。
+        """
+        with metrics.span("thumbnail.build"):
+            return self._build(card_id, url, variants, timeout, content)
+
+    def _build(self, card_id, url, variants, timeout, content):
+        if content is None:
+            content = self.image_cache.fetch(card_id, url, timeout=timeout)
+        if not content:
+            return {}
+        try:
+            card_img = Image.open(BytesIO(content)).convert("RGBA")
+        except Exception:
+            return {}
+
+        # 元画像が前回と別の版なら、古い版から作った他のバリアントも消す
+        digest = content_digest(content)
+        source = self.source_digest(card_id, url)
+        if source is not None and source != digest:
+            self.invalidate(card_id, url)
+
+        if source != digest:
+            meta = {"card_id": card_id, "url": url, "source": digest}
+            self._atomic_write(self._meta_path(card_id, url), json.dumps(meta, ensure_ascii=False).encode("utf-8"))
+
+        encoded = {}
+        for name in variants or self.variants:
+            spec = self.variants[name]
+            data = encode_thumbnail(render_thumbnail(card_img, spec.size, spec.crop_top_half), spec.lossless)
+            self._write_thumbnail(self._path(card_id, url, name), data)
+            encoded[name] = data
+        with self._lock:
+            self._check_after[(card_id, url)] = time.time() + self.image_cache.revalidate_after
+        return encoded
+
+    def _write_thumbnail(self, path, data):
+        with self._lock:
+            try:
+                old_size = os.path.getsize(path)
+            except OSError:
+                old_size = 0
+            self._atomic_write(path, data)
+            self._total_bytes += len(data) - old_size
+            if self._total_bytes > self.max_bytes:
+                self._evict_locked()
+
+    def evict(self):
+        """サイズ上限を超えていれば、使われていない順にカードごとのサムネイルを削除する"""
+        with self._lock:
+            self._evict_locked()
+
+    def _evict_locked(self):
+        # 他プロセスの書き込みも反映するため、ディレクトリを走査し直して合計を求める
+        entries = self._scan_entries()
+        total = sum(size for _, _, size in entries)
+        if total > self.max_bytes:
+            target = int(self.max_bytes * _EVICT_LOW_WATERMARK)
+            entries.sort(key=lambda e: e[1]) # mtimeが古い順
+            for key, _, size in entries:
+                if total <= target:
+                    break
+                for suffix in [f".{name}{_EXTENSION}" for name in self.variants] + [".json"]:
+                    try:
+                        os.remove(os.path.join(self.thumb_dir, key + suffix))
+                    except OSError:
+                        pass
+                total -= size
+        self._total_bytes = total
+
+    # ------------------------------
+    # 元画像の再検証
+    # ------------------------------
+    def source_digest(self, card_id, url):
+        """サムネイルを作った元画像の版。記録が無ければ None"""
+        try:
+            with open(self._meta_path(card_id, url), "r", encoding="utf-8") as f:
+                return json.load(f).get("source")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _schedule_check(self, card_id, url):
+        item = (card_id, url)
+        now = time.time()
+        with self._lock:
+            if self._check_after.get(item, 0) > now:
+                return
+            self._check_after[item] = now + self.image_cache.revalidate_after
+        if self._start_workers():
+            self._queue.put(("refresh", item))
+        else:
+            self._refresh_quietly(item)
+
+    def refresh(self, card_id, url):
+        """元画像を（期限切れなら条件付きGETで）再検証し、サムネイルを作った版から変わっていれば作り直す
+
+        作り直した場合は True。元画像を取得できない場合は今のサムネイルを使い続ける。
+        """
+        meta = self.image_cache.get_meta(card_id, url)
+        content = None
+        if meta is not None and meta.get("digest") and self.image_cache.is_fresh(meta):
+            digest = meta["digest"]
+        else:
+            content = self.image_cache.fetch(card_id, url)
+            if not content:
+                return False
+            digest = content_digest(content)
+        if digest == self.source_digest(card_id, url):
+            return False
+        variants = [name for name in self.variants if os.path.exists(self._path(card_id, url, name))]
+        if not variants:
+            return False
+        metrics.incr("thumbnail_stale_rebuilds")
+        return bool(self.build(card_id, url, variants, content=content))
+
+    def _refresh_quietly(self, item):
+        try:
+            self.refresh(*item)
+        except Exception:
+            pass
+
+    def build_many(self, items, variants=None, max_workers=IMAGE_FETCH_MAX_WORKERS):
+        """(card_id, url) のリストのうち、まだサムネイルが無いものをまとめて作成する。作成した件数を返す"""
+        variants = variants or list(self.variants)
+        missing = [(card_id, url) for card_id, url in items if not self.has_all(card_id, url, variants)]
+        built = run_concurrently(lambda item: bool(self.build(*item, variants)), missing, max_workers=max_workers)
+        return sum(built)
+
+    def has_all(self, card_id, url, variants=None):
+        return all(os.path.exists(self._path(card_id, url, name)) for name in variants or self.variants)
+
+    def prefetch(self, items):
+        """PREFETCH_VARIANTS のサムネイルをバックグラウンドで作成する（スレッドが使えない環境では何もしない）
+
+        ワーカーはデーモンスレッドなので、取得待ちが残っていてもプロセスの終了を妨げない。
+        """
+        if not self._start_workers():
+            return
+        now = time.time()
+        with self._lock:
+            for item in items:
+                if item in self._pending or self._retry_after.get(item, 0) > now:
+                    continue
+                self._pending.add(item)
+                self._queue.put(("build", item))
+
+    def _start_workers(self):
+        """バックグラウンドのワーカーを（まだなら）起動する。スレッドが使えない環境では False"""
+        if not THREADS_AVAILABLE:
+            return False
+        with self._lock:
+            if self._queue is None:
+                self._queue = queue.Queue()
+                for _ in range(IMAGE_FETCH_MAX_WORKERS):
+                    threading.Thread(target=self._prefetch_worker, daemon=True).start()
+        return True
+
+    def _prefetch_worker(self):
+        while True:
+            kind, item = self._queue.get()
+            if kind == "refresh":
+                self._refresh_quietly(item)
+                continue
+            try:
+                built = self.build(*item, PREFETCH_VARIANTS)
+            except Exception:
+                built = {}
+            with self._lock:
+                self._pending.discard(item)
+                if built:
+                    self._retry_after.pop(item, None)
+                else:
+                    self._retry_after[item] = time.time() + PREFETCH_RETRY_SECONDS
+
+    def invalidate(self, card_id, url):
+        """そのカードのサムネイルと元画像の版の記録をすべて削除する"""
+        with self._lock:
+            for path in [self._path(card_id, url, name) for name in self.variants] + [self._meta_path(card_id, url)]:
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                if path.endswith(_EXTENSION):
+                    self._total_bytes -= size
+
+
+def main():
+    """カードテーブルの全カードのサムネイルを事前に作成する"""
+    from card_data import load_card_table
+
+    df, _ = load_card_table()
+    items = list(dict.fromkeys(
+        (card_id, resolve_image_url(card_id, image_url))
+        for card_id, image_url in zip(df["カードID"], df["画像URL"])
+    ))
+    leaders = set(df.loc[df["タイプ"] == "LEADER", "カードID"])
+
+    store = ThumbnailStore()
+    # リーダー用の切り出し画像はリーダーのカードだけ作る
+    built = store.build_many(items, PREFETCH_VARIANTS)
+    store.build_many([item for item in items if item[0] in leaders], ["leader"])
+    print(f"{built} / {len(items)} 枚のサムネイルを作成しました。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+"""デッキリストのテキスト形式（「# デッキ名」+「枚数xカードID」）の読み書き
+
+    # デッキ名        ← 省略可
+    1xOP01-001       ← 1行目はリーダー
+    4xOP01-016
+    ...
+
+テキストインポート・QRインポート・保存済みデッキの読み込み・一括処理で共通に使う。
+1行ずつ1回だけ走査し、カードIDの確認は CardLookup などの集合に対する O(1) の `in` で行う。
+複数デッキを連結したファイルは iter_decks でデッキごとに順に読める。
+QRコードには、カード辞書の番号で詰めた短縮形式（encode_deck_code / decode_deck_code）も使える。
+Streamlit に依存しない純粋なモジュール。
+"""
+import re
+from collections import namedtuple
+
+# 「枚数xカードID」の行。カードIDに x が含まれていても、最初の x だけで区切る
+_CARD_LINE = re.compile(r"^(\d+)\s*x\s*(\S.*)$")
+
+# 読み飛ばした行の情報（line_no は1始まりの行番号）
+DeckLineError = namedtuple("DeckLineError", ["line_no", "line", "message"])
+
+# name: デッキ名（無ければ ""）、leader_id: リーダーのカードID（読めなかった場合は None）
+# cards: {カードID: 枚数}、errors: 読み飛ばした行の DeckLineError のリスト
+DeckList = namedtuple("DeckList", ["name", "leader_id", "cards", "errors"])
+
+
+class DeckParseError(ValueError):
+    """デッキリストとして読めない（リーダー行が無い・不正）"""
+
+    def __init__(self, message, line_no=None, line=None):
+        super().__init__(message)
+        self.line_no = line_no
+        self.line = line
+
+
+def parse_card_line(line):
+    """「枚数xカードID」の行を (カードID, 枚数) にする。形式が違えば None"""
+    match = _CARD_LINE.match(line.strip())
+    if match is None:
+        return None
+    return match.group(2).strip(), int(match.group(1))
+
+
+def iter_decks(lines, known_ids=None, blank_separates=True):
+    """行のイテラブル（または複数行の文字列）からデッキを順に読み、DeckList を1つずつ返すジェネレータ
+
+    「# デッキ名」の行、またはカード行の後の空行（blank_separates=False なら「# デッキ名」の行のみ）で次のデッキに切り替わる。
+    known_ids（CardLookup や set など）を渡すと、含まれないカードIDの行は読み飛ばして errors に記録する。
+    リーダー行が読めなかったデッキも leader_id=None として返す（止まらずに次のデッキへ進む）。
+    """
+    # 💡 修正: 文字列をそのまま渡すと1文字ずつの「行」になるので、行に分ける
+    if isinstance(lines, str):
+        lines = lines.splitlines()
+    name, leader_id, cards, errors = "", None, {}, []
+    started = False # 現在のデッキに1行以上の内容があるか
+    has_leader_line = False # 現在のデッキのリーダー行（名前の次の行）を読んだか
+
+    for line_no, raw in enumerate(lines, start=1):
+        line = raw.strip()
+        if not line:
+            if blank_separates and has_leader_line:
+                yield DeckList(name, leader_id, cards, errors)
+                name, leader_id, cards, errors = "", None, {}, []
+                started = has_leader_line = False
+            continue
+
+        if line.startswith("#"):
+            if started:
+                yield DeckList(name, leader_id, cards, errors)
+                leader_id, cards, errors = None, {}, []
+                has_leader_line = False
+            name = line[1:].strip()
+            started = True
+            continue
+
+        started = True
+        parsed = parse_card_line(line)
+        if not has_leader_line:
+            # デッキの最初のカード行がリーダー
+            has_leader_line = True
+            if parsed is None:
+                errors.append(DeckLineError(line_no, line, "デッキリスト形式が不正です（リーダー行に'x'がない）。"))
+            else:
+                leader_id = parsed[0]
+            continue
+        if parsed is None:
+            errors.append(DeckLineError(line_no, line, "「枚数xカードID」の形式ではありません。"))
+            continue
+        card_id, count = parsed
+        if known_ids is not None and card_id not in known_ids:
+            errors.append(DeckLineError(line_no, line, f"カード {card_id} が見つかりません。"))
+            continue
+        cards[card_id] = count
+
+    if started:
+        yield DeckList(name, leader_id, cards, errors)
+
+
+def parse_deck_text(text, known_ids=None):
+    """1デッキ分のテキストを読んで DeckList を返す
+
+    空行は区切りとみなさずに読み飛ばす。リーダー行が無い・不正な場合は DeckParseError を送出する。
+    """
+    for deck in iter_decks(text.split("\n"), known_ids, blank_separates=False):
+        if deck.leader_id is None:
+            if deck.errors:
+                error = deck.errors[0]
+                raise DeckParseError(error.message, error.line_no, error.line)
+            raise DeckParseError("デッキリストが空か、リーダーが特定できませんでした。")
+        return deck
+    raise DeckParseError("有効なデッキリストがありません。")
+
+
+def deck_sort_key(card_id, card_row):
+    """デッキ内の並び順（タイプ → コスト → 色 → カードID）"""
+    return (card_row["タイプ順位"], card_row["コスト数値"], card_row["色順位"], card_id)
+
+
+def sort_deck_cards(cards, card_lookup):
+    """{カードID: 枚数} を表示・出力の順に並べた [(カードID, 枚数)] を返す"""
+    return sorted(cards.items(), key=lambda item: deck_sort_key(item[0], card_lookup[item[0]]))
+
+
+def format_deck_text(name, leader_id, cards, card_lookup=None):
+    """デッキをテキスト形式にする（parse_deck_text の逆）
+
+    card_lookup を渡すとカードを sort_deck_cards の順に並べる。省略した場合は cards の順のまま出力する。
+    """
+    lines = []
+    if name:
+        lines.append(f"# {name}")
+    lines.append(f"1x{leader_id}")
+    items = sort_deck_cards(cards, card_lookup) if card_lookup is not None else cards.items()
+    lines.extend(f"{count}x{card_id}" for card_id, count in items)
+    return "\n".join(lines)
+
+
+# ===============================
+# 📦 QRコード用の短縮形式
+# ===============================
+# テキスト形式（1行「4xOP01-016」で約11バイト）の代わりに、カード辞書の番号と枚数をビット単位で詰め、
+# QRコードの英数字モードで使える45文字（base45）で表す。同じデッキでもQRコードの型番がかなり小さくなる。
+#
+#     DK:<base45>
+#
+# ビット列: 形式バージョン(4) / 辞書の登録数(16) / リーダー番号(w) / 種類数(8) / [カード番号(w) 枚数(2[+6])]...
+# に続けて、バイト境界からデッキ名（UTF-8、先頭1バイトが長さ）。w は辞書の登録数を表せるビット数。
+# 枚数は 1〜3 を 2ビット、4枚以上は 2ビットの 3 に続けて (枚数-4) を 6ビットで表す。
+#
+# カード辞書 (card_dictionary.txt) は公式カードのIDを1行に1つ並べたもので、追記のみで更新する。
+# 番号がずれないため、登録数が同じ（かそれ以上）の辞書を持っていれば、以前の短縮形式もそのまま読める。
+
+COMPACT_PREFIX = "DK:"
+COMPACT_FORMAT_VERSION = 1
+CARD_DICTIONARY_PATH = "card_dictionary.txt"
+
+_BASE45_CHARS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:"
+_BASE45_VALUES = {c: i for i, c in enumerate(_BASE45_CHARS)}
+
+_COUNT_BITS = 2
+_COUNT_EXTRA_BITS = 6
+_MAX_COUNT = 3 + (1 << _COUNT_EXTRA_BITS)
+_DISTINCT_BITS = 8
+_DICTIONARY_SIZE_BITS = 16
+
+
+def base45_encode(data):
+    """バイト列を base45 (RFC 9285) の文字列にする。QRコードの英数字モードの文字だけになる"""
+    chars = []
+    for i in range(0, len(data) - 1, 2):
+        value = data[i] * 256 + data[i + 1]
+        value, c = divmod(value, 45)
+        e, d = divmod(value, 45)
+        chars += (_BASE45_CHARS[c], _BASE45_CHARS[d], _BASE45_CHARS[e])
+    if len(data) % 2:
+        d, c = divmod(data[-1], 45)
+        chars += (_BASE45_CHARS[c], _BASE45_CHARS[d])
+    return "".join(chars)
+
+
+def base45_decode(text):
+    """base45_encode の逆。不正な文字列なら ValueError"""
+    try:
+        values = [_BASE45_VALUES[c] for c in text]
+    except KeyError as e:
+        raise ValueError(f"base45 に使えない文字です: {e.args[0]!r}") from None
+    if len(values) % 3 == 1:
+        raise ValueError("base45 の長さが不正です。")
+    out = bytearray()
+    for i in range(0, len(values), 3):
+        chunk = values[i:i + 3]
+        if len(chunk) == 3:
+            value = chunk[0] + chunk[1] * 45 + chunk[2] * 45 * 45
+            if value > 0xFFFF:
+                raise ValueError("base45 の値が範囲外です。")
+            out.extend(divmod(value, 256))
+        else:
+            value = chunk[0] + chunk[1] * 45
+            if value > 0xFF:
+                raise ValueError("base45 の値が範囲外です。")
+            out.append(value)
+    return bytes(out)
+
+
+class CardDictionary:
+    """短縮形式で使うカードIDの通し番号（追記のみ）。version は登録数"""
+
+    def __init__(self, card_ids):
+        self.card_ids = list(card_ids)
+        self.index = {card_id: i for i, card_id in enumerate(self.card_ids)}
+
+    @property
+    def version(self):
+        return len(self.card_ids)
+
+    @classmethod
+    def load(cls, path=CARD_DICTIONARY_PATH):
+        """辞書ファイルを読み込む。ファイルが無ければ空の辞書（短縮形式は使えない）"""
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return cls(line.strip() for line in f if line.strip())
+        except FileNotFoundError:
+            return cls([])
+
+    def extended(self, card_ids):
+        """未登録のカードIDを末尾に追加した新しい辞書を返す（既存の番号は変えない）"""
+        new_ids = sorted(set(card_ids) - self.index.keys())
+        return CardDictionary(self.card_ids + new_ids)
+
+    def save(self, path=CARD_DICTIONARY_PATH):
+        with open(path, "w", encoding="utf-8", newline="\n") as f:
+            f.writelines(f"{card_id}\n" for card_id in self.card_ids)
+
+
+_card_dictionary = None
+
+
+def get_card_dictionary():
+    """既定の辞書ファイルの CardDictionary（プロセス内で1回だけ読み込む）"""
+    global _card_dictionary
+    if _card_dictionary is None:
+        _card_dictionary = CardDictionary.load()
+    return _card_dictionary
+
+
+def encode_compact(name, leader_id, cards, dictionary=None):
+    """デッキを短縮形式の文字列にする。辞書に無いカードがある・枚数が多すぎるなど表せない場合は None"""
+    dictionary = dictionary if dictionary is not None else get_card_dictionary()
+    index = dictionary.index
+    name_bytes = name.encode("utf-8")
+    if (
+        dictionary.version == 0 or dictionary.version >= 1 << _DICTIONARY_SIZE_BITS
+        or leader_id not in index or len(cards) >= 1 << _DISTINCT_BITS or len(name_bytes) > 0xFF
+        or any(card_id not in index or not 1 <= count <= _MAX_COUNT for card_id, count in cards.items())
+    ):
+        return None
+
+    width = max(1, (dictionary.version - 1).bit_length())
+    bits, n_bits = 0, 0
+
+    def put(value, size):
+        nonlocal bits, n_bits
+        bits = (bits << size) | value
+        n_bits += size
+
+    put(COMPACT_FORMAT_VERSION, 4)
+    put(dictionary.version, _DICTIONARY_SIZE_BITS)
+    put(index[leader_id], width)
+    put(len(cards), _DISTINCT_BITS)
+    for card_index, count in sorted((index[card_id], count) for card_id, count in cards.items()):
+        put(card_index, width)
+        if count <= 3:
+            put(count - 1, _COUNT_BITS)
+        else:
+            put(3, _COUNT_BITS)
+            put(count - 4, _COUNT_EXTRA_BITS)
+    put(0, -n_bits % 8)
+
+    payload = bits.to_bytes(n_bits // 8, "big") + bytes([len(name_bytes)]) + name_bytes
+    return COMPACT_PREFIX + base45_encode(payload)
+
+
+def decode_compact(text, known_ids=None, dictionary=None):
+    """短縮形式の文字列を DeckList にする。読めなければ DeckParseError
+
+    辞書に無いカード（known_ids に含まれないカードも）は parse_deck_text と同じく errors に記録して読み飛ばす。
+    """
+    dictionary = dictionary if dictionary is not None else get_card_dictionary()
+    try:
+        # base45 は空白も文字として使うため、strip() せず改行だけを取り除く
+        payload = base45_decode(text.rstrip("\r\n")[len(COMPACT_PREFIX):])
+    except ValueError as e:
+        raise DeckParseError(f"短縮形式のデッキコードが不正です（{e}）。") from None
+
+    total_bits = len(payload) * 8
+    bits = int.from_bytes(payload, "big")
+    pos = 0
+
+    def take(size):
+        nonlocal pos
+        if pos + size > total_bits:
+            raise DeckParseError("短縮形式のデッキコードが途中で切れています。")
+        pos += size
+        return (bits >> (total_bits - pos)) & ((1 << size) - 1)
+
+    if take(4) != COMPACT_FORMAT_VERSION:
+        raise DeckParseError("対応していない形式のデッキコードです。")
+    version = take(_DICTIONARY_SIZE_BITS)
+    if version > dictionary.version:
+        raise DeckParseError("カード辞書が古いため読み込めません。アプリを更新してください。")
+    width = max(1, (version - 1).bit_length())
+    leader_index = take(width)
+    if leader_index >= version:
+        raise DeckParseError("短縮形式のデッキコードが不正です（リーダー番号が範囲外）。")
+
+    cards, errors = {}, []
+    for line_no in range(2, take(_DISTINCT_BITS) + 2):
+        card_index = take(width)
+        count = take(_COUNT_BITS) + 1
+        if count == 4:
+            count = take(_COUNT_EXTRA_BITS) + 4
+        card_id = dictionary.card_ids[card_index] if card_index < version else None
+        if card_id is None or (known_ids is not None and card_id not in known_ids):
+            errors.append(DeckLineError(line_no, f"{count}x{card_id}", f"カード {card_id} が見つかりません。"))
+            continue
+        cards[card_id] = count
+
+    pos += -pos % 8
+    name_length = take(8)
+    name_start = pos // 8
+    if name_start + name_length > len(payload):
+        raise DeckParseError("短縮形式のデッキコードが途中で切れています。")
+    name = payload[name_start:name_start + name_length].decode("utf-8", errors="replace")
+    return DeckList(name, dictionary.card_ids[leader_index], cards, errors)
+
+
+def encode_deck_code(name, leader_id, cards, card_lookup=None, compact=True):
+    """QRコードに入れる文字列を返す。compact=True なら短縮形式、表せなければテキスト形式"""
+    if compact:
+        code = encode_compact(name, leader_id, cards)
+        if code is not None:
+            return code
+    return format_deck_text(name, leader_id, cards, card_lookup)
+
+
+def decode_deck_code(text, known_ids=None):
+    """QRコードから読んだ文字列（短縮形式・テキスト形式のどちらでもよい）を DeckList にする"""
+    if text.startswith(COMPACT_PREFIX):
+        return decode_compact(text, known_ids)
+    return parse_deck_text(text, known_ids)
+
+
+def main():
+    """カードテーブルの公式カード（メイン・パラレルのCSV）のうち、辞書に無いものを追記する"""
+    import pandas as pd
+    from card_data import MAIN_CARDS_CSV, PARALLEL_CARDS_CSV
+
+    card_ids = []
+    for path in (MAIN_CARDS_CSV, PARALLEL_CARDS_CSV):
+        try:
+            card_ids += pd.read_csv(path, usecols=["カードID"])["カードID"].dropna().astype(str).tolist()
+        except FileNotFoundError:
+            pass
+    dictionary = CardDictionary.load()
+    updated = dictionary.extended(card_ids)
+    updated.save()
+    print(f"{updated.version - dictionary.version} 件を追加しました（登録数 {updated.version}）。")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""Streamlit に依存しないデッキ作成のエンジン（カードテーブル・検索・デッキの読み書きと検証・デッキ画像）
+
+アプリ (original_deck.py) はこのモジュールの薄いクライアントで、同じ処理をワーカープロセス・
+ベンチマーク・バッチ処理からも UI を起動せずに使える。
+
+    from deck_engine import get_engine
+    engine = get_engine()
+    results = engine.filter_cards(colors=["赤"], costs=[3])
+    deck = engine.parse_deck(text)
+    image = engine.render_deck_image(deck.leader_id, deck.cards, deck.name)
+    encoded = engine.encode_deck_image(image, "jpeg")
+
+import 時には何も読み込まない（pandas・NumPy・PIL・OpenCV もここでは import しない）。
+カードテーブル・画像キャッシュ・デッキストアは、DeckEngine の各プロパティに初めて触れたときに構築する。
+"""
+import threading
+
+
+def filter_cards(df, colors, types, costs, counters, attributes, blocks, feature_selected, free_words, series_ids=None, leader_colors=None, parallel_mode="normal", card_index=None):
+    """条件に一致するカードの行 (DataFrame) を表示順で返す
+
+    - parallel_mode: "normal" は通常カードのみ、"parallel" はパラレルのみ、"both" は両方
+    - leader_colors: デッキ作成モード。LEADERを除外し、リーダーの色を含むカードに絞る
+    card_index は df から構築した CardIndex（省略するとその場で構築する）。
+    同じ条件の行番号は CardIndex の LRU から返るため、同じ検索の繰り返しは軽い。
+    """
+    if card_index is None:
+        from card_index import CardIndex
+        card_index = CardIndex(df)
+
+    positions = card_index.filter_positions(
+        colors=colors, types=types, costs=costs, counters=counters,
+        attributes=attributes, blocks=blocks, feature_selected=feature_selected,
+        free_words=free_words, series_ids=series_ids,
+        leader_colors=leader_colors, parallel_mode=parallel_mode
+    )
+    # positions は CardIndex が前計算した並び順で返るため sort_values は不要
+    return df.iloc[positions]
+
+
+class DeckEngine:
+    """デッキ作成の処理一式。1プロセスに1つ作り、スレッド間で共有してよい
+
+    カードテーブルは refresh() で元CSVの変更を取り込む（card_data.CardTable と同じ）。
+    df / card_index / card_lookup は呼び出した時点のテーブルを返すので、1回の処理の中では
+    最初に取り出したものを使い続けること。
+    """
+
+    def __init__(self, use_snapshot=True, card_table=None, image_cache=None, thumbnail_store=None):
+        """card_table / image_cache / thumbnail_store を渡すと、既定のものの代わりに使う（ベンチマークなど）"""
+        self.use_snapshot = use_snapshot
+        self._lock = threading.RLock()
+        self._card_table = card_table
+        self._image_cache = image_cache if image_cache is not None else getattr(thumbnail_store, "image_cache", None)
+        self._thumbnail_store = thumbnail_store
+        self._deck_store = None
+
+    def _lazy(self, attr, build):
+        # 初回だけ build() で作る（同時に呼ばれても1回だけ）
+        value = getattr(self, attr)
+        if value is None:
+            with self._lock:
+                value = getattr(self, attr)
+                if value is None:
+                    value = build()
+                    setattr(self, attr, value)
+        return value
+
+    # ------------------------------
+    # カードテーブル
+    # ------------------------------
+    @property
+    def card_table(self):
+        """カードテーブル（スナップショット or CSV から1回だけ読み込む）"""
+        def build():
+            from card_data import CardTable
+            return CardTable.load(self.use_snapshot)
+        return self._lazy("_card_table", build)
+
+    @property
+    def card_signature(self):
+        """カードテーブルの版（元CSV・コードのハッシュ）のハッシュ可能なタプル
+
+        テーブルが変わると変わるので、描画結果などのキャッシュキーに df の代わりに使う。
+        """
+        signature = self.card_table.signature
+        return tuple(sorted(
+            (key, tuple(value) if isinstance(value, list) else value) for key, value in signature.items()
+        ))
+
+    def refresh(self):
+        """元CSVの変更を確認して取り込み、(df, card_index) を返す"""
+        card_table = self.card_table
+        card_table.refresh()
+        return card_table.state
+
+    @property
+    def df(self):
+        return self.card_table.df
+
+    @property
+    def card_index(self):
+        return self.card_table.index
+
+    @property
+    def card_lookup(self):
+        card_index = self.card_table.index
+        return card_index.lookup if card_index is not None else None
+
+    def leader_colors(self, leader_id):
+        """リーダーの色（"赤/緑" など）。カードが無ければ ""（デッキストアの色の索引に使う）"""
+        card_lookup = self.card_lookup
+        record = card_lookup.get(leader_id) if card_lookup is not None else None
+        return record["色"] if record is not None else ""
+
+    # ------------------------------
+    # 検索
+    # ------------------------------
+    def filter_cards(self, colors=None, types=None, costs=None, counters=None, attributes=None, blocks=None,
+                     feature_selected=None, free_words="", series_ids=None, leader_colors=None, parallel_mode="normal"):
+        """条件に一致するカードの行 (DataFrame) を表示順で返す（引数はモジュールの filter_cards と同じ）"""
+        df, card_index = self.card_table.state
+        return filter_cards(
+            df, colors, types, costs, counters, attributes, blocks, feature_selected, free_words,
+            series_ids, leader_colors, parallel_mode, card_index=card_index
+        )
+
+    def facet_counts(self, **filters):
+        """フィルタの選択肢ごとの件数（CardIndex.facet_counts）"""
+        return self.card_index.facet_counts(**filters)
+
+    # ------------------------------
+    # デッキの読み書き・検証
+    # ------------------------------
+    def parse_deck(self, text):
+        """テキスト形式のデッキを DeckList にする（存在しないカードの行は読み飛ばして errors に記録する）"""
+        from deck_codec import parse_deck_text
+        return parse_deck_text(text, known_ids=self.card_lookup)
+
+    def format_deck(self, name, leader_id, cards):
+        """デッキをテキスト形式にする（カードはプレビューと同じ順）"""
+        from deck_codec import format_deck_text
+        return format_deck_text(name, leader_id, cards, self.card_lookup)
+
+    def encode_deck_code(self, name, leader_id, cards, compact=True):
+        """QRコードに入れる文字列（短縮形式にできなければテキスト形式）"""
+        from deck_codec import encode_deck_code
+        return encode_deck_code(name, leader_id, cards, self.card_lookup, compact)
+
+    def decode_deck_code(self, text):
+        """短縮形式・テキスト形式のどちらの文字列も DeckList にする"""
+        from deck_codec import decode_deck_code
+        return decode_deck_code(text, known_ids=self.card_lookup)
+
+    def decode_qr_image(self, data):
+        """画像ファイルのバイト列に写っているQRコードの文字列をすべて返す"""
+        from deck_qr import decode_qr_image
+        return decode_qr_image(data)
+
+    def validator(self, format_id=None):
+        """レギュレーション（省略時は既定のフォーマット）の DeckValidator"""
+        from deck_rules import get_regulation_table, get_validator
+        return get_validator(get_regulation_table().get(format_id), self.card_lookup)
+
+    def validate(self, leader_id, cards, format_id=None):
+        """1デッキの違反のリスト（deck_rules.Violation）"""
+        return self.validator(format_id).validate(leader_id, cards)
+
+    def validate_many(self, decks, format_id=None):
+        """デッキの束をまとめて検証し、デッキごとの違反のリストを返す"""
+        return self.validator(format_id).validate_many(decks)
+
+    # ------------------------------
+    # 保存済みデッキ
+    # ------------------------------
+    @property
+    def deck_store(self):
+        """保存済みデッキのストア（SQLite の接続はスレッドごとに張られる）"""
+        def build():
+            from deck_store import open_deck_store
+            return open_deck_store(leader_colors=self.leader_colors)
+        return self._lazy("_deck_store", build)
+
+    def save_deck(self, name, leader_id, cards):
+        """デッキをストアに保存する（カードはプレビューと同じ順に並べる）"""
+        from deck_codec import sort_deck_cards
+        card_lookup = self.card_lookup
+        self.deck_store.save(
+            name, leader_id, dict(sort_deck_cards(cards, card_lookup)), colors=self.leader_colors(leader_id)
+        )
+
+    # ------------------------------
+    # カード画像・デッキ画像
+    # ------------------------------
+    @property
+    def image_cache(self):
+        """カード画像のディスクキャッシュ"""
+        def build():
+            from card_image_cache import CardImageCache
+            return CardImageCache()
+        return self._lazy("_image_cache", build)
+
+    @property
+    def thumbnail_store(self):
+        """カード画像のサムネイルのディスクキャッシュ"""
+        image_cache = self.image_cache
+
+        def build():
+            from card_thumbnails import ThumbnailStore
+            return ThumbnailStore(image_cache)
+        return self._lazy("_thumbnail_store", build)
+
+    def render_deck_image(self, leader, cards, name="", compact_qr=True):
+        """デッキ画像（カード画像＋QRコード付き、PIL の RGBA 画像）を描画する
+
+        leader はリーダーのカードID（通常版の画像を使う）、またはカードの行（パラレル版のリーダーなど）。
+        カードIDのリーダーが無ければ KeyError。
+        """
+        from deck_image import render_deck_image
+        card_lookup = self.card_lookup
+        if isinstance(leader, str):
+            leader = card_lookup[leader]
+        return render_deck_image(
+            leader, cards, card_lookup, name, thumbnail_store=self.thumbnail_store, compact_qr=compact_qr
+        )
+
+    def encode_deck_image(self, img, output_format="png", quality=None, max_bytes=None):
+        """デッキ画像をダウンロード用のバイト列 (deck_image_encode.EncodedImage) にする
+
+        output_format は "png" / "jpeg" / "webp" / "budget"（max_bytes 以内に収める）。
+        """
+        from deck_image_encode import encode_image
+        return encode_image(img, output_format, quality=quality, max_bytes=max_bytes)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """プロセス内で共有する DeckEngine（作るだけで、カードテーブルなどは使うときに読み込む）"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = DeckEngine()
+    return _engine
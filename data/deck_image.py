@@ -0,0 +1,351 @@
+"""デッキ画像（2150x2048、カード画像＋QRコード付き）の描画
+
+背景・リーダー画像・フォント・デッキ名プレートはレイヤーごとにメモ化し、
+カードを1枚変えて作り直す場合はQR・デッキ名・カードグリッドを貼り直すだけで済むようにしている。
+Streamlit に依存しない純粋なモジュール（アプリからもバッチ処理からも使う）。
+"""
+import functools
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+import qrcode
+from PIL import Image, ImageDraw, ImageFont
+
+from card_image_cache import run_concurrently
+from card_thumbnails import ThumbnailStore, find_variant, render_thumbnail, resolve_image_url
+from deck_codec import encode_deck_code, sort_deck_cards
+
+
+def load_card_image(card_id, card_url, target_size, crop_top_half, thumbnail_store):
+    """URLが決まっているカード画像を指定サイズで返す。取得できなければ None"""
+    # 決まったサイズ（デッキ画像のカード・リーダー）は縮小済みのサムネイルを使う
+    variant = find_variant(target_size, crop_top_half)
+    if variant is not None:
+        return thumbnail_store.get_image(card_id, card_url, variant)
+
+    # それ以外のサイズはディスクキャッシュの元画像からその場でリサイズする
+    content = thumbnail_store.image_cache.fetch(card_id, card_url, timeout=5)
+    if not content:
+        return None
+    card_img = Image.open(BytesIO(content)).convert("RGBA")
+    return render_thumbnail(card_img, target_size, crop_top_half)
+
+def download_card_image(card_id, card_lookup, target_size, crop_top_half, thumbnail_store):
+    """カードIDから (card_id, 画像) を返す。カスタムカード（画像URL持ち）に対応。取得できなければ (card_id, None)"""
+    try:
+        # is_parallel=False のカードを優先して取得（card_lookup で O(1)）
+        card_row = card_lookup.get(card_id)
+        if card_row is None:
+            return card_id, None
+        # カスタムカードは画像URL、それ以外は公式カードのURL
+        card_url = resolve_image_url(card_id, card_row.get('画像URL'))
+        return card_id, load_card_image(card_id, card_url, target_size, crop_top_half, thumbnail_store)
+    except Exception:
+        return card_id, None
+
+
+# 色から背景色を取得 
+color_map = {
+    "赤": "#AC1122", "緑": "#008866", "青": "#0084BD", 
+    "紫": "#93388B", "黒": "#211818", "黄": "#F7E731"
+}
+
+def hex_to_rgb(hex_color):
+    hex_color = hex_color.lstrip('#')
+    return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
+
+# 💡 修正: 背景グラデーションを列ごとの draw.line ループではなく NumPy で一括生成し、
+# リーダー色の組み合わせごとにメモ化する（呼び出し側で .copy() してから描画すること）
+@functools.lru_cache(maxsize=32)
+def render_background(leader_colors, width, height):
+    """リーダー色のタプルから背景画像 (RGBA) を生成する。2色以上は横方向のグラデーション"""
+    if len(leader_colors) == 0:
+        return Image.new('RGBA', (width, height), (0, 0, 0, 0)) # 透明な背景
+    
+    gradient_colors_rgb = np.array(
+        [hex_to_rgb(color_map.get(c, "#FFFFFF")) for c in leader_colors], dtype=np.float64
+    )
+    if len(leader_colors) == 1:
+        return Image.new('RGBA', (width, height), tuple(int(v) for v in gradient_colors_rgb[0]) + (255,))
+    
+    num_colors = len(gradient_colors_rgb)
+    xs = np.arange(width, dtype=np.float64)
+    if num_colors == 2:
+        # 2色の場合は線形グラデーション
+        segment_index = np.zeros(width, dtype=np.intp)
+        ratio = xs / width
+    else:
+        # 3色以上の場合は、各色を均等区間に配置したグラデーション
+        segment_width = width / (num_colors - 1)
+        segment_index = np.minimum((xs / segment_width).astype(np.intp), num_colors - 2)
+        ratio = (xs - segment_index * segment_width) / segment_width
+    
+    start_rgb = gradient_colors_rgb[segment_index]
+    end_rgb = gradient_colors_rgb[segment_index + 1]
+    ratio = ratio[:, None]
+    strip = (start_rgb * (1 - ratio) + end_rgb * ratio).astype(np.uint8) # int() と同じく切り捨て
+    
+    # 高さ1pxのストリップを作り、NEARESTで縦方向に引き伸ばして全面に広げる
+    strip_img = Image.fromarray(strip[None, :, :]).convert('RGBA')
+    return strip_img.resize((width, height), Image.NEAREST)
+
+# 💡 追加: リーダーごとの上部レイヤー（背景＋リーダー画像）をメモ化する
+# カードを1枚変えて作り直すときは、このレイヤーをコピーしてQR・デッキ名・カードを貼るだけで済む
+# キーは (リーダー色, リーダーID, URL, 大きさと位置, リーダー画像の元画像の版)。ThumbnailStore はキーに含めない
+DECK_HEADER_CACHE_SIZE = 8
+_deck_headers = OrderedDict()
+_deck_headers_lock = threading.Lock()
+
+def leader_image_source(card_id, url, size, thumbnail_store):
+    """リーダー画像を作った元画像の版 (content_digest)。まだ取得していなければ None"""
+    if find_variant(size, True) is not None:
+        return thumbnail_store.source_digest(card_id, url)
+    meta = thumbnail_store.image_cache.get_meta(card_id, url)
+    return meta.get("digest") if meta else None
+
+def render_deck_header(leader_colors, leader_id, leader_url, width, height, leader_pos, leader_size, thumbnail_store):
+    """上部 (width x height) の背景にリーダー画像を貼ったレイヤーを返す（呼び出し側で変更しないこと）
+    元画像が差し替わってサムネイルが作り直されたら（URLが同じでも）作り直す。
+    リーダー画像が取得できなかった場合は例外を送出する（失敗した結果をメモ化しないため）"""
+    layout = (leader_colors, leader_id, leader_url, width, height, leader_pos, leader_size)
+    source = leader_image_source(leader_id, leader_url, leader_size, thumbnail_store)
+    if source is not None:
+        with _deck_headers_lock:
+            header = _deck_headers.get(layout + (source,))
+            if header is not None:
+                _deck_headers.move_to_end(layout + (source,))
+                return header
+
+    header = render_background(leader_colors, width, height).copy()
+    leader_img = load_card_image(leader_id, leader_url, leader_size, True, thumbnail_store)
+    if leader_img is None:
+        raise ValueError(f"リーダー画像を取得できませんでした: {leader_id}")
+    header.paste(leader_img, leader_pos, leader_img)
+
+    # 初回は画像を取得してはじめて版が決まるので、取得した後の版で覚える
+    source = leader_image_source(leader_id, leader_url, leader_size, thumbnail_store)
+    if source is not None:
+        with _deck_headers_lock:
+            # 同じリーダーの古い版のレイヤーは捨てる
+            for key in [key for key in _deck_headers if key[:-1] == layout]:
+                del _deck_headers[key]
+            _deck_headers[layout + (source,)] = header
+            while len(_deck_headers) > DECK_HEADER_CACHE_SIZE:
+                _deck_headers.popitem(last=False)
+    return header
+
+def clear_deck_header_cache():
+    with _deck_headers_lock:
+        _deck_headers.clear()
+
+# デッキ名の文字サイズ
+DECK_NAME_FONT_SIZE = 70
+
+# 💡 最終修正: アプリに同梱したフォントを最優先で試行する
+# ファイル名: meiryo.ttc (事前にアップロードが必要です)
+BUNDLED_FONT_PATH = "meiryo.ttc"
+
+# Streamlit Cloud環境での文字化け対策として、以下の順で試行
+DECK_NAME_FONT_PATHS = [
+    # 1. アプリに同梱したフォント（最優先）
+    (BUNDLED_FONT_PATH, None),
+    
+    # 2. 前回の修正で試したStreamlit Cloud/Linux 環境の標準パス
+    ("/usr/share/fonts/truetype/noto/NotoSansJP-Regular.otf", None),
+    ("/usr/share/fonts/opentype/noto/NotoSansCJKjp-Regular.otf", None),
+    ("/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", 0), 
+    ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", None),
+    ("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", None),
+
+    # 3. ローカル Windows のパス (Streamlit Cloudでは無視される)
+    ("C:\\Windows\\Fonts\\meiryo.ttc", 0),
+    ("C:\\Windows\\Fonts\\msgothic.ttc", 0),
+]
+
+# 💡 追加: フォントの探索・読み込みはプロセスで1回だけ行う
+@functools.lru_cache(maxsize=None)
+def load_deck_name_font(size=DECK_NAME_FONT_SIZE):
+    """デッキ名用のフォントを返す（見つからなければデフォルトフォント）"""
+    for path, index in DECK_NAME_FONT_PATHS:
+        try:
+            if os.path.exists(path): # ファイルが存在するかチェックを追加
+                if index is not None:
+                    return ImageFont.truetype(path, size, index=index)
+                return ImageFont.truetype(path, size)
+        except IOError:
+            continue # 次のフォントを試す
+
+    # 💡 最終フォールバック
+    return ImageFont.load_default()
+
+# 💡 追加: デッキ名のプレート（半透明の黒帯）の位置と大きさはデッキ名ごとにメモ化する
+@functools.lru_cache(maxsize=64)
+def layout_name_plate(deck_name, area_x, area_width, upper_height, use_default_font=False):
+    """(フォント, プレート画像, プレート位置, 文字位置) を返す
+    プレート画像はプレートの大きさだけの RGBA 画像（キャンバス全体の重ね合わせは行わない）"""
+    font_name = ImageFont.load_default() if use_default_font else load_deck_name_font()
+    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), deck_name, font=font_name)
+    text_width = bbox[2] - bbox[0]
+    text_height = bbox[3] - bbox[1]
+    
+    BG_HEIGHT = text_height + 40 
+    bg_x1 = area_x + 50 
+    bg_x2 = area_x + area_width - 50
+    bg_y1 = (upper_height - BG_HEIGHT) // 2
+    bg_y2 = bg_y1 + BG_HEIGHT
+    plate = Image.new('RGBA', (bg_x2 - bg_x1 + 1, bg_y2 - bg_y1 + 1), (0, 0, 0, 128))
+
+    text_x = bg_x1 + (bg_x2 - bg_x1 - text_width) // 2
+    text_y = bg_y1 + 20 
+    return font_name, plate, (bg_x1, bg_y1), (text_x, text_y)
+
+def draw_name_plate(img, deck_name, area_x, area_width, upper_height, use_default_font=False):
+    """デッキ名をプレート付きで img に描く（プレートの範囲だけを合成する）"""
+    font_name, plate, plate_pos, text_pos = layout_name_plate(deck_name, area_x, area_width, upper_height, use_default_font)
+    img.alpha_composite(plate, dest=plate_pos)
+    ImageDraw.Draw(img).text(text_pos, deck_name, fill="white", font=font_name)
+
+@functools.lru_cache(maxsize=32)
+def render_qr_code(data, size):
+    """QRコードを size x size の RGBA 画像にする（同じ内容ならメモ化した画像を使う）
+
+    英数字だけの内容（短縮形式）は qrcode が英数字モードで符号化するため、型番が小さくなる。
+    """
+    qr = qrcode.QRCode(version=1, box_size=8, border=2)
+    qr.add_data(data)
+    qr.make(fit=True)
+    qr_img = qr.make_image(fill_color="black", back_color="white")
+    return qr_img.resize((size, size), Image.LANCZOS).convert("RGBA")
+
+def render_deck_image(leader, deck_dict, card_lookup, deck_name="", thumbnail_store=None, compact_qr=True):
+    """デッキリストの画像を生成（カード画像＋QRコード付き）2150x2048固定サイズ
+
+    leader は「カードID」「色」を持つ行（dict / Series / CardRecord）。
+    thumbnail_store を省略すると既定の保存先のサムネイル・画像キャッシュを使う。
+    compact_qr=False にすると、QRコードに一般のQRリーダーでも読めるテキスト形式のデッキリストを入れる。
+    """
+    if thumbnail_store is None:
+        thumbnail_store = ThumbnailStore()
+    
+    # 最終画像サイズ
+    FINAL_WIDTH = 2150
+    FINAL_HEIGHT = 2048
+    
+    # カードグリッドの高さ 
+    GRID_HEIGHT = 1500 
+    
+    # 上セクションの最大高さ
+    UPPER_HEIGHT = FINAL_HEIGHT - GRID_HEIGHT
+    
+    # リーダーの色を取得
+    leader_color_text = leader["色"]
+    leader_colors = [c.strip() for c in leader_color_text.replace("／", "/").split("/") if c.strip()]
+    
+    deck_cards_sorted = sort_deck_cards(deck_dict, card_lookup)
+    
+    # QRコード生成
+    # 💡 修正: 既定はカード辞書の番号で詰めた短縮形式（QRコードが小さくなり読み取りやすい）。表せない場合はテキスト形式
+    deck_code = encode_deck_code(deck_name, leader['カードID'], dict(deck_cards_sorted), compact=compact_qr)
+    QR_SIZE = 400
+    qr_img = render_qr_code(deck_code, QR_SIZE)
+    
+    # カード画像のサイズ（下部グリッド用）
+    card_width = 215
+    card_height = 300
+    
+    # 💡 修正 2B-1: モバイル対応のため、グリッドの列数を10から3に変更（画像生成時は10列を維持）
+    cards_per_row = 10 
+    cards_per_col = 5
+    
+    margin_card = 0
+    
+    # --- 上セクションの配置（リーダー → デッキ名 → QR） ---
+    
+    GAP = 48 
+    
+    LEADER_CROPPED_HEIGHT = UPPER_HEIGHT 
+    LEADER_CROPPED_WIDTH = int(LEADER_CROPPED_HEIGHT * (400 / 280)) 
+    LEADER_TARGET_SIZE = (LEADER_CROPPED_WIDTH, LEADER_CROPPED_HEIGHT) 
+    
+    QR_SIZE = 400
+    
+    DECK_NAME_AREA_WIDTH = FINAL_WIDTH - (GAP * 3) - LEADER_CROPPED_WIDTH - QR_SIZE 
+
+    leader_x = GAP 
+    deck_name_area_start_x = leader_x + LEADER_CROPPED_WIDTH + GAP 
+    qr_x = deck_name_area_start_x + DECK_NAME_AREA_WIDTH + GAP 
+    
+    leader_y = 0 
+    qr_y = (UPPER_HEIGHT - QR_SIZE) // 2 
+
+    # 画像作成 (RGBAモードで初期化)
+    # 💡 修正: 背景（単色/グラデーション）はリーダー色ごとにメモ化した画像をコピーして使う
+    img = render_background(tuple(leader_colors), FINAL_WIDTH, FINAL_HEIGHT).copy()
+
+    # 1. リーダー画像を配置 
+    # 💡 修正: 背景＋リーダー画像の上部レイヤーはリーダーごとにメモ化したものを貼る
+    try:
+        leader_record = card_lookup.get(leader['カードID'])
+        leader_url = resolve_image_url(leader['カードID'], leader_record['画像URL'] if leader_record is not None else None)
+        header = render_deck_header(
+            tuple(leader_colors), leader['カードID'], leader_url, 
+            FINAL_WIDTH, UPPER_HEIGHT, (leader_x, leader_y), LEADER_TARGET_SIZE, thumbnail_store
+        )
+        img.paste(header, (0, 0))
+    except:
+        pass
+
+    # 3. QRコードを配置 
+    img.paste(qr_img, (qr_x, qr_y), qr_img)
+    
+    # 2. デッキ名（中央）
+    # 💡 修正: フォントとプレートはメモ化し、合成はプレートの範囲だけで行う（キャンバス全体の重ね合わせをやめる）
+    if deck_name:
+        try:
+            draw_name_plate(img, deck_name, deck_name_area_start_x, DECK_NAME_AREA_WIDTH, UPPER_HEIGHT)
+        except Exception as e:
+            # 描画中にエラーが発生した場合の最終手段（最終フォールバック）
+            try:
+                # デフォルトフォントで再描画を試みる（このfont_nameは小さいが、表示はされる）
+                draw_name_plate(img, deck_name, deck_name_area_start_x, DECK_NAME_AREA_WIDTH, UPPER_HEIGHT, use_default_font=True)
+            except:
+                pass # 完全に失敗した場合は何もしない
+    
+    # 下セクション：デッキカード（10x5グリッド）
+    y_start = UPPER_HEIGHT 
+    x_start = (FINAL_WIDTH - (card_width * cards_per_row + margin_card * (cards_per_row - 1))) // 2
+    
+    all_deck_cards = []
+    for card_id, count in deck_cards_sorted:
+        all_deck_cards.extend([card_id] * count)
+    
+    card_images = {}
+    cards_to_download = list(dict.fromkeys(all_deck_cards[:cards_per_row * cards_per_col]))
+    
+    # 💡 修正: 共有セッション + スレッドプールで並列ダウンロード（同時実行数は最大8）
+    # Pyodide/Streamlit Cloudなどスレッドが使えない環境では従来通り逐次ダウンロードになる
+    downloaded = run_concurrently(
+        lambda card_id: download_card_image(card_id, card_lookup, (card_width, card_height), False, thumbnail_store),
+        cards_to_download,
+    )
+    for card_id, card_img in downloaded:
+        if card_img:
+            card_images[card_id] = card_img
+    
+    for idx, card_id in enumerate(all_deck_cards):
+        if idx >= cards_per_row * cards_per_col:
+            break
+        
+        row = idx // cards_per_row
+        col = idx % cards_per_row
+        
+        x = x_start + col * (card_width + margin_card)
+        y = y_start + row * (card_height + margin_card)
+        
+        if card_id in card_images:
+            img.paste(card_images[card_id], (x, y), card_images[card_id])
+    
+    return img.convert('RGB')
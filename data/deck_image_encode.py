@@ -0,0 +1,151 @@
+"""デッキ画像（PIL の画像）をダウンロード用のバイト列にする
+
+    encoded = encode_image(img, "jpeg", quality=85)
+    encoded = encode_image(img, "budget", max_bytes=1_000_000) # 1MB 以内に収める
+    open("deck" + encoded.extension, "wb").write(encoded.data)
+
+2150x2048 のデッキ画像はカード画像（写真に近い絵）が大半を占めるため、PNG では数MB・1秒近くかかる。
+JPEG / WebP は数分の1の大きさで、JPEG は PNG の10倍以上速い。
+"budget" はサイズの上限に収まる最も高い画質を探し（足りなければ縮小する）、モバイル向けに使う。
+Streamlit に依存しない純粋なモジュール。
+"""
+from collections import namedtuple
+from io import BytesIO
+
+from PIL import Image
+
+# 出力形式: (表示名, 画質を指定できるか)。並びは選択肢の順
+OUTPUT_FORMATS = {
+    "png": ("PNG（劣化なし）", False),
+    "jpeg": ("JPEG", True),
+    "webp": ("WebP", True),
+    "budget": ("サイズ上限を指定", False),
+}
+DEFAULT_FORMAT = "png"
+
+# PNG の圧縮レベル: 写真の多い画像では 1〜3 にしてもほとんど速くならず、単色の背景の分だけ大きくなる。
+# optimize（レベル9＋フィルタの探索）は1割以上遅く、小さくなるのは数%なので使わない
+PNG_COMPRESS_LEVEL = 6
+
+DEFAULT_QUALITY = {"jpeg": 85, "webp": 80}
+# WebP の method（0〜6。大きいほど遅く小さい）。既定の 4 は 2 の倍近くかかり、数%しか小さくならない
+WEBP_METHOD = 2
+
+# "budget" の既定の上限と、画質を下げる下限（これでも収まらなければ縮小する）
+DEFAULT_MAX_BYTES = 1_000_000
+BUDGET_FORMAT = "jpeg"
+BUDGET_MIN_QUALITY = 50
+# 画質の二分探索の回数の上限（JPEG 1回は 0.1秒弱）
+BUDGET_MAX_STEPS = 5
+# 縮小の下限（元の幅に対する割合）。これより小さくするとQRコード（元は400px）が読み取りにくくなる
+BUDGET_MIN_SCALE = 0.5
+
+# 画面に表示するプレビューの幅（サイドバーは 300px 前後なので、高密度の画面でも足りる幅）
+PREVIEW_WIDTH = 720
+PREVIEW_QUALITY = 80
+
+_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+_EXTENSIONS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp"}
+
+# data: 画像ファイルのバイト列、format: "PNG" / "JPEG" / "WEBP"、quality: JPEG / WebP の画質（PNG は None）
+# size: (幅, 高さ)。"budget" で縮小した場合は元の画像より小さい
+EncodedImage = namedtuple("EncodedImage", ["data", "format", "mime_type", "extension", "quality", "size"])
+
+
+def _to_rgb(img):
+    # デッキ画像は不透明なので、アルファは捨てる（JPEG は RGBA を保存できず、PNG / WebP も小さくなる）
+    if img.mode == "RGB":
+        return img
+    if img.mode in ("RGBA", "LA", "P"):
+        return img.convert("RGBA").convert("RGB")
+    return img.convert("RGB")
+
+
+def _save(img, pil_format, quality=None):
+    buf = BytesIO()
+    if pil_format == "PNG":
+        img.save(buf, format="PNG", compress_level=PNG_COMPRESS_LEVEL)
+    elif pil_format == "JPEG":
+        # optimize（ハフマン表の最適化）は数十ms で1〜4割小さくなる。プログレッシブは倍以上遅いので使わない
+        img.save(buf, format="JPEG", quality=quality, optimize=True)
+    else:
+        img.save(buf, format="WEBP", quality=quality, method=WEBP_METHOD)
+    data = buf.getvalue()
+    return EncodedImage(data, pil_format, _MIME_TYPES[pil_format], _EXTENSIONS[pil_format], quality, img.size)
+
+
+def encode_image(img, output_format=DEFAULT_FORMAT, quality=None, max_bytes=None):
+    """画像をファイルのバイト列 (EncodedImage) にする
+
+    - output_format: "png" / "jpeg" / "webp" / "budget"（OUTPUT_FORMATS のキー）
+    - quality: JPEG / WebP の画質（1〜100。省略時は DEFAULT_QUALITY）
+    - max_bytes: "budget" のサイズ上限（省略時は DEFAULT_MAX_BYTES）。"budget" 以外では無視する
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"未対応の出力形式です: {output_format}")
+    img = _to_rgb(img)
+    if output_format == "budget":
+        return encode_within(img, max_bytes or DEFAULT_MAX_BYTES, quality=quality)
+    if output_format == "png":
+        return _save(img, "PNG")
+    pil_format = output_format.upper()
+    return _save(img, pil_format, quality or DEFAULT_QUALITY[output_format])
+
+
+def encode_within(img, max_bytes, output_format=BUDGET_FORMAT, quality=None):
+    """max_bytes 以内に収まる最も高い画質で JPEG / WebP にする
+
+    画質 quality（省略時は DEFAULT_QUALITY）で収まればそのまま、収まらなければ BUDGET_MIN_QUALITY までの
+    二分探索で画質を下げる。下限でも収まらなければ、大きさの比から縮小率を見積もって縮小する。
+    縮小の下限でも収まらない場合は、最も小さかったものを返す（上限を超えることがある）。
+    """
+    img = _to_rgb(img)
+    pil_format = output_format.upper()
+    high = quality or DEFAULT_QUALITY[output_format]
+    encoded = _save(img, pil_format, high)
+    if len(encoded.data) <= max_bytes:
+        return encoded
+
+    low = min(BUDGET_MIN_QUALITY, high)
+    smallest = _save(img, pil_format, low)
+    if len(smallest.data) <= max_bytes:
+        # 収まる画質 low と収まらない画質 high の間を探す
+        best = smallest
+        for _ in range(BUDGET_MAX_STEPS):
+            if high - low <= 1:
+                break
+            mid = (low + high) // 2
+            encoded = _save(img, pil_format, mid)
+            if len(encoded.data) <= max_bytes:
+                best, low = encoded, mid
+            else:
+                high = mid
+        return best
+
+    # 画質の下限でも収まらない: バイト数はおおよそ画素数に比例するので、面積の比で縮小する
+    width, height = img.size
+    scale = 1.0
+    while scale > BUDGET_MIN_SCALE:
+        scale = max(BUDGET_MIN_SCALE, scale * (max_bytes / len(smallest.data)) ** 0.5 * 0.95)
+        resized = img.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.LANCZOS)
+        encoded = _save(resized, pil_format, low)
+        if len(encoded.data) < len(smallest.data):
+            smallest = encoded
+        if len(encoded.data) <= max_bytes:
+            break
+    return smallest
+
+
+def encode_preview(img, width=PREVIEW_WIDTH):
+    """画面表示用に縮小した JPEG（ダウンロード用のフル解像度の画像を毎回ブラウザに送らない）"""
+    img = _to_rgb(img)
+    if img.width > width:
+        img = img.resize((width, round(img.height * width / img.width)), Image.LANCZOS)
+    return _save(img, "JPEG", PREVIEW_QUALITY)
+
+
+def format_size(num_bytes):
+    """"1.23 MB" / "456 KB" の形の表示用の文字列"""
+    if num_bytes >= 1_000_000:
+        return f"{num_bytes / 1_000_000:.2f} MB"
+    return f"{max(1, round(num_bytes / 1000))} KB"
@@ -0,0 +1,137 @@
+"""アップロードされた画像からのQRコードの読み取り
+
+スマートフォンの写真（1200万画素以上）をそのまま cv2.QRCodeDetector に渡すと数秒かかり、失敗することもある。
+ここでは次の順に、安いものから試す。
+
+1. グレースケールで読み込み、長辺 QR_FAST_MAX_SIDE に縮小して detectAndDecodeMulti（複数のQRコードも一度に読む）
+2. 位置は見つかったが読めなかったQRコードは、元の解像度からその周辺（ROI）を切り出して読み直す
+3. 何も見つからない（か読めないものが残った）場合は、長辺 QR_TILE_MAX_SIDE の画像を重なりのあるタイルに分けて
+   1〜2 と同じように探す
+4. それでも何も読めなければ、元の解像度のまま読む
+
+Streamlit に依存しない純粋なモジュール（結果のキャッシュは呼び出し側で行う）。
+"""
+import cv2
+import numpy as np
+
+# 最初に試す縮小画像の長辺
+QR_FAST_MAX_SIDE = 1280
+
+# ROI を読み直すときの切り出し画像の長辺（QRコードの周辺に余白 QR_ROI_MARGIN を付けて切り出す）
+QR_ROI_SIDE = 800
+QR_ROI_MARGIN = 0.15
+
+# タイル探索に使う画像の長辺と、分割数（縦横）のリスト。タイルは縦横とも QR_TILE_OVERLAP の割合で重ねる
+QR_TILE_MAX_SIDE = 2048
+QR_TILE_GRIDS = [2, 3]
+QR_TILE_OVERLAP = 0.25
+
+
+def create_detector():
+    """QRコードの検出器を返す。OpenCV 4.8 以降の QRCodeDetectorAruco は縮小画像でも位置を見つけやすいので優先する"""
+    if hasattr(cv2, "QRCodeDetectorAruco"):
+        return cv2.QRCodeDetectorAruco()
+    return cv2.QRCodeDetector()
+
+
+def load_grayscale(data):
+    """画像ファイルのバイト列をグレースケールの配列にする。画像として読めなければ None"""
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def fit_within(img, max_side):
+    """長辺が max_side を超える場合だけ縮小し、(画像, 縮小率) を返す"""
+    height, width = img.shape[:2]
+    scale = min(1.0, max_side / max(height, width))
+    if scale == 1.0:
+        return img, 1.0
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(img, size, interpolation=cv2.INTER_AREA), scale
+
+
+def _detect_multi(detector, img):
+    """detectAndDecodeMulti の結果を [(文字列, 4隅の座標 or None)] にする（読めなかったものは文字列が ""）"""
+    try:
+        ok, texts, points, _ = detector.detectAndDecodeMulti(img)
+    except cv2.error:
+        return []
+    if not ok:
+        return []
+    if points is None:
+        points = [None] * len(texts)
+    return list(zip(texts, points))
+
+
+def _decode_roi(detector, gray, corners):
+    """元の解像度の画像から corners の周辺を切り出して読み直す。読めなければ ""（cv2 のエラーも同様）"""
+    height, width = gray.shape[:2]
+    x1, y1 = corners.min(axis=0)
+    x2, y2 = corners.max(axis=0)
+    margin = max(x2 - x1, y2 - y1) * QR_ROI_MARGIN
+    x1, y1 = max(0, int(x1 - margin)), max(0, int(y1 - margin))
+    x2, y2 = min(width, int(x2 + margin) + 1), min(height, int(y2 + margin) + 1)
+    if x2 <= x1 or y2 <= y1:
+        return ""
+    roi, _ = fit_within(gray[y1:y2, x1:x2], QR_ROI_SIDE)
+    try:
+        text, _, _ = detector.detectAndDecode(roi)
+    except cv2.error:
+        return ""
+    return text or ""
+
+
+def _iter_tiles(img, grid):
+    """img を grid x grid の重なりのあるタイルに分け、(タイル, 左上のx, 左上のy) を順に返す"""
+    height, width = img.shape[:2]
+    tile_h = int(height / (grid - (grid - 1) * QR_TILE_OVERLAP))
+    tile_w = int(width / (grid - (grid - 1) * QR_TILE_OVERLAP))
+    for row in range(grid):
+        for col in range(grid):
+            # 最後のタイルが画像の端にそろうように位置を割り振る（切り捨てで端の数ピクセルが漏れないように）
+            x = (width - tile_w) * col // (grid - 1)
+            y = (height - tile_h) * row // (grid - 1)
+            yield img[y:y + tile_h, x:x + tile_w], x, y
+
+
+def decode_qr_codes(gray, detector=None):
+    """グレースケール画像に写っているQRコードをすべて読み、文字列のリストを返す（重複は除き、見つけた順）"""
+    detector = detector if detector is not None else create_detector()
+    found = []
+
+    def scan(img, scale, offset=(0, 0)):
+        """img（元画像を scale 倍したもの、またはその offset からの一部）を読む。位置だけ分かって読めなかった数を返す"""
+        unread = 0
+        for text, corners in _detect_multi(detector, img):
+            if not text and corners is not None:
+                # 2. 位置だけ分かったものは元の解像度で読み直す
+                text = _decode_roi(detector, gray, (np.asarray(corners, dtype=np.float32) + offset) / scale)
+            if not text:
+                unread += 1
+            elif text not in found:
+                found.append(text)
+        return unread
+
+    # 1. 縮小画像でまとめて検出・デコード
+    small, scale = fit_within(gray, QR_FAST_MAX_SIDE)
+    if scan(small, scale) == 0 and found:
+        return found
+
+    # 3. タイルに分けて探す（写真の一部に小さく写っている場合）
+    medium, scale = fit_within(gray, QR_TILE_MAX_SIDE)
+    for grid in QR_TILE_GRIDS:
+        unread = sum(scan(tile, scale, (x, y)) for tile, x, y in _iter_tiles(medium, grid))
+        if unread == 0 and found:
+            return found
+
+    # 4. 最後の手段として元の解像度のまま読む（遅いが、細かいQRコードが小さく写っている場合に読めることがある）
+    if not found and scale < 1.0:
+        scan(gray, 1.0)
+    return found
+
+
+def decode_qr_image(data):
+    """画像ファイルのバイト列からQRコードをすべて読み、文字列のリストを返す。画像として読めなければ ValueError"""
+    gray = load_grayscale(data)
+    if gray is None:
+        raise ValueError("画像を読み込めませんでした。")
+    return decode_qr_codes(gray)
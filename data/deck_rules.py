@@ -0,0 +1,301 @@
+"""デッキの構築ルール（レギュレーション）とデッキの検証
+
+ルールはレギュレーション表 (regulations.json) にフォーマットごとに書く。
+
+- deck_size: デッキの枚数（リーダーを除く）
+- max_copies: 同じカードIDを入れられる枚数
+- unlimited: 枚数制限のないカードID
+- restricted: {カードID: 枚数} の制限カード（リストで書くと 1枚）
+- banned: 禁止カードID
+
+DeckValidator はカードごとの上限・色・種類を配列にしておき、デッキの束を (デッキ番号, カード番号, 枚数) の
+疎な枚数行列として一度にまとめて検証する（デッキごと・カードごとの Python のループなし）。
+禁止・制限カードを変更したときは `python deck_rules.py` で保存済みの全デッキを検証し直せる。
+Streamlit に依存しない純粋なモジュール。
+"""
+import argparse
+import json
+import os
+import sys
+import weakref
+from collections import namedtuple
+
+import numpy as np
+
+from card_index import INDEXED_COLORS
+
+# レギュレーション表（アプリの作業ディレクトリからの相対パス）
+REGULATION_PATH = "regulations.json"
+
+# レギュレーション表が無い場合のルール（これまでアプリに書かれていたもの）
+DEFAULT_REGULATIONS = {
+    "default": "standard",
+    "formats": {
+        "standard": {
+            "label": "スタンダード",
+            "deck_size": 50,
+            "max_copies": 4,
+            "unlimited": ["OP01-075", "OP08-072"],
+            "restricted": {},
+            "banned": [],
+        },
+    },
+}
+
+# 違反の種類
+BANNED = "banned"
+RESTRICTED = "restricted"
+TOO_MANY_COPIES = "too_many_copies"
+DECK_SIZE = "deck_size"
+COLOR_MISMATCH = "color_mismatch"
+LEADER_IN_DECK = "leader_in_deck"
+UNKNOWN_CARD = "unknown_card"
+INVALID_LEADER = "invalid_leader"
+
+# 違反1件分。card_id はデッキ全体の違反（枚数・リーダー）では None（INVALID_LEADER はリーダーのID）、
+# count と limit は枚数の違反のときの現在の枚数と上限（それ以外は None）
+Violation = namedtuple("Violation", ["code", "card_id", "count", "limit", "message"])
+
+
+class Regulation(namedtuple("Regulation", ["format_id", "label", "deck_size", "max_copies", "unlimited", "restricted", "banned"])):
+    """1フォーマット分のルール。restricted は ((カードID, 枚数), ...)（ハッシュできるようにタプルで持つ）"""
+    __slots__ = ()
+
+    @classmethod
+    def from_dict(cls, format_id, data):
+        restricted = data.get("restricted") or {}
+        if isinstance(restricted, list):
+            restricted = {card_id: 1 for card_id in restricted}
+        return cls(
+            format_id, data.get("label", format_id), int(data.get("deck_size", 50)), int(data.get("max_copies", 4)),
+            frozenset(data.get("unlimited", ())), tuple(sorted((k, int(v)) for k, v in restricted.items())),
+            frozenset(data.get("banned", ())),
+        )
+
+    def copy_limit(self, card_id):
+        """そのカードを入れられる枚数。制限がなければ None"""
+        if card_id in self.banned:
+            return 0
+        for restricted_id, limit in self.restricted:
+            if restricted_id == card_id:
+                return limit
+        if card_id in self.unlimited:
+            return None
+        return self.max_copies
+
+
+class RegulationTable:
+    """フォーマット ID → Regulation。signature はファイルの (mtime, サイズ)（ファイルが無い場合は None）"""
+
+    def __init__(self, data, signature=None):
+        self.formats = {format_id: Regulation.from_dict(format_id, f) for format_id, f in data["formats"].items()}
+        self.default = data.get("default") or next(iter(self.formats))
+        self.signature = signature
+
+    @classmethod
+    def load(cls, path=REGULATION_PATH):
+        """レギュレーション表を読み込む。ファイルが無ければ DEFAULT_REGULATIONS"""
+        try:
+            st = os.stat(path)
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return cls(DEFAULT_REGULATIONS)
+        return cls(data, (st.st_mtime_ns, st.st_size))
+
+    def get(self, format_id=None):
+        """フォーマットのルール（省略時は既定のフォーマット）。無ければ KeyError"""
+        return self.formats[format_id or self.default]
+
+
+_regulation_table = None
+
+
+def get_regulation_table(path=REGULATION_PATH):
+    """既定のレギュレーション表。ファイルが更新されていれば読み直す（禁止カードの変更を再起動なしで反映する）"""
+    global _regulation_table
+    try:
+        st = os.stat(path)
+        signature = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        signature = None
+    if _regulation_table is None or _regulation_table.signature != signature:
+        _regulation_table = RegulationTable.load(path)
+    return _regulation_table
+
+
+# 上限の種類（違反の種類を決めるのに使う）
+_KIND_NORMAL, _KIND_RESTRICTED, _KIND_BANNED = 0, 1, 2
+
+
+class DeckValidator:
+    """1つのレギュレーションで、カードテーブルのカードからなるデッキを検証する
+
+    カード番号ごとに 上限枚数（制限なしは inf）/ 上限の種類 / 色のビット / リーダーかどうか の配列を持つ。
+    """
+
+    def __init__(self, regulation, card_lookup):
+        self.regulation = regulation
+        records = card_lookup.preferred
+        self.card_ids = list(records)
+        self.card_codes = {card_id: code for code, card_id in enumerate(self.card_ids)}
+        n = len(self.card_ids)
+
+        self.limits = np.full(n, float(regulation.max_copies))
+        self.kinds = np.full(n, _KIND_NORMAL, dtype=np.int8)
+        for card_id in regulation.unlimited:
+            if card_id in self.card_codes:
+                self.limits[self.card_codes[card_id]] = np.inf
+        for card_id, limit in regulation.restricted:
+            if card_id in self.card_codes:
+                self.limits[self.card_codes[card_id]] = limit
+                self.kinds[self.card_codes[card_id]] = _KIND_RESTRICTED
+        for card_id in regulation.banned:
+            if card_id in self.card_codes:
+                self.limits[self.card_codes[card_id]] = 0
+                self.kinds[self.card_codes[card_id]] = _KIND_BANNED
+
+        self.color_bits = np.array([self._color_bits(records[card_id]["色"]) for card_id in self.card_ids], dtype=np.int32)
+        self.is_leader = np.array([records[card_id]["タイプ"] == "LEADER" for card_id in self.card_ids], dtype=bool)
+
+    @staticmethod
+    def _color_bits(colors):
+        # "赤/緑" → 赤と緑のビット。検索の色フィルタと同じく部分一致で判定する
+        colors = str(colors)
+        return sum(1 << bit for bit, color in enumerate(INDEXED_COLORS) if color in colors)
+
+    def validate(self, leader_id, cards):
+        """1デッキ（リーダーID, {カードID: 枚数}）の違反のリストを返す（空ならルールどおり）"""
+        return self.validate_many([(leader_id, cards)])[0]
+
+    def validate_many(self, decks):
+        """デッキ（DeckList または (リーダーID, {カードID: 枚数})）の束を検証し、デッキごとの違反のリストを返す
+
+        枚数行列を作るところ以外はすべて配列演算で、違反のあったデッキ・カードだけ Violation を作る。
+        """
+        leader_ids, lengths, card_ids, counts = [], [], [], []
+        for deck in decks:
+            leader_id, cards = (deck.leader_id, deck.cards) if hasattr(deck, "cards") else deck
+            leader_ids.append(leader_id)
+            lengths.append(len(cards))
+            card_ids.extend(cards)
+            counts.extend(cards.values())
+        n = len(leader_ids)
+        card_codes = self.card_codes
+        codes = np.fromiter(map(card_codes.get, card_ids, [-1] * len(card_ids)), dtype=np.int64, count=len(card_ids))
+        rows = np.repeat(np.arange(n, dtype=np.int64), lengths)
+        counts = np.array(counts, dtype=np.int64)
+        present = counts > 0
+        # カードテーブルに無いカード（違反として報告し、枚数の合計には含める）
+        unknown = [(int(rows[i]), card_ids[i], int(counts[i])) for i in np.flatnonzero(present & (codes < 0))]
+        keep = present & (codes >= 0)
+        rows, cols, counts = rows[keep], codes[keep], counts[keep]
+        violations = [[] for _ in range(n)]
+        regulation = self.regulation
+
+        # リーダー: カードテーブルにあるリーダーカードか。不正なリーダーのデッキは色を判定しない
+        leader_codes = np.array([card_codes.get(leader_id, -1) for leader_id in leader_ids], dtype=np.int64)
+        known = leader_codes >= 0
+        valid_leader = known.copy()
+        valid_leader[known] = self.is_leader[leader_codes[known]]
+        leader_bits = np.zeros(n, dtype=np.int32)
+        leader_bits[valid_leader] = self.color_bits[leader_codes[valid_leader]]
+        for row in np.flatnonzero(~valid_leader):
+            leader_id = leader_ids[row]
+            message = (f"{leader_id} はリーダーカードではありません。" if known[row]
+                       else f"リーダーカード {leader_id} が見つかりません。")
+            violations[row].append(Violation(INVALID_LEADER, leader_id, None, None, message))
+        banned_leader = valid_leader.copy()
+        banned_leader[valid_leader] = self.kinds[leader_codes[valid_leader]] == _KIND_BANNED
+        for row in np.flatnonzero(banned_leader):
+            leader_id = leader_ids[row]
+            violations[row].append(Violation(BANNED, leader_id, 1, 0, f"{leader_id} は禁止カードです。"))
+
+        # 枚数の上限（禁止・制限・同名カードの上限）
+        limits = self.limits[cols]
+        for i in np.flatnonzero(counts > limits):
+            row, code, count = int(rows[i]), int(cols[i]), int(counts[i])
+            card_id, kind, limit = self.card_ids[code], self.kinds[code], int(limits[i])
+            if kind == _KIND_BANNED:
+                violations[row].append(Violation(BANNED, card_id, count, 0, f"{card_id} は禁止カードです。"))
+            elif kind == _KIND_RESTRICTED:
+                violations[row].append(Violation(
+                    RESTRICTED, card_id, count, limit, f"{card_id} は制限カードです（{limit}枚まで、現在 {count}枚）。"
+                ))
+            else:
+                violations[row].append(Violation(
+                    TOO_MANY_COPIES, card_id, count, limit, f"{card_id} は {limit}枚までです（現在 {count}枚）。"
+                ))
+
+        # デッキに入れられないカード（リーダーカード、リーダーと色が1つも重ならないカード）
+        for i in np.flatnonzero(self.is_leader[cols]):
+            card_id = self.card_ids[cols[i]]
+            violations[rows[i]].append(Violation(
+                LEADER_IN_DECK, card_id, None, None, f"{card_id} はリーダーカードなのでデッキに入れられません。"
+            ))
+        for i in np.flatnonzero(((self.color_bits[cols] & leader_bits[rows]) == 0) & valid_leader[rows]):
+            card_id = self.card_ids[cols[i]]
+            violations[rows[i]].append(Violation(
+                COLOR_MISMATCH, card_id, None, None, f"{card_id} はリーダーの色を含まないカードです。"
+            ))
+        for row, card_id, count in unknown:
+            violations[row].append(Violation(UNKNOWN_CARD, card_id, count, None, f"カード {card_id} が見つかりません。"))
+
+        # デッキの枚数（カードテーブルに無いカードも数える）
+        totals = np.bincount(rows, weights=counts, minlength=n).astype(np.int64)
+        for row, card_id, count in unknown:
+            totals[row] += count
+        for row in np.flatnonzero(totals != regulation.deck_size):
+            total = int(totals[row])
+            violations[row].append(Violation(
+                DECK_SIZE, None, total, regulation.deck_size,
+                f"デッキは {regulation.deck_size}枚ちょうどにしてください（現在 {total}枚）。"
+            ))
+        return violations
+
+
+# カードテーブル（CardLookup）ごとに、レギュレーション → DeckValidator を覚えておく
+_validators = weakref.WeakKeyDictionary()
+
+
+def get_validator(regulation, card_lookup):
+    """レギュレーションとカードテーブルの DeckValidator（同じ組み合わせでは作り直さない）"""
+    by_regulation = _validators.setdefault(card_lookup, {})
+    validator = by_regulation.get(regulation)
+    if validator is None:
+        validator = by_regulation[regulation] = DeckValidator(regulation, card_lookup)
+    return validator
+
+
+def main(argv=None):
+    """デッキストアの全デッキを検証し、ルールに合わないデッキと違反を表示する"""
+    from deck_engine import DeckEngine
+
+    table = get_regulation_table()
+    parser = argparse.ArgumentParser(description="保存済みデッキがレギュレーションに合っているか検証します。")
+    parser.add_argument("--format", choices=sorted(table.formats), default=table.default, help="フォーマット")
+    parser.add_argument("--include-size", action="store_true", help="枚数が足りない・多いだけのデッキも表示する")
+    args = parser.parse_args(argv)
+
+    engine = DeckEngine()
+    if engine.card_index is None:
+        print("カードリストのCSVが見つかりません。data/ ディレクトリで実行してください。", file=sys.stderr)
+        return 1
+    decks = list(engine.deck_store.load_all())
+    results = engine.validate_many(decks, args.format)
+
+    illegal = 0
+    for deck, violations in zip(decks, results):
+        if not args.include_size:
+            violations = [v for v in violations if v.code != DECK_SIZE]
+        if violations:
+            illegal += 1
+            print(f"# {deck.name} ({deck.leader_id})")
+            for violation in violations:
+                print(f"  - {violation.message}")
+    print(f"{len(decks)} 個のデッキのうち {illegal} 個がレギュレーション「{table.get(args.format).label}」に合っていません。")
+    return 1 if illegal else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
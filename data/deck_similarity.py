@@ -0,0 +1,188 @@
+"""保存済みデッキの類似検索・リーダーごとの採用カード集計
+
+デッキ x カードの枚数行列を疎行列（カードごとの転置リスト）として NumPy 配列で持ち、
+
+- similar: 指定したデッキに似たデッキの上位 k 件（コサイン類似度 / 枚数を考慮した Jaccard 係数）
+- common_cards: そのリーダーのデッキでよく採用されているカード
+
+を、デッキごとのループなしで np.bincount だけで求める。
+入力はデッキストアやインポートで作られる DeckList（{カードID: 枚数}）で、Streamlit に依存しない純粋なモジュール。
+`python deck_similarity.py` で、デッキストアの全デッキについてオフラインで集計できる。
+"""
+import argparse
+import sys
+from collections import namedtuple
+
+import numpy as np
+
+COSINE = "cosine"
+JACCARD = "jaccard"
+
+# similar の結果。score は 0〜1
+SimilarDeck = namedtuple("SimilarDeck", ["name", "leader_id", "score"])
+# common_cards の結果。deck_share はそのリーダーのデッキのうち採用している割合、avg_count は採用デッキでの平均枚数
+CommonCard = namedtuple("CommonCard", ["card_id", "deck_share", "avg_count"])
+
+
+class DeckIndex:
+    """保存済みデッキの枚数行列（デッキ x カード）
+
+    内部では (デッキ番号, カード番号, 枚数) の非ゼロ要素を、カード番号順（転置リスト）で持つ。
+    """
+
+    def __init__(self, decks):
+        names, leader_ids = [], []
+        rows, cols, counts = [], [], []
+        card_codes = {}
+        for deck in decks:
+            row = len(names)
+            names.append(deck.name)
+            leader_ids.append(deck.leader_id)
+            for card_id, count in deck.cards.items():
+                if count > 0:
+                    rows.append(row)
+                    cols.append(card_codes.setdefault(card_id, len(card_codes)))
+                    counts.append(count)
+
+        self.names = names
+        self.rows_by_name = {name: row for row, name in enumerate(names)}
+        self.leader_ids = leader_ids
+        self.card_ids = list(card_codes)
+        self.card_codes = card_codes
+        leader_codes = {}
+        self.leader_codes = leader_codes
+        self.deck_leaders = np.array([leader_codes.setdefault(l, len(leader_codes)) for l in leader_ids], dtype=np.int32)
+
+        rows = np.array(rows, dtype=np.int32)
+        cols = np.array(cols, dtype=np.int32)
+        counts = np.array(counts, dtype=np.float64)
+        order = np.argsort(cols, kind="stable")
+        self.post_rows = rows[order]
+        self.post_cols = cols[order]
+        self.post_counts = counts[order]
+        # カード番号 c の転置リストは post_rows[card_ptr[c]:card_ptr[c + 1]]
+        self.card_ptr = np.zeros(len(self.card_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cols, minlength=len(self.card_ids)), out=self.card_ptr[1:])
+
+        n = len(names)
+        self.norms = np.sqrt(np.bincount(rows, weights=counts * counts, minlength=n))
+        self.totals = np.bincount(rows, weights=counts, minlength=n)
+        self.post_leaders = self.deck_leaders[self.post_rows] if n else np.zeros(0, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_store(cls, store):
+        """デッキストアの全デッキから作る"""
+        return cls(store.load_all())
+
+    def _gather(self, cards):
+        """cards のうち索引にあるカードの転置リストを連結し、(デッキ番号, 枚数, クエリ側の枚数) を返す"""
+        slices, query_counts = [], []
+        for card_id, count in cards.items():
+            code = self.card_codes.get(card_id)
+            if code is None or count <= 0:
+                continue
+            start, stop = self.card_ptr[code], self.card_ptr[code + 1]
+            slices.append(np.arange(start, stop))
+            query_counts.append(np.full(stop - start, count, dtype=np.float64))
+        if not slices:
+            empty = np.zeros(0)
+            return empty.astype(np.int32), empty, empty
+        positions = np.concatenate(slices)
+        return self.post_rows[positions], self.post_counts[positions], np.concatenate(query_counts)
+
+    def scores(self, cards, metric=COSINE):
+        """cards（{カードID: 枚数}）と各デッキの類似度の配列（デッキ番号順）"""
+        n = len(self.names)
+        rows, counts, query_counts = self._gather(cards)
+        query = np.array([c for c in cards.values() if c > 0], dtype=np.float64)
+        if metric == COSINE:
+            dot = np.bincount(rows, weights=counts * query_counts, minlength=n)
+            denom = self.norms * np.sqrt((query * query).sum())
+        elif metric == JACCARD:
+            # 枚数を考慮した Jaccard 係数: Σmin(a, b) / Σmax(a, b)（Σmax = Σa + Σb - Σmin）
+            dot = np.bincount(rows, weights=np.minimum(counts, query_counts), minlength=n)
+            denom = self.totals + query.sum() - dot
+        else:
+            raise ValueError(f"不明な類似度です: {metric}")
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(denom > 0, dot / denom, 0.0)
+
+    def similar(self, cards, k=10, metric=COSINE, leader_id=None, exclude=None):
+        """cards に似たデッキを類似度の高い順に最大 k 件返す（類似度 0 のデッキは含めない）
+
+        leader_id を指定するとそのリーダーのデッキだけ、exclude（デッキ名）はそのデッキを除く。
+        """
+        scores = self.scores(cards, metric)
+        if leader_id is not None:
+            code = self.leader_codes.get(leader_id)
+            scores = np.where(self.deck_leaders == code, scores, 0.0) if code is not None else np.zeros_like(scores)
+        if exclude in self.rows_by_name:
+            scores[self.rows_by_name[exclude]] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            # k 番目と同点のデッキも残してから並べる（同点はデッキ番号順で、切り捨てる側を一定にする）
+            kth = np.partition(-scores[candidates], k - 1)[k - 1]
+            candidates = candidates[-scores[candidates] <= kth]
+        candidates = candidates[np.lexsort((candidates, -scores[candidates]))][:k]
+        return [SimilarDeck(self.names[i], self.leader_ids[i], float(scores[i])) for i in candidates]
+
+    def common_cards(self, leader_id, k=20):
+        """そのリーダーのデッキで採用率の高いカードを最大 k 件返す（採用率 → 平均枚数 → カードIDの順）"""
+        code = self.leader_codes.get(leader_id)
+        if code is None:
+            return []
+        n_decks = int((self.deck_leaders == code).sum())
+        mask = self.post_leaders == code
+        card_codes = self.post_cols[mask]
+        decks_using = np.bincount(card_codes, minlength=len(self.card_ids))
+        copies = np.bincount(card_codes, weights=self.post_counts[mask], minlength=len(self.card_ids))
+        used = np.flatnonzero(decks_using)
+        avg = copies[used] / decks_using[used]
+        order = sorted(range(len(used)), key=lambda i: (-decks_using[used[i]], -avg[i], self.card_ids[used[i]]))[:k]
+        return [
+            CommonCard(self.card_ids[used[i]], decks_using[used[i]] / n_decks, float(avg[i]))
+            for i in order
+        ]
+
+
+def main(argv=None):
+    """デッキストアの全デッキについて、似ているデッキ・リーダーごとの採用カードを表示する"""
+    from deck_store import open_deck_store
+
+    parser = argparse.ArgumentParser(description="保存済みデッキの類似デッキ・採用カードを集計します。")
+    parser.add_argument("--similar", metavar="デッキ名", help="このデッキに似たデッキを表示する")
+    parser.add_argument("--leader", metavar="カードID", help="このリーダーのデッキでよく使われるカードを表示する")
+    parser.add_argument("--metric", choices=[COSINE, JACCARD], default=COSINE)
+    parser.add_argument("-k", type=int, default=10, help="表示する件数")
+    args = parser.parse_args(argv)
+
+    store = open_deck_store()
+    index = DeckIndex.from_store(store)
+    print(f"{len(index)} 個のデッキ、{len(index.card_ids)} 種類のカード")
+
+    if args.similar:
+        deck = store.load(args.similar)
+        if deck is None:
+            print(f"デッキ「{args.similar}」が見つかりません。", file=sys.stderr)
+            return 1
+        for result in index.similar(deck.cards, args.k, args.metric, exclude=deck.name):
+            print(f"{result.score:6.3f}  {result.name}  ({result.leader_id})")
+    # --similar だけを指定した場合は採用カードを表示しない。どちらも無ければ全リーダー分を表示する
+    if args.leader:
+        leaders = [args.leader]
+    elif args.similar:
+        leaders = []
+    else:
+        leaders = sorted(index.leader_codes)
+    for leader_id in leaders:
+        print(f"\n# {leader_id}")
+        for card in index.common_cards(leader_id, args.k):
+            print(f"{card.deck_share:6.1%}  {card.avg_count:4.2f}枚  {card.card_id}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+"""保存済みデッキのストレージ（SQLite が既定、従来の saved_decks/<デッキ名>.txt も使える）
+
+どちらも同じインターフェイス（list_decks / load / load_all / save / delete / fingerprint）を持つ。
+
+- SQLiteDeckStore: デッキ名・リーダー・色・更新日時に索引を張ったテーブルに保存する。一覧や絞り込みは
+  インデックスを引くだけで、読み込みもテキストの解析なしでカードの行を取り出すだけで済む。
+  書き込みは1トランザクションで行い（途中で失敗しても中途半端な状態が残らない）、WAL モードなので
+  複数のセッション（スレッド）やプロセスから同時に使える。
+- FileDeckStore: 従来のディレクトリ形式。書き込みは一時ファイル + os.replace で行い、一覧は
+  ファイルの (mtime, サイズ) が変わったものだけ読み直す。
+
+SQLite のストアは初回に saved_decks/ のデッキを取り込むので、従来の保存データもそのまま使える。
+Streamlit に依存しない純粋なモジュール。
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from deck_codec import DeckLineError, DeckList, DeckParseError, format_deck_text, parse_deck_text
+
+# "sqlite" または "files"
+DECK_STORE_BACKEND = "sqlite"
+# SQLite のデータベースファイル（アプリの作業ディレクトリからの相対パス）
+DECK_DB_PATH = "saved_decks.sqlite3"
+# 従来形式の保存先ディレクトリ（FileDeckStore の保存先、SQLite への取り込み元）
+SAVED_DECKS_DIR = "saved_decks"
+
+# 一覧の1件分。colors はリーダーの色（"赤/緑" など）、updated_at は UNIX 時刻
+DeckSummary = namedtuple("DeckSummary", ["name", "leader_id", "colors", "card_count", "updated_at"])
+
+# list_decks の並び順
+ORDER_BY_NAME = "name"
+ORDER_BY_UPDATED = "updated"
+
+
+def split_colors(colors):
+    """"赤/緑" や "赤／緑" を ["赤", "緑"] にする"""
+    return [c.strip() for c in (colors or "").replace("／", "/").split("/") if c.strip()]
+
+
+def check_deck_name(name):
+    """保存できるデッキ名か確かめる（どちらのバックエンドでも同じ名前が使えるよう、パス区切りは禁止）"""
+    if not name or not name.strip():
+        raise ValueError("デッキ名を入力してください。")
+    if any(c in name for c in "/\\\0") or name in (".", ".."):
+        raise ValueError("デッキ名に「/」「\\」は使えません。")
+
+
+def _missing_card_error(position, card_id, count):
+    # 行番号はテキスト形式の「# デッキ名」「リーダー」の2行の後ろとして数える
+    return DeckLineError(position + 3, f"{count}x{card_id}", f"カード {card_id} が見つかりません。")
+
+
+def _matches(summary, leader_id, color, query):
+    return (
+        (leader_id is None or summary.leader_id == leader_id)
+        and (color is None or color in split_colors(summary.colors))
+        and (not query or query in summary.name)
+    )
+
+
+class SQLiteDeckStore:
+    """SQLite に保存するデッキストア"""
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS decks (
+            name TEXT PRIMARY KEY,
+            leader_id TEXT NOT NULL,
+            colors TEXT NOT NULL,
+            card_count INTEGER NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS decks_leader ON decks (leader_id);
+        CREATE INDEX IF NOT EXISTS decks_updated ON decks (updated_at);
+        CREATE TABLE IF NOT EXISTS deck_colors (
+            color TEXT NOT NULL,
+            name TEXT NOT NULL REFERENCES decks (name) ON DELETE CASCADE,
+            PRIMARY KEY (color, name)
+        );
+        CREATE TABLE IF NOT EXISTS deck_cards (
+            name TEXT NOT NULL REFERENCES decks (name) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            card_id TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (name, position)
+        );
+        CREATE TABLE IF NOT EXISTS store_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path=DECK_DB_PATH, legacy_dir=SAVED_DECKS_DIR, leader_colors=None, timeout=10):
+        self.path = path
+        self.timeout = timeout
+        # sqlite3 の接続はスレッドをまたいで使えないため、スレッド（Streamlit のセッション）ごとに持つ
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.executescript(self._SCHEMA)
+        if legacy_dir and os.path.isdir(legacy_dir):
+            self._import_legacy(legacy_dir, leader_colors)
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout)
+            try:
+                conn.execute("PRAGMA journal_mode=WAL")
+            except sqlite3.OperationalError:
+                # 別のプロセスが同時に作成中（WAL の設定はファイルに残るので、その設定がそのまま使われる）
+                pass
+            conn.execute("PRAGMA foreign_keys=ON")
+            self._local.conn = conn
+        return conn
+
+    def _import_legacy(self, legacy_dir, leader_colors):
+        """saved_decks/ のデッキを1回だけ取り込む（取り込み済みの印は store_meta に残す）
+
+        check_deck_name が受け付けない名前のデッキは飛ばす（取り込んでも同じ名前で保存し直せないため）。
+        """
+        conn = self._connect()
+        if conn.execute("SELECT 1 FROM store_meta WHERE key = 'legacy_imported'").fetchone():
+            return
+        legacy = FileDeckStore(legacy_dir, leader_colors)
+        with conn:
+            for summary in legacy.list_decks():
+                # 取り込まなかったデッキも元のファイルは saved_decks/ に残る
+                try:
+                    check_deck_name(summary.name)
+                except ValueError:
+                    continue
+                deck = legacy.load(summary.name)
+                if deck is not None and not self._exists(conn, summary.name):
+                    self._write(conn, summary.name, deck.leader_id, deck.cards, summary.colors, summary.updated_at)
+            conn.execute("INSERT OR REPLACE INTO store_meta VALUES ('legacy_imported', ?)", (legacy_dir,))
+
+    @staticmethod
+    def _exists(conn, name):
+        return conn.execute("SELECT 1 FROM decks WHERE name = ?", (name,)).fetchone() is not None
+
+    @staticmethod
+    def _write(conn, name, leader_id, cards, colors, updated_at):
+        conn.execute("DELETE FROM decks WHERE name = ?", (name,))
+        conn.execute(
+            "INSERT INTO decks VALUES (?, ?, ?, ?, ?)",
+            (name, leader_id, colors or "", sum(cards.values()), updated_at),
+        )
+        conn.executemany("INSERT INTO deck_colors VALUES (?, ?)", [(c, name) for c in dict.fromkeys(split_colors(colors))])
+        conn.executemany(
+            "INSERT INTO deck_cards VALUES (?, ?, ?, ?)",
+            [(name, i, card_id, count) for i, (card_id, count) in enumerate(cards.items())],
+        )
+
+    def list_decks(self, leader_id=None, color=None, query=None, order=ORDER_BY_NAME):
+        """保存済みデッキの DeckSummary のリスト。リーダー・色（1色）・デッキ名の部分一致で絞り込める"""
+        sql = "SELECT name, leader_id, colors, card_count, updated_at FROM decks"
+        where, params = [], []
+        if leader_id is not None:
+            where.append("leader_id = ?")
+            params.append(leader_id)
+        if color is not None:
+            where.append("name IN (SELECT name FROM deck_colors WHERE color = ?)")
+            params.append(color)
+        if query:
+            where.append("instr(name, ?) > 0")
+            params.append(query)
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY updated_at DESC, name" if order == ORDER_BY_UPDATED else " ORDER BY name"
+        return [DeckSummary(*row) for row in self._connect().execute(sql, params)]
+
+    def load(self, name, known_ids=None):
+        """デッキを DeckList で返す。無ければ None
+
+        known_ids を渡すと、含まれないカードは読み飛ばして errors に記録する（parse_deck_text と同じ）。
+        """
+        conn = self._connect()
+        row = conn.execute("SELECT leader_id FROM decks WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return None
+        cards, errors = {}, []
+        for position, card_id, count in conn.execute(
+            "SELECT position, card_id, count FROM deck_cards WHERE name = ? ORDER BY position", (name,)
+        ):
+            if known_ids is not None and card_id not in known_ids:
+                errors.append(_missing_card_error(position, card_id, count))
+                continue
+            cards[card_id] = count
+        return DeckList(name, row[0], cards, errors)
+
+    def load_all(self):
+        """全デッキの DeckList をデッキ名順に返すジェネレータ（1回のクエリでまとめて読む）"""
+        conn = self._connect()
+        leaders = dict(conn.execute("SELECT name, leader_id FROM decks"))
+        name, cards = None, {}
+        for deck_name, card_id, count in conn.execute(
+            "SELECT name, card_id, count FROM deck_cards ORDER BY name, position"
+        ):
+            if deck_name != name:
+                if name is not None:
+                    yield DeckList(name, leaders.pop(name), cards, [])
+                name, cards = deck_name, {}
+            cards[card_id] = count
+        if name is not None:
+            yield DeckList(name, leaders.pop(name), cards, [])
+        # カードが1枚も無いデッキ
+        for name in sorted(leaders):
+            yield DeckList(name, leaders[name], {}, [])
+
+    def fingerprint(self):
+        """保存内容が変わると変わる値（件数と最終更新時刻）。集計結果のキャッシュキーに使う"""
+        return tuple(self._connect().execute("SELECT COUNT(*), MAX(updated_at) FROM decks").fetchone())
+
+    def save(self, name, leader_id, cards, colors=""):
+        """デッキを保存する（同名のデッキは置き換える）。colors はリーダーの色"""
+        check_deck_name(name)
+        conn = self._connect()
+        with conn:
+            self._write(conn, name, leader_id, dict(cards), colors, time.time())
+
+    def delete(self, name):
+        """デッキを削除する。削除した場合は True"""
+        conn = self._connect()
+        with conn:
+            return conn.execute("DELETE FROM decks WHERE name = ?", (name,)).rowcount > 0
+
+
+class FileDeckStore:
+    """saved_decks/<デッキ名>.txt に1デッキずつ保存する従来形式のデッキストア"""
+
+    def __init__(self, directory=SAVED_DECKS_DIR, leader_colors=None):
+        self.directory = directory
+        # ファイルにはリーダーの色を書かないため、一覧の色はリーダーのカードIDから引く
+        self.leader_colors = leader_colors
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        # ファイル名 → ((mtime, サイズ), DeckSummary or None)
+        self._index = {}
+
+    def _path(self, name):
+        return os.path.join(self.directory, f"{name}.txt")
+
+    def _read(self, path, name, known_ids=None):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                deck = parse_deck_text(f.read(), known_ids=known_ids)
+        except (FileNotFoundError, DeckParseError, UnicodeDecodeError):
+            return None
+        # ファイル名をデッキ名とする（中の「# デッキ名」と違っていても、従来どおりファイル名で扱う）
+        return deck._replace(name=name)
+
+    def _refresh_index(self):
+        """ディレクトリを走査し、(mtime, サイズ) が変わったファイルだけ読み直す"""
+        seen = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".txt") and entry.is_file():
+                    st = entry.stat()
+                    seen[entry.name] = (st.st_mtime, st.st_size)
+        with self._lock:
+            for file_name in self._index.keys() - seen.keys():
+                del self._index[file_name]
+            for file_name, stamp in seen.items():
+                cached = self._index.get(file_name)
+                if cached is not None and cached[0] == stamp:
+                    continue
+                name = file_name[:-4]
+                deck = self._read(os.path.join(self.directory, file_name), name)
+                summary = None
+                if deck is not None:
+                    colors = self.leader_colors(deck.leader_id) if self.leader_colors else ""
+                    summary = DeckSummary(name, deck.leader_id, colors or "", sum(deck.cards.values()), stamp[0])
+                self._index[file_name] = (stamp, summary)
+            return [summary for _, summary in self._index.values() if summary is not None]
+
+    def list_decks(self, leader_id=None, color=None, query=None, order=ORDER_BY_NAME):
+        summaries = [s for s in self._refresh_index() if _matches(s, leader_id, color, query)]
+        if order == ORDER_BY_UPDATED:
+            return sorted(summaries, key=lambda s: (-s.updated_at, s.name))
+        return sorted(summaries, key=lambda s: s.name)
+
+    def load(self, name, known_ids=None):
+        return self._read(self._path(name), name, known_ids)
+
+    def load_all(self):
+        for summary in self.list_decks():
+            deck = self.load(summary.name)
+            if deck is not None:
+                yield deck
+
+    def fingerprint(self):
+        summaries = self._refresh_index()
+        return len(summaries), max((s.updated_at for s in summaries), default=None)
+
+    def save(self, name, leader_id, cards, colors=""):
+        check_deck_name(name)
+        text = format_deck_text(name, leader_id, dict(cards))
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self._path(name))
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def delete(self, name):
+        try:
+            os.remove(self._path(name))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def open_deck_store(backend=DECK_STORE_BACKEND, leader_colors=None):
+    """設定されたバックエンドのデッキストアを返す
+
+    leader_colors はリーダーのカードID → 色（"赤/緑" など）の関数。ファイル形式の一覧や従来データの取り込みで色を補うのに使う。
+    """
+    if backend == "files":
+        return FileDeckStore(leader_colors=leader_colors)
+    if backend == "sqlite":
+        return SQLiteDeckStore(leader_colors=leader_colors)
+    raise ValueError(f"不明なデッキストアのバックエンドです: {backend}")
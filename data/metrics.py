@@ -0,0 +1,256 @@
+"""処理時間（スパン）とカウンターの計測
+
+    import metrics
+    with metrics.span("search.filter"):
+        results = filter_cards(...)
+    metrics.incr("image_cache_hits")
+
+計測値はプロセス単位で集計し、snapshot() で一覧に、render_prometheus() で Prometheus のテキスト形式にする。
+既定では無効で、無効のときの span() は共有の何もしないオブジェクトを返し、incr() などは何もしない
+（有効かどうかを1回見るだけ）。環境変数 DECK_METRICS=1 で有効になる。
+DECK_METRICS_PORT を指定して serve_from_env() を呼ぶと、そのポートの /metrics で公開する。
+Streamlit に依存しない純粋なモジュール。
+"""
+import bisect
+import functools
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# スパンのヒストグラムの境界（秒）
+SPAN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Prometheus のメトリクス名の接頭辞
+METRIC_PREFIX = "deck_"
+
+
+class _Timer:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self, n_buckets):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # buckets[i] は SPAN_BUCKETS[i] 以下だった回数（累積ではない。最後は +Inf）
+        self.buckets = [0] * (n_buckets + 1)
+
+
+class Registry:
+    """スパンの時間とカウンターを集計する（スレッドセーフ）"""
+
+    def __init__(self, enabled=False, buckets=SPAN_BUCKETS):
+        self.enabled = enabled
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+        self.started_at = time.time()
+
+    def observe(self, name, seconds):
+        """スパン name の1回分の時間を記録する"""
+        with self._lock:
+            timer = self._timers.get(name)
+            if timer is None:
+                timer = self._timers[name] = _Timer(len(self.buckets))
+            timer.count += 1
+            timer.total += seconds
+            if seconds > timer.max:
+                timer.max = seconds
+            timer.buckets[bisect.bisect_left(self.buckets, seconds)] += 1
+
+    def incr(self, name, value=1):
+        """カウンター name を value 増やす"""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+            self.started_at = time.time()
+
+    def snapshot(self):
+        """{"timers": {名前: {count, total, mean, max}}, "counters": {名前: 値}, "started_at": 集計開始時刻}"""
+        with self._lock:
+            timers = {
+                name: {"count": t.count, "total": t.total, "mean": t.total / t.count, "max": t.max}
+                for name, t in sorted(self._timers.items())
+            }
+            return {"timers": timers, "counters": dict(sorted(self._counters.items())), "started_at": self.started_at}
+
+    def render_prometheus(self):
+        """Prometheus のテキスト形式（スパンはヒストグラム、カウンターは *_total）"""
+        with self._lock:
+            timers = sorted((name, t.count, t.total, list(t.buckets)) for name, t in self._timers.items())
+            counters = sorted(self._counters.items())
+        span_metric = f"{METRIC_PREFIX}span_seconds"
+        lines = [f"# HELP {span_metric} Time spent in each instrumented phase.", f"# TYPE {span_metric} histogram"]
+        for name, count, total, buckets in timers:
+            label = _escape_label(name)
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{span_metric}_bucket{{span="{label}",le="{le}"}} {cumulative}')
+            lines.append(f'{span_metric}_sum{{span="{label}"}} {total!r}')
+            lines.append(f'{span_metric}_count{{span="{label}"}} {count}')
+        for name, value in counters:
+            metric = f"{METRIC_PREFIX}{_sanitize_name(name)}_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        lines.append(f"# TYPE {METRIC_PREFIX}metrics_started_seconds gauge")
+        lines.append(f"{METRIC_PREFIX}metrics_started_seconds {self.started_at!r}")
+        return "\n".join(lines) + "\n"
+
+
+def _sanitize_name(name):
+    return "".join(c if c.isalnum() or c == "_" else "_" for c in name)
+
+
+def _escape_label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Span:
+    __slots__ = ("_registry", "_name", "_start")
+
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._name = name
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self._registry.observe(self._name, time.perf_counter() - self._start)
+        return False
+
+
+class _NullSpan:
+    """計測が無効のときの span()（何もしない）"""
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+# プロセスで共有する集計
+_registry = Registry(enabled=os.environ.get("DECK_METRICS", "") not in ("", "0"))
+
+
+def get_registry():
+    return _registry
+
+
+def is_enabled():
+    return _registry.enabled
+
+
+def enable():
+    _registry.enabled = True
+
+
+def disable():
+    _registry.enabled = False
+
+
+def span(name):
+    """with の間の時間をスパン name として記録する（無効のときは何もしない）"""
+    if not _registry.enabled:
+        return _NULL_SPAN
+    return _Span(_registry, name)
+
+
+def timed(name):
+    """関数の実行時間をスパン name として記録するデコレーター"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _registry.enabled:
+                return func(*args, **kwargs)
+            with _Span(_registry, name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def clock():
+    """with で囲めない範囲の計測の開始時刻（無効のときは None）。observe_since と組にして使う"""
+    return time.perf_counter() if _registry.enabled else None
+
+
+def observe_since(name, started):
+    """clock() の時刻からの経過時間をスパン name として記録する"""
+    if started is not None and _registry.enabled:
+        _registry.observe(name, time.perf_counter() - started)
+
+
+def observe(name, seconds):
+    if _registry.enabled:
+        _registry.observe(name, seconds)
+
+
+def incr(name, value=1):
+    if _registry.enabled:
+        _registry.incr(name, value)
+
+
+def snapshot():
+    return _registry.snapshot()
+
+
+def reset():
+    _registry.reset()
+
+
+def render_prometheus():
+    return _registry.render_prometheus()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_http_server(port, host="127.0.0.1"):
+    """/metrics を返す HTTP サーバーを裏のスレッドで起動する（プロセスで1回だけ。2回目以降は何もしない）"""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def serve_from_env():
+    """計測が有効で DECK_METRICS_PORT が指定されていれば /metrics を公開する。ポートが使えなければ何もしない"""
+    port = os.environ.get("DECK_METRICS_PORT")
+    if not port or not _registry.enabled:
+        return None
+    try:
+        return start_http_server(int(port), os.environ.get("DECK_METRICS_HOST", "127.0.0.1"))
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,152 @@
+"""文字 N-gram（既定はバイグラム）の転置インデックスによる部分一致検索
+
+日本語テキストは単語区切りが無いため、文字バイグラムのポスティングリストを
+積集合して候補行を絞り、最後に実際の部分一致で確認する。
+カードテーブルに限らず、任意の文字列リストに対して単体で使える。
+"""
+import numpy as np
+
+
+def splice_postings(postings, start, stop, part_postings, part_size):
+    """行 [start, stop) を part_size 行で置き換えたときのポスティングリストを作る
+
+    part_postings は差し替える行だけで作ったポスティング（行番号は 0 始まり）。
+    元の辞書は変更せず、新しい辞書を返す。
+    """
+    delta = part_size - (stop - start)
+    result = {}
+    for key, positions in postings.items():
+        part = part_postings.get(key)
+        if part is None:
+            # 差し替え範囲と重ならないリストはそのまま使う／ずらすだけで済む
+            if positions[-1] < start:
+                result[key] = positions
+                continue
+            if positions[0] >= stop:
+                result[key] = positions + delta if delta else positions
+                continue
+        head = positions[:np.searchsorted(positions, start)]
+        tail = positions[np.searchsorted(positions, stop):]
+        pieces = [head]
+        if part is not None:
+            pieces.append(part + start)
+        if len(tail):
+            pieces.append(tail + delta)
+        merged = np.concatenate(pieces).astype(positions.dtype, copy=False)
+        if len(merged):
+            result[key] = merged
+    for key, part in part_postings.items():
+        if key not in postings:
+            result[key] = (part + start).astype(part.dtype, copy=False)
+    return result
+
+
+def pack_postings(postings):
+    """ポスティングの辞書を (キーのリスト, 連結した行番号, 各キーの先頭位置) にする（スナップショットの保存用）"""
+    keys = list(postings)
+    lengths = np.array([len(postings[key]) for key in keys], dtype=np.int64)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.concatenate([postings[key] for key in keys]) if keys else np.zeros(0, dtype=np.int32)
+    return keys, values.astype(np.int32, copy=False), offsets
+
+
+def unpack_postings(keys, values, offsets):
+    """pack_postings の逆。各リストは values の部分配列（コピーしない）"""
+    return {key: values[offsets[i]:offsets[i + 1]] for i, key in enumerate(keys)}
+
+
+class NgramIndex:
+    """文字列リストに対する大文字小文字を無視した部分一致検索インデックス
+
+    >>> index = NgramIndex(["モンキー・D・ルフィ", "ロロノア・ゾロ"])
+    >>> index.search("ルフィ").tolist()
+    [0]
+    """
+
+    def __init__(self, texts, n=2):
+        if n < 1:
+            raise ValueError("n は 1 以上を指定してください。")
+        self.n = n
+        self.texts = [str(t).lower() for t in texts]
+
+        # n 文字未満のクエリにも答えられるよう、1..n 文字の gram をすべて索引する
+        postings = {}
+        for pos, text in enumerate(self.texts):
+            grams = set()
+            for size in range(1, n + 1):
+                grams.update(text[i:i + size] for i in range(len(text) - size + 1))
+            for gram in grams:
+                postings.setdefault(gram, []).append(pos)
+        self.postings = {gram: np.asarray(lst, dtype=np.int32) for gram, lst in postings.items()}
+
+    @classmethod
+    def from_postings(cls, texts, postings, n=2):
+        """保存しておいたポスティングから作る（texts は __init__ と同じ、小文字にする前のもの）"""
+        index = cls.__new__(cls)
+        index.n = n
+        index.texts = [str(t).lower() for t in texts]
+        index.postings = postings
+        return index
+
+    def __len__(self):
+        return len(self.texts)
+
+    def replace_rows(self, start, stop, texts):
+        """行 [start, stop) を texts で置き換えた新しいインデックスを返す（差し替え部分だけ索引し直す）"""
+        part = NgramIndex(texts, n=self.n)
+        patched = NgramIndex.__new__(NgramIndex)
+        patched.n = self.n
+        patched.texts = self.texts[:start] + part.texts + self.texts[stop:]
+        patched.postings = splice_postings(self.postings, start, stop, part.postings, len(part))
+        return patched
+
+    def candidates(self, query):
+        """query のすべての gram を含む行番号（昇順）を返す。部分一致の確認はしない"""
+        query = query.lower()
+        if not query:
+            return np.arange(len(self.texts), dtype=np.int32)
+        size = min(self.n, len(query))
+        grams = {query[i:i + size] for i in range(len(query) - size + 1)}
+
+        lists = []
+        for gram in grams:
+            positions = self.postings.get(gram)
+            if positions is None:
+                return np.empty(0, dtype=np.int32)
+            lists.append(positions)
+
+        # 短いリストから積集合を取ると早く空になる
+        lists.sort(key=len)
+        result = lists[0]
+        for positions in lists[1:]:
+            result = np.intersect1d(result, positions, assume_unique=True)
+            if result.size == 0:
+                break
+        return result
+
+    def search(self, query, positions=None):
+        """query を部分文字列として含む行番号（昇順）を返す
+
+        positions を渡すと、その行番号の中だけから探す。
+        """
+        query = query.lower()
+        result = self.candidates(query)
+        if positions is not None:
+            result = np.intersect1d(result, positions)
+        if len(query) <= self.n:
+            # gram がクエリ全体と一致するので確認は不要
+            return result
+        texts = self.texts
+        return np.asarray([pos for pos in result.tolist() if query in texts[pos]], dtype=np.int32)
+
+    def search_all(self, keywords, positions=None):
+        """すべてのキーワードを含む行番号（AND 検索）を返す"""
+        result = positions
+        for keyword in keywords:
+            result = self.search(keyword, result)
+            if result.size == 0:
+                break
+        if result is None:
+            return np.arange(len(self.texts), dtype=np.int32)
+        return result
@@ -2,24 +2,40 @@ import streamlit as st
 import pandas as pd
 import json
 import os
-import qrcode
-from PIL import Image, ImageDraw, ImageFont
-import io
 import base64
-import re 
-import requests 
-from io import BytesIO 
-# 💡 修正: ThreadPoolExecutorを使用しないため、関連するimportを削除
-# from concurrent.futures import ThreadPoolExecutor, as_completed 
-# 💡 修正: pyzbarの代わりにOpenCVとNumpyをインポート
-import cv2
-import numpy as np
+import hashlib
+# 💡 修正: ThreadPoolExecutorの直接importは削除（Pyodide/Streamlit Cloud対策）
+# 並列ダウンロードは card_image_cache.run_concurrently がスレッド可否を判定して行う
+# 💡 修正: カードテーブル・検索・デッキの読み書きと検証・画像キャッシュ・デッキ画像の描画・QRコードの読み取り・
+# デッキストアは Streamlit に依存しない deck_engine にまとめた。アプリはその薄いクライアント
+# （ワーカー・ベンチマーク・バッチ処理からも UI を起動せずに同じ処理を使える）
+from deck_engine import filter_cards, get_engine
+# 💡 追加: カスタムカードの画像URLの解決（一覧表示のサムネイル用）
+from card_thumbnails import resolve_image_url
+# 💡 追加: デッキリストの読み込みエラー
+from deck_codec import DeckParseError
+# 💡 追加: 保存済みデッキの一覧の並び順
+from deck_store import ORDER_BY_UPDATED
+# 💡 追加: 保存済みデッキの類似検索・リーダーごとの採用カード集計
+from deck_similarity import DeckIndex
+# 💡 追加: 構築ルール（レギュレーション表）とデッキの検証
+from deck_rules import DECK_SIZE, get_regulation_table
+# 💡 追加: デッキ画像の出力形式（PNG / JPEG / WebP / サイズ上限）
+from deck_image_encode import DEFAULT_MAX_BYTES, DEFAULT_QUALITY, OUTPUT_FORMATS, encode_preview, format_size
+# 💡 追加: 処理時間・画像キャッシュの計測（DECK_METRICS=1 のときだけ記録する）
+import metrics
+# 💡 修正: 色・タイプの並び順とソートキーの計算は card_data.build_card_table で行うため、定義は card_data に移動
+from card_data import color_order, type_priority, SORT_KEY_COLUMNS
 
 # ===============================
 # 🛠️ 修正 1: アプリ全体を Wide Mode に設定
 # ===============================
 st.set_page_config(layout="wide")
 
+# 💡 追加: 再実行1回分の時間（途中の st.rerun / st.stop で終わった回は記録しない）
+rerun_started = metrics.clock()
+metrics.serve_from_env()
+
 # ===============================
 # 📱 修正 3 (最終手段: CSS Grid版): モバイルでの列崩れを防止するCSS
 # ===============================
@@ -66,99 +82,23 @@ st.markdown("""
 # ===============================
 # 🧠 キャッシュ付きデータ読み込み
 # ===============================
-# 💡 追加: カスタムカードCSVのファイル名
-CUSTOM_CARDS_CSV = "custom_cards.csv"
-# 💡 追加: パラレルカードCSVのファイル名
-PARALLEL_CARDS_CSV = "cardlist_p_only.csv" 
+# 💡 修正: CSVの読み込み・派生列の計算・CardIndexの構築は card_data.load_card_table に移動
+# 元CSVが変わっていなければ列指向のバイナリスナップショット (card_snapshot.npz) から読み込む
+# 💡 修正: カードテーブルはプロセス内で1つの DeckEngine が持ち、全セッションで共有する
+engine = get_engine()
 
-@st.cache_data(ttl=3600, show_spinner=False)
 def load_data():
-    """Streamlit UI要素を含まない、純粋なデータロード関数"""
-    
-    # --- 1. メインカードリストの読み込み ---
-    if not os.path.exists("cardlist_filtered.csv"):
-        # ❌ 修正: st.error()を削除
-        return pd.DataFrame()
-        
-    df_main = pd.read_csv("cardlist_filtered.csv")
-    
-    # 💡 修正: カスタムカードとの統合を容易にするため、不足している列を追加（空値でOK）
-    if '画像URL' not in df_main.columns:
-        df_main['画像URL'] = None
-    
-    # 💡 追加: パラレルカードフラグの追加
-    df_main['is_parallel'] = False 
-    
-    # --- 2. カスタムカードリストの読み込みと統合 ---
-    df_custom = pd.DataFrame()
-    if os.path.exists(CUSTOM_CARDS_CSV):
-        try:
-            # メインDFと同じ列構造を期待
-            df_custom = pd.read_csv(CUSTOM_CARDS_CSV)
-            
-        except Exception as e:
-            df_custom = pd.DataFrame() # 読み込みに失敗した場合は空にする
-
-    # --- 3. パラレルカードリストの読み込みと統合 ---
-    df_parallel = pd.DataFrame()
-    if os.path.exists(PARALLEL_CARDS_CSV):
-        try:
-            df_parallel = pd.read_csv(PARALLEL_CARDS_CSV)
-            if '画像URL' not in df_parallel.columns:
-                df_parallel['画像URL'] = None
-            df_parallel['is_parallel'] = True # パラレルカードにフラグを立てる
-        except Exception as e:
-            df_parallel = pd.DataFrame() # 読み込みに失敗した場合は空にする
-            
-    # 必須列のリストを定義 (パラレルカードフラグも含む)
-    required_cols = list(df_main.columns)
-
-    # 結合前の列チェックと調整 (カスタムカード)
-    if not df_custom.empty:
-        missing_cols = [col for col in required_cols if col not in df_custom.columns]
-        for col in missing_cols:
-            df_custom[col] = "-" # 欠損列を埋める
-        df_custom['is_parallel'] = False # カスタムカードは通常パラレルではないと仮定
-        df_custom = df_custom[required_cols] # 列順を揃える
+    """Streamlit UI要素を含まない、純粋なデータロード関数
     
-    # 結合前の列チェックと調整 (パラレルカード)
-    if not df_parallel.empty:
-        missing_cols = [col for col in required_cols if col not in df_parallel.columns]
-        for col in missing_cols:
-            df_parallel[col] = "-" 
-        df_parallel = df_parallel[required_cols] 
-
-    # データの結合
-    df_list = [df_main]
-    if not df_custom.empty:
-        df_list.append(df_custom)
-    if not df_parallel.empty:
-        # メインカードと重複するものは除外しない（同じカードIDで別バージョンのため）
-        df_list.append(df_parallel)
-
-    df = pd.concat(df_list, ignore_index=True)
-    # -----------------------------------------------------------
-    
-    df = df.fillna("-")
-    
-    # 特徴と属性の処理を統一（全角/半角スラッシュ対応）
-    df["特徴リスト"] = df["特徴"].apply(lambda x: [f.strip() for f in str(x).replace("／", "/").split("/") if f.strip() and f.strip() != "-"])
-    df["属性リスト"] = df["属性"].apply(lambda x: [f.strip() for f in str(x).replace("／", "/").split("/") if f.strip() and f.strip() != "-"])
-    df["コスト数値"] = df["コスト"].replace("-", 0).astype(int)
-    
-    # 修正: 入手情報から【】内のシリーズ番号のみを抽出
-    def extract_series_id(info):
-        match = re.search(r'【(.*?)】', str(info))
-        if match:
-            return match.group(1).strip()
-        return "その他" if str(info).strip() not in ["-", ""] else "-"
-        
-    df["シリーズID"] = df["入手情報"].apply(extract_series_id)
-    
-    return df
+    💡 修正: (カードDF, 検索用の CardIndex) を返す
+    💡 修正: ttl=3600 で全体を読み直すのをやめ、元CSVが更新されていれば
+    変わったCSV（カスタム/パラレル）の部分だけを差し替えてから返す"""
+    return engine.refresh()
 
 # データのロード
-df = load_data()
+df, card_index = load_data()
+# 💡 追加: カードIDから通常版優先のレコードを O(1) で引く辞書
+card_lookup = card_index.lookup if card_index is not None else None
 
 # ❌ 修正: ファイルが見つからないときのエラー処理を、キャッシュ外に移動
 if df.empty:
@@ -166,38 +106,9 @@ if df.empty:
         st.error("エラー: cardlist_filtered.csv が見つかりません。")
     st.stop()
 
-# 無制限カードのリスト
-UNLIMITED_CARDS = ["OP01-075", "OP08-072"]
-
-# ===============================
-# 🧩 並び順設定
-# ===============================
-color_order = ["赤", "緑", "青", "紫", "黒", "黄"]
-color_priority = {c: i for i, c in enumerate(color_order)}
-type_priority = {"LEADER": 0, "CHARACTER": 1, "EVENT": 2, "STAGE": 3}
-
-def color_sort_key(row):
-    text = str(row["色"])
-    t = str(row["タイプ"])
-    if text.strip() == "-" or text.strip() == "":
-        return (999, 999, 999, 999)
-
-    found_colors = [c for c in color_order if c in text]
-    if not found_colors:
-        return (999, 999, 999, 999)
-
-    first_color = found_colors[0]
-    base_priority = color_priority[first_color]
-
-    is_multi = "/" in text or "／" in text
-    sub_colors = [c for c in color_order if c in text and c != first_color]
-    sub_priority = color_order.index(sub_colors[0]) + 1 if is_multi and sub_colors else 0
-    multi_flag = 1 if is_multi else 0
-
-    type_rank = type_priority.get(t, 9)
-    return (base_priority, type_rank, sub_priority, multi_flag)
-
-df["ソートキー"] = df.apply(color_sort_key, axis=1)
+# 💡 修正: 無制限カードのリスト (UNLIMITED_CARDS) は、禁止・制限カードやデッキ枚数と合わせて
+# レギュレーション表 (regulations.json) に移動。ファイルを更新すれば再起動なしで反映される
+regulation_table = get_regulation_table()
 
 # ===============================
 # 💡 修正 1: パラレルカードフィルタの状態更新コールバック関数
@@ -220,6 +131,47 @@ def update_parallel_filter(key_suffix):
     # 裏側のフィルター状態を更新
     st.session_state[f"parallel_filter_{key_suffix}"] = internal_mode
 
+# ===============================
+# 💡 追加: 検索結果のページ分割（表示中のページのカードだけを描画する）
+# ===============================
+# 1ページあたりの表示枚数（1列あたり2〜5枚のどれでも割り切れる数）
+CARDS_PER_PAGE = 60
+
+def change_page(page_key, delta):
+    """前へ/次へボタンのコールバック。ページ番号を更新する"""
+    st.session_state[page_key] = max(0, st.session_state.get(page_key, 0) + delta)
+
+def get_page_range(total, page_key, reset_token):
+    """表示するページの (開始位置, 終了位置, ページ番号, ページ数) を返す
+    検索条件 (reset_token) が変わったら1ページ目に戻す"""
+    token_key = f"{page_key}_token"
+    if st.session_state.get(token_key) != reset_token:
+        st.session_state[token_key] = reset_token
+        st.session_state[page_key] = 0
+    page_count = max(1, -(-total // CARDS_PER_PAGE))
+    page = min(st.session_state.get(page_key, 0), page_count - 1)
+    st.session_state[page_key] = page
+    start = page * CARDS_PER_PAGE
+    return start, min(start + CARDS_PER_PAGE, total), page, page_count
+
+def render_pager(page_key, start, stop, total, page, page_count, position):
+    """前へ/次へボタンと表示範囲を表示する（1ページに収まる場合は何も表示しない）
+    position は同じページ送りを上下に置くときのキーの区別に使う"""
+    if page_count <= 1:
+        return
+    col_prev, col_info, col_next = st.columns([1, 2, 1])
+    with col_prev:
+        st.button("◀ 前へ", key=f"{page_key}_prev_{position}", on_click=change_page, args=(page_key, -1), 
+                  disabled=page == 0, width='stretch')
+    with col_info:
+        st.markdown(
+            f"<div style='text-align: center;'>{page + 1} / {page_count} ページ（{start + 1}〜{stop} / {total} 枚）</div>", 
+            unsafe_allow_html=True
+        )
+    with col_next:
+        st.button("次へ ▶", key=f"{page_key}_next_{position}", on_click=change_page, args=(page_key, 1), 
+                  disabled=page >= page_count - 1, width='stretch')
+
 
 # ===============================
 # 💾 セッション初期化
@@ -238,6 +190,9 @@ if "search_cols" not in st.session_state:
     st.session_state["search_cols"] = 3
 if "qr_upload_key" not in st.session_state: 
     st.session_state["qr_upload_key"] = 0
+# 💡 追加: 最後に「デッキ画像を生成」したデッキ（リーダー・カード・デッキ名・QRコードの形式）
+if "deck_image_key" not in st.session_state:
+    st.session_state["deck_image_key"] = None
 # 💡 修正: パラレルカードフィルタの状態を文字列で初期化
 if "parallel_filter_search" not in st.session_state:
     st.session_state["parallel_filter_search"] = "normal" # normal, parallel, both
@@ -264,413 +219,97 @@ if "deck_filter" not in st.session_state:
 # ===============================
 # 🔍 検索関数
 # ===============================
-# 💡 修正: parallel_mode 引数を文字列に変更 ("normal", "parallel", "both")
-def filter_cards(df, colors, types, costs, counters, attributes, blocks, feature_selected, free_words, series_ids=None, leader_colors=None, parallel_mode="normal"):
-    results = df.copy()
-
-    # 💡 修正: パラレルカードフィルタの適用
-    if parallel_mode == "parallel":
-        # パラレルカードのみ
-        results = results[results["is_parallel"] == True]
-    elif parallel_mode == "normal":
-        # 通常カードのみ
-        results = results[results["is_parallel"] == False]
-    # "both" の場合はフィルタリングしない (results = df.copy() のまま)
-
-    # デッキ作成モードの場合、リーダーの色に基づいてフィルタ
-    if leader_colors:
-        results = results[results["タイプ"] != "LEADER"]
-        results = results[results["色"].apply(lambda c: any(lc in c for lc in leader_colors))]
-    else:
-        # デッキ作成モード以外の場合、そして "both" モードではない場合、
-        # 同じカードIDを持つ通常版を優先するロジックを適用
-        if parallel_mode == "normal":
-            # "normal" モードの場合、通常カードのみが残っているので、重複排除は不要。
-            pass
-        elif parallel_mode == "parallel":
-            # "parallel" モードの場合、パラレルカードのみが残っているので、重複排除は不要。
-            pass
-        elif parallel_mode == "both":
-            # "both" モードの場合、LEADER以外で同じカードIDを持つ通常版とパラレル版が混在する。
-            # このままにしておくことで、両方のバージョンが表示される。
-            pass
-
-
-    if colors:
-        results = results[results["色"].apply(lambda c: any(col in c for col in colors))]
-
-    if types:
-        results = results[results["タイプ"].isin(types)]
-
-    if costs:
-        results = results[results["コスト数値"].isin(costs)]
-
-    if counters:
-        results = results[results["カウンター"].isin(counters)]
-
-    if attributes:
-        results = results[results["属性リスト"].apply(lambda lst: any(attr in lst for attr in attributes))]
-
-    if blocks:
-        results = results[results["ブロックアイコン"].isin(blocks)]
-        
-    # シリーズIDフィルタ
-    if series_ids:
-        results = results[results["シリーズID"].isin(series_ids)]
-
-    if feature_selected:
-        results = results[results["特徴リスト"].apply(lambda lst: any(f in lst for f in feature_selected))]
+# 💡 修正: filter_cards は deck_engine に移動（CardIndex の行番号の集合演算で絞り込み、結果は LRU で共有）
 
-    if free_words:
-        keywords = free_words.split()
-        for k in keywords:
-            results = results[
-                results["カード名"].str.contains(k, case=False, na=False) |
-                results["特徴"].str.contains(k, case=False, na=False) |
-                results["テキスト"].str.contains(k, case=False, na=False) |
-                results["トリガー"].str.contains(k, case=False, na=False)
-            ]
-
-    results = results.sort_values(
-        by=["ソートキー", "コスト数値", "カードID", "is_parallel"], # is_parallelをソートキーに追加
-        ascending=[True, True, True, True]
-    )
-    return results
+# 💡 追加: multiselect の選択肢に件数を付ける format_func
+def facet_label(counts):
+    """{選択肢: 件数} から「選択肢 (件数)」と表示する format_func を作る"""
+    return lambda value: f"{value} ({counts.get(value, 0)})"
 
 # ===============================
 # 🖼️ デッキ画像生成関数 
 # ===============================
 
-# 💡 修正: カード画像ダウンロード関数を修正し、カスタムカード（URLが`http`または`https`で始まるもの）の場合は直接URLから画像をダウンロードするように変更。
-def download_card_image(card_id, df, target_size, crop_top_half=False):
-    """カードIDとDFから画像を取得。カスタムカード（画像URL持ち）に対応。"""
-    try:
-        # 💡 修正: is_parallel=False のカードを優先して取得
-        card_row_base = df[(df["カードID"] == card_id) & (df["is_parallel"] == False)]
-        if card_row_base.empty:
-            # 通常版がない場合はパラレルカードを取得 (ただし、リーダーは除外)
-            card_row = df[df["カードID"] == card_id].iloc[0]
-        else:
-            card_row = card_row_base.iloc[0]
-            
-        # 1. 画像URLの決定
-        image_url = card_row.get('画像URL') # get()でキーが存在しない場合に対応
-        if pd.isna(image_url): # NaN対策
-             image_url = None
-             
-        is_custom_card = pd.notna(image_url) and str(image_url).startswith(("http", "https"))
-        
-        if is_custom_card:
-            card_url = str(image_url)
-        else:
-            # 公式カードのURL
-            card_url = f"https://www.onepiece-cardgame.com/images/cardlist/card/{card_id}.png"
-
-        # 2. 画像のダウンロード
-        response = requests.get(card_url, timeout=5)
-        if response.status_code == 200:
-            card_img = Image.open(BytesIO(response.content)).convert("RGBA")
-            
-            # 3. サイズ調整
-            if crop_top_half:
-                CROPPED_WIDTH = target_size[0]
-                CROPPED_HEIGHT = target_size[1]
-                
-                full_height_target = CROPPED_HEIGHT * 2 
-                card_img = card_img.resize((CROPPED_WIDTH, full_height_target), Image.LANCZOS)
-                
-                card_img = card_img.crop((0, 0, CROPPED_WIDTH, CROPPED_HEIGHT))
-            else:
-                card_img = card_img.resize(target_size, Image.LANCZOS) 
-                
-            return card_id, card_img
-    except Exception as e:
-        # st.error(f"画像ダウンロードエラー ({card_id}): {e}") # デバッグ用
-        return card_id, None
-
-@st.cache_data(ttl=3600, show_spinner=False) 
-def create_deck_image(leader, deck_dict, df, deck_name=""):
-    """デッキリストの画像を生成（カード画像＋QRコード付き）2150x2048固定サイズ"""
-    
-    # 最終画像サイズ
-    FINAL_WIDTH = 2150
-    FINAL_HEIGHT = 2048
-    
-    # カードグリッドの高さ 
-    GRID_HEIGHT = 1500 
-    
-    # 上セクションの最大高さ
-    UPPER_HEIGHT = FINAL_HEIGHT - GRID_HEIGHT
-    
-    # リーダーの色を取得
-    leader_color_text = leader["色"]
-    leader_colors = [c.strip() for c in leader_color_text.replace("／", "/").split("/") if c.strip()]
-    
-    # 色から背景色を取得 
-    color_map = {
-        "赤": "#AC1122", "緑": "#008866", "青": "#0084BD", 
-        "紫": "#93388B", "黒": "#211818", "黄": "#F7E731"
-    }
-    
-    # デッキリストテキスト生成
-    deck_lines = []
-    if deck_name:
-        deck_lines.append(f"# {deck_name}")
-    deck_lines.append(f"1x{leader['カードID']}")
-    
-    deck_cards_sorted = []
-    for card_id, count in deck_dict.items():
-        # 💡 修正: is_parallel=False のカードを優先して取得
-        card_row_base = df[(df["カードID"] == card_id) & (df["is_parallel"] == False)]
-        if card_row_base.empty:
-            card_row = df[df["カードID"] == card_id].iloc[0]
-        else:
-            card_row = card_row_base.iloc[0]
-            
-        base_priority, type_rank, sub_priority, multi_flag = card_row["ソートキー"]
-        deck_cards_sorted.append({
-            "card_id": card_id,
-            "count": count,
-            "new_sort_key": (type_rank, card_row["コスト数値"], base_priority, card_id), 
-            "cost": card_row["コスト数値"]
-        })
-    deck_cards_sorted.sort(key=lambda x: x["new_sort_key"])
-    
-    for card_info in deck_cards_sorted:
-        deck_lines.append(f"{card_info['count']}x{card_info['card_id']}")
-    deck_text = "\n".join(deck_lines)
-    
-    # QRコード生成
-    qr = qrcode.QRCode(version=1, box_size=8, border=2)
-    qr.add_data(deck_text)
-    qr.make(fit=True)
-    qr_img = qr.make_image(fill_color="black", back_color="white")
-    QR_SIZE = 400
-    qr_img = qr_img.resize((QR_SIZE, QR_SIZE), Image.LANCZOS)
-    
-    # カード画像のサイズ（下部グリッド用）
-    card_width = 215
-    card_height = 300
-    
-    # 💡 修正 2B-1: モバイル対応のため、グリッドの列数を10から3に変更（画像生成時は10列を維持）
-    cards_per_row = 10 
-    cards_per_col = 5
-    
-    margin_card = 0
-    
-    # 画像作成 (RGBAモードで初期化)
-    img = Image.new('RGBA', (FINAL_WIDTH, FINAL_HEIGHT), (0, 0, 0, 0)) # 透明な背景で初期化
-    draw = ImageDraw.Draw(img)
-    
-    # 背景色（グラデーション対応）
-    # 💡 修正: 2色以上の場合、多色グラデーションに対応
-    if len(leader_colors) == 1:
-        bg_color = color_map.get(leader_colors[0], "#FFFFFF")
-        draw.rectangle([0, 0, FINAL_WIDTH, FINAL_HEIGHT], fill=bg_color)
-    elif len(leader_colors) >= 2:
-        
-        # 1. 使用する色のリストを取得 (HEX)
-        gradient_colors_hex = [color_map.get(c, "#FFFFFF") for c in leader_colors]
-        
-        def hex_to_rgb(hex_color):
-            hex_color = hex_color.lstrip('#')
-            return tuple(int(hex_color[i:i+2], 16) for i in (0, 2, 4))
-            
-        # 2. RGBに変換
-        gradient_colors_rgb = [hex_to_rgb(c) for c in gradient_colors_hex]
-        num_colors = len(gradient_colors_rgb)
-        
-        # 3. 各ピクセルを計算
-        if num_colors == 2:
-             # 2色の場合は元の処理と同じ（線形グラデーション）
-             for x in range(FINAL_WIDTH):
-                 ratio = x / FINAL_WIDTH
-                 r = int(gradient_colors_rgb[0][0] * (1 - ratio) + gradient_colors_rgb[1][0] * ratio)
-                 g = int(gradient_colors_rgb[0][1] * (1 - ratio) + gradient_colors_rgb[1][1] * ratio)
-                 b = int(gradient_colors_rgb[0][2] * (1 - ratio) + gradient_colors_rgb[1][2] * ratio)
-                 draw.line([(x, 0), (x, FINAL_HEIGHT)], fill=(r, g, b))
-        else:
-            # 3色以上の場合は、各色を均等区間に配置したグラデーション
-            segment_width = FINAL_WIDTH / (num_colors - 1)
-            
-            for x in range(FINAL_WIDTH):
-                # 現在のx座標がどのセグメントに属するかを計算
-                segment_index = min(int(x / segment_width), num_colors - 2)
-                
-                # セグメント内の開始色と終了色
-                start_rgb = gradient_colors_rgb[segment_index]
-                end_rgb = gradient_colors_rgb[segment_index + 1]
-                
-                # セグメント内の割合を計算 (0.0 から 1.0)
-                segment_x_start = segment_index * segment_width
-                ratio = (x - segment_x_start) / segment_width
-                
-                # 色のブレンド
-                r = int(start_rgb[0] * (1 - ratio) + end_rgb[0] * ratio)
-                g = int(start_rgb[1] * (1 - ratio) + end_rgb[1] * ratio)
-                b = int(start_rgb[2] * (1 - ratio) + end_rgb[2] * ratio)
-                
-                draw.line([(x, 0), (x, FINAL_HEIGHT)], fill=(r, g, b))
-    
-    # --- 上セクションの配置（リーダー → デッキ名 → QR） ---
-    
-    GAP = 48 
-    
-    LEADER_CROPPED_HEIGHT = UPPER_HEIGHT 
-    LEADER_CROPPED_WIDTH = int(LEADER_CROPPED_HEIGHT * (400 / 280)) 
-    LEADER_TARGET_SIZE = (LEADER_CROPPED_WIDTH, LEADER_CROPPED_HEIGHT) 
-    
-    QR_SIZE = 400
-    
-    DECK_NAME_AREA_WIDTH = FINAL_WIDTH - (GAP * 3) - LEADER_CROPPED_WIDTH - QR_SIZE 
-
-    leader_x = GAP 
-    deck_name_area_start_x = leader_x + LEADER_CROPPED_WIDTH + GAP 
-    qr_x = deck_name_area_start_x + DECK_NAME_AREA_WIDTH + GAP 
-    
-    leader_y = 0 
-    qr_y = (UPPER_HEIGHT - QR_SIZE) // 2 
-
-    # 1. リーダー画像を配置 
-    try:
-        # 💡 修正: dfを引数に追加
-        _, leader_img = download_card_image(leader['カードID'], df, LEADER_TARGET_SIZE, crop_top_half=True) 
-        if leader_img:
-            img.paste(leader_img, (leader_x, leader_y), leader_img) 
-    except:
-        pass
-
-    # 3. QRコードを配置 
-    img.paste(qr_img.convert("RGBA"), (qr_x, qr_y), qr_img.convert("RGBA"))
-    
-    # 2. デッキ名（中央）
-    if deck_name:
-        FONT_SIZE = 70
-        font_name = None 
-        
-        # 💡 最終修正: アプリに同梱したフォントを最優先で試行する
-        # ファイル名: meiryo.ttc (事前にアップロードが必要です)
-        BUNDLED_FONT_PATH = "meiryo.ttc"
-
-        # Streamlit Cloud環境での文字化け対策として、以下の順で試行
-        font_paths_to_try = [
-            # 1. アプリに同梱したフォント（最優先）
-            (BUNDLED_FONT_PATH, None),
-            
-            # 2. 前回の修正で試したStreamlit Cloud/Linux 環境の標準パス
-            ("/usr/share/fonts/truetype/noto/NotoSansJP-Regular.otf", None),
-            ("/usr/share/fonts/opentype/noto/NotoSansCJKjp-Regular.otf", None),
-            ("/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc", 0), 
-            ("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", None),
-            ("/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf", None),
-
-            # 3. ローカル Windows のパス (Streamlit Cloudでは無視される)
-            ("C:\\Windows\\Fonts\\meiryo.ttc", 0),
-            ("C:\\Windows\\Fonts\\msgothic.ttc", 0),
-        ]
-        
-        for path, index in font_paths_to_try:
-            try:
-                if os.path.exists(path): # ファイルが存在するかチェックを追加
-                    if index is not None:
-                        font_name = ImageFont.truetype(path, FONT_SIZE, index=index)
-                    else:
-                        font_name = ImageFont.truetype(path, FONT_SIZE)
-                    break # 成功したらループを抜ける
-            except IOError:
-                continue # 次のフォントを試す
-
-        # 💡 最終フォールバック
-        if font_name is None:
-             font_name = ImageFont.load_default() 
-        
-        try:
-            # 描画処理
-            bbox = draw.textbbox((0, 0), deck_name, font=font_name)
-            text_width = bbox[2] - bbox[0]
-            text_height = bbox[3] - bbox[1]
-            
-            BG_HEIGHT = text_height + 40 
-            bg_x1 = deck_name_area_start_x + 50 
-            bg_x2 = deck_name_area_start_x + DECK_NAME_AREA_WIDTH - 50
-            bg_y1 = (UPPER_HEIGHT - BG_HEIGHT) // 2
-            bg_y2 = bg_y1 + BG_HEIGHT
-
-            overlay = Image.new('RGBA', (FINAL_WIDTH, FINAL_HEIGHT), (0, 0, 0, 0))
-            overlay_draw = ImageDraw.Draw(overlay)
-            overlay_draw.rectangle([bg_x1, bg_y1, bg_x2, bg_y2], fill=(0, 0, 0, 128))
-            
-            img = Image.alpha_composite(img, overlay)
-            draw = ImageDraw.Draw(img) 
-
-            text_x = bg_x1 + (bg_x2 - bg_x1 - text_width) // 2
-            text_y = bg_y1 + 20 
-
-            draw.text((text_x, text_y), deck_name, fill="white", font=font_name)
-            
-        except Exception as e:
-            # 描画中にエラーが発生した場合の最終手段（最終フォールバック）
-            try:
-                # デフォルトフォントで再描画を試みる（このfont_nameは小さいが、表示はされる）
-                font_name = ImageFont.load_default()
-                bbox = draw.textbbox((0, 0), deck_name, font=font_name)
-                text_width = bbox[2] - bbox[0]
-                text_height = bbox[3] - bbox[1]
-                
-                BG_HEIGHT = text_height + 40 
-                bg_x1 = deck_name_area_start_x + 50 
-                bg_x2 = deck_name_area_start_x + DECK_NAME_AREA_WIDTH - 50
-                bg_y1 = (UPPER_HEIGHT - BG_HEIGHT) // 2
-                bg_y2 = bg_y1 + BG_HEIGHT
-
-                overlay = Image.new('RGBA', (FINAL_WIDTH, FINAL_HEIGHT), (0, 0, 0, 0))
-                overlay_draw = ImageDraw.Draw(overlay)
-                overlay_draw.rectangle([bg_x1, bg_y1, bg_x2, bg_y2], fill=(0, 0, 0, 128))
-                
-                img = Image.alpha_composite(img, overlay)
-                draw = ImageDraw.Draw(img) 
-
-                text_x = bg_x1 + (bg_x2 - bg_x1 - text_width) // 2
-                text_y = bg_y1 + 20 
-
-                draw.text((text_x, text_y), deck_name, fill="white", font=font_name)
-            except:
-                pass # 完全に失敗した場合は何もしない
-    
-    # 下セクション：デッキカード（10x5グリッド）
-    y_start = UPPER_HEIGHT 
-    x_start = (FINAL_WIDTH - (card_width * cards_per_row + margin_card * (cards_per_row - 1))) // 2
-    
-    all_deck_cards = []
-    for card_info in deck_cards_sorted:
-        all_deck_cards.extend([card_info['card_id']] * card_info['count'])
-    
-    card_images = {}
-    cards_to_download = set(all_deck_cards[:cards_per_row * cards_per_col])
-    
-    # 💡 修正: ThreadPoolExecutorを削除し、同期的なダウンロードに変更
-    # Pyodide/Streamlit Cloudなどの環境でマルチスレッドがエラーになるため
-    with st.spinner("カード画像をダウンロード中..."):
-        for card_id in cards_to_download:
-            # 💡 修正: dfを引数に追加
-            card_id, card_img = download_card_image(card_id, df, (card_width, card_height))
-            if card_img:
-                card_images[card_id] = card_img
-    
-    for idx, card_id in enumerate(all_deck_cards):
-        if idx >= cards_per_row * cards_per_col:
-            break
-        
-        row = idx // cards_per_row
-        col = idx % cards_per_row
-        
-        x = x_start + col * (card_width + margin_card)
-        y = y_start + row * (card_height + margin_card)
-        
-        if card_id in card_images:
-            img.paste(card_images[card_id], (x, y), card_images[card_id])
-    
-    return img.convert('RGB')
+# 💡 修正: カード画像のディスクキャッシュとサムネイルは DeckEngine がプロセス内で1つだけ生成して共有する
+def card_thumbnail_source(card_id, image_url):
+    """st.image に渡す一覧表示用の画像を返す
+    サムネイルが作成済みならそのバイト列、まだなら元画像のURLを返し、裏でサムネイルを作成する"""
+    url = resolve_image_url(card_id, image_url)
+    thumbnail_store = engine.thumbnail_store
+    content = thumbnail_store.get_bytes(card_id, url, "grid")
+    if content is None:
+        thumbnail_store.prefetch([(card_id, url)])
+        return url
+    return content
+
+# 💡 修正: 描画処理は Streamlit に依存しない deck_image.render_deck_image に移動（バッチ処理と共用）
+# 💡 追加: 出力形式ごとにエンコードしたバイト列をキャッシュする（ダウンロードボタンなどの再実行ではエンコードし直さない）
+# 形式だけ変えた場合は描き直すが、背景・リーダー・サムネイルはメモ化されているので軽い
+@st.cache_data(ttl=3600, max_entries=32, show_spinner=False)
+def encode_deck_image(leader, deck_dict, card_signature, deck_name, compact_qr, output_format, quality, max_bytes):
+    """デッキ画像（カード画像＋QRコード付き、2150x2048）を描画・エンコードし、
+    (ダウンロード用の EncodedImage, 表示用に縮小した EncodedImage) を返す
+    card_signature はキャッシュキーにだけ使う（カードテーブルが変わったら描き直す。df 全体はハッシュしない）"""
+    with st.spinner("カード画像をダウンロード中..."), metrics.span("deck_image.render"):
+        deck_img = engine.render_deck_image(leader, deck_dict, deck_name, compact_qr=compact_qr)
+    with metrics.span("deck_image.encode"):
+        encoded = engine.encode_deck_image(deck_img, output_format, quality=quality, max_bytes=max_bytes)
+        preview = encode_preview(deck_img)
+    metrics.incr("deck_image_encoded_bytes", len(encoded.data))
+    return encoded, preview
+
+# 💡 修正: 保存済みデッキのストア（一覧・読み込み・保存・削除）も DeckEngine が持ち、全セッションで共有する
+deck_store = engine.deck_store
+
+# 💡 追加: 保存済みの全デッキをまとめて検証する（保存内容・レギュレーション・カードテーブルが変わると作り直す）
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_saved_deck_violations(store_fingerprint, regulation, card_signature):
+    """{デッキ名: 枚数以外の違反のリスト}（違反のあるデッキのみ）"""
+    decks = list(deck_store.load_all())
+    results = engine.validator(regulation.format_id).validate_many(decks)
+    violations = {}
+    for deck, deck_violations in zip(decks, results):
+        deck_violations = [v for v in deck_violations if v.code != DECK_SIZE]
+        if deck_violations:
+            violations[deck.name] = deck_violations
+    return violations
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_deck_index(store_fingerprint):
+    """保存済みデッキの枚数行列（保存内容が変わると store_fingerprint が変わり、作り直す）"""
+    return DeckIndex.from_store(deck_store)
+
+# デッキをストアに保存する（カードはプレビューと同じ順に並べる）
+save_deck = engine.save_deck
+
+# 💡 追加: 同じ画像を何度も読まないよう、アップロード内容のハッシュごとに読み取り結果をキャッシュする
+@st.cache_data(max_entries=32, show_spinner=False)
+def read_qr_codes(upload_hash, _data):
+    """アップロード画像に写っているQRコードの文字列をすべて返す（_data はキャッシュキーに含めない）"""
+    with metrics.span("qr.read"):
+        return engine.decode_qr_image(_data)
+
+# 💡 追加: 計測結果の表示（スパンごとの回数・平均・最大、カウンター、Prometheus 形式のダウンロード）
+def render_metrics_panel():
+    with st.sidebar.expander("🛠️ 計測（管理者用）"):
+        snap = metrics.snapshot()
+        if snap["timers"]:
+            st.dataframe(pd.DataFrame([
+                {"スパン": name, "回数": t["count"], "平均 (ms)": round(t["mean"] * 1000, 2),
+                 "最大 (ms)": round(t["max"] * 1000, 2), "合計 (s)": round(t["total"], 3)}
+                for name, t in snap["timers"].items()
+            ]), hide_index=True)
+        if snap["counters"]:
+            st.dataframe(pd.DataFrame(
+                [{"カウンター": name, "値": value} for name, value in snap["counters"].items()]
+            ), hide_index=True)
+        hits_info = card_index.filter_cache_info()
+        st.caption(f"検索結果のキャッシュ: ヒット {hits_info[0]} / ミス {hits_info[1]}（{hits_info[2]} 件保持）")
+        st.download_button("📥 Prometheus 形式でダウンロード", metrics.render_prometheus(),
+                           file_name="metrics.txt", mime="text/plain", key="metrics_download")
+        if st.button("🔄 リセット", key="metrics_reset"):
+            metrics.reset()
+            st.rerun()
 
 # ===============================
 # 🎯 モード切替
@@ -720,32 +359,43 @@ if st.session_state["mode"] == "検索":
     # 選択に応じてセッションステートを更新する処理はコールバックに移譲したため削除
 
     
-    colors = st.sidebar.multiselect("色を選択", color_order, key="search_colors")
-    types = st.sidebar.multiselect("タイプを選択", list(type_priority.keys()), key="search_types")
-    costs = st.sidebar.multiselect("コストを選択", sorted(df["コスト数値"].unique()), key="search_costs")
-    counters = st.sidebar.multiselect("カウンターを選択", sorted(df["カウンター"].unique()), key="search_counters")
+    # 💡 修正: 選択肢は CardIndex が読み込み時に前計算したもの（再実行のたびに df を走査しない）
+    # 各選択肢には「ほかの条件をすべて満たすカードの件数」を付ける（条件は直前の入力値）
+    facet_options = card_index.facet_options
+    with metrics.span("search.facets"):
+        search_facets = card_index.facet_counts(
+            colors=st.session_state.get("search_colors"), types=st.session_state.get("search_types"),
+            costs=st.session_state.get("search_costs"), counters=st.session_state.get("search_counters"),
+            attributes=st.session_state.get("search_attributes"), blocks=st.session_state.get("search_blocks"),
+            feature_selected=st.session_state.get("search_features"), series_ids=st.session_state.get("search_series_ids"),
+            free_words=st.session_state.get("search_free", ""), parallel_mode=st.session_state["parallel_filter_search"]
+        )
+    
+    colors = st.sidebar.multiselect("色を選択", color_order, format_func=facet_label(search_facets["colors"]), key="search_colors")
+    types = st.sidebar.multiselect("タイプを選択", list(type_priority.keys()), format_func=facet_label(search_facets["types"]), key="search_types")
+    costs = st.sidebar.multiselect("コストを選択", facet_options["costs"], format_func=facet_label(search_facets["costs"]), key="search_costs")
+    counters = st.sidebar.multiselect("カウンターを選択", facet_options["counters"], format_func=facet_label(search_facets["counters"]), key="search_counters")
     
-    all_attributes = sorted({attr for lst in df["属性リスト"] for attr in lst if attr})
-    attributes = st.sidebar.multiselect("属性を選択", all_attributes, key="search_attributes")
+    attributes = st.sidebar.multiselect("属性を選択", facet_options["attributes"], format_func=facet_label(search_facets["attributes"]), key="search_attributes")
     
-    blocks = st.sidebar.multiselect("ブロックアイコン", sorted(df["ブロックアイコン"].unique()), key="search_blocks")
+    blocks = st.sidebar.multiselect("ブロックアイコン", facet_options["blocks"], format_func=facet_label(search_facets["blocks"]), key="search_blocks")
     
-    all_features = sorted({f for lst in df["特徴リスト"] for f in lst if f})
-    feature_selected = st.sidebar.multiselect("特徴を選択", all_features, key="search_features")
+    feature_selected = st.sidebar.multiselect("特徴を選択", facet_options["feature_selected"], format_func=facet_label(search_facets["feature_selected"]), key="search_features")
     
     # シリーズIDフィルタ 
-    all_series_ids = sorted([s for s in df["シリーズID"].unique() if s != "-"])
-    series_ids = st.sidebar.multiselect("入手シリーズを選択", all_series_ids, key="search_series_ids")
+    series_ids = st.sidebar.multiselect("入手シリーズを選択", facet_options["series_ids"], format_func=facet_label(search_facets["series_ids"]), key="search_series_ids")
 
     # フリーワード検索
     free_words = st.sidebar.text_input("フリーワード検索（スペース区切り可）", key="search_free")
     
     # --- 検索ロジック (常に実行) ---
-    st.session_state["search_results"] = filter_cards(
-        df, colors, types, costs, counters, attributes, blocks, feature_selected, free_words, 
-        series_ids=series_ids, 
-        parallel_mode=st.session_state["parallel_filter_search"] # 💡 修正: パラレルフィルタの適用
-    )
+    with metrics.span("search.filter"):
+        st.session_state["search_results"] = filter_cards(
+            df, colors, types, costs, counters, attributes, blocks, feature_selected, free_words, 
+            series_ids=series_ids, 
+            parallel_mode=st.session_state["parallel_filter_search"], # 💡 修正: パラレルフィルタの適用
+            card_index=card_index # 💡 追加: 転置インデックスで検索
+        )
     
     results = st.session_state["search_results"]
     
@@ -765,25 +415,33 @@ if st.session_state["mode"] == "検索":
     st.session_state["search_cols"] = selected_cols
     
     cols_count = st.session_state["search_cols"]
+    
+    # 💡 修正: 全件ではなく表示中のページだけを描画する（検索条件が変わったら1ページ目に戻す）
+    search_token = [colors, types, costs, counters, attributes, blocks, feature_selected, series_ids, free_words, 
+                    st.session_state["parallel_filter_search"]]
+    start, stop, page, page_count = get_page_range(len(results), "search_page", search_token)
+    render_pager("search_page", start, stop, len(results), page, page_count, "top")
+    
     cols = st.columns(cols_count) 
-    for idx, (_, row) in enumerate(results.iterrows()):
-        card_id = row['カードID']
-        
+    grid_started = metrics.clock()
+    # 💡 修正: iterrows() ではなく必要な列だけを itertuples() で読む
+    page_rows = results.iloc[start:stop][["カードID", "カード名", "画像URL", "is_parallel"]]
+    for idx, (card_id, card_name, image_url, is_parallel) in enumerate(page_rows.itertuples(index=False, name=None), start=start):
         # 💡 修正: カスタムカードの画像URLを使用するロジックを追加
-        image_url = row['画像URL']
-        if pd.notna(image_url) and str(image_url).startswith(("http", "https")):
-             img_url = str(image_url)
-        else:
-             img_url = f"https://www.onepiece-cardgame.com/images/cardlist/card/{card_id}.png"
+        # 💡 修正: 一覧表示は縮小済みのサムネイルを使う（未作成なら元画像のURL）
+        img_url = card_thumbnail_source(card_id, image_url)
         
         with cols[idx % cols_count]: 
-            caption_text = f"{row['カード名']} ({card_id})"
+            caption_text = f"{card_name} ({card_id})"
             # 💡 修正: パラレルマークの追加
-            if row['is_parallel']:
+            if is_parallel:
                 caption_text = f"✨P {caption_text}"
                 
             # 💡 修正: use_column_width=True を use_container_width=True に置き換え
             st.image(img_url, use_container_width=True) 
+    metrics.observe_since("search.render_grid", grid_started)
+    
+    render_pager("search_page", start, stop, len(results), page, page_count, "bottom")
 
 # ===============================
 # 🧱 デッキ作成モード
@@ -797,13 +455,11 @@ else:
     
     leader = st.session_state.get("leader")
     if leader is not None:
-        # 💡 修正: is_parallel=False のリーダーカード情報を優先して表示
-        leader_display = df[(df["カードID"] == leader['カードID']) & (df["is_parallel"] == False)]
-        if leader_display.empty:
-            leader_display = df[df["カードID"] == leader['カードID']]
+        # 💡 修正: is_parallel=False のリーダーカード情報を優先して表示（card_lookup で O(1)）
+        leader_display = card_lookup.get(leader['カードID'])
             
-        if not leader_display.empty:
-            leader_name = leader_display.iloc[0]['カード名']
+        if leader_display is not None:
+            leader_name = leader_display['カード名']
             st.sidebar.markdown(f"**リーダー:** {leader_name} ({leader['カードID']})")
         else:
             st.sidebar.markdown(f"**リーダー:** {leader['カードID']}")
@@ -813,21 +469,27 @@ else:
         if deck_name_input != st.session_state.get("deck_name", ""):
             st.session_state["deck_name"] = deck_name_input
     
+    # 💡 追加: フォーマットが複数あるときだけ選べるようにする
+    if len(regulation_table.formats) > 1:
+        st.sidebar.selectbox(
+            "レギュレーション", list(regulation_table.formats), index=list(regulation_table.formats).index(regulation_table.default),
+            format_func=lambda format_id: regulation_table.formats[format_id].label, key="regulation_format"
+        )
+    regulation = regulation_table.formats.get(st.session_state.get("regulation_format"), regulation_table.get())
+    deck_size = regulation.deck_size
+    
+    deck_list_started = metrics.clock()
     total_cards = sum(st.session_state["deck"].values())
-    st.sidebar.markdown(f"**合計カード:** {total_cards}/50")
+    st.sidebar.markdown(f"**合計カード:** {total_cards}/{deck_size}")
     
     if st.session_state["deck"]:
         deck_cards = []
         for card_id, count in st.session_state["deck"].items():
-            # 💡 修正: is_parallel=False のカード情報を優先して取得
-            card_row_base = df[(df["カードID"] == card_id) & (df["is_parallel"] == False)]
-            if card_row_base.empty:
-                card_row = df[df["カードID"] == card_id].iloc[0]
-            else:
-                card_row = card_row_base.iloc[0]
+            # 💡 修正: is_parallel=False のカード情報を優先して取得（card_lookup で O(1)）
+            card_row = card_lookup[card_id]
                 
-            # ソートキーを再計算 (元のコードのソートキー取得ロジックに合わせる)
-            base_priority, type_rank, sub_priority, multi_flag = card_row["ソートキー"]
+            # ソートキーを取得 (元のコードのソートキー取得ロジックに合わせる)
+            base_priority, type_rank = card_row["色順位"], card_row["タイプ順位"]
             deck_cards.append({
                 "card_id": card_id,
                 "count": count,
@@ -845,7 +507,9 @@ else:
             col_name, col_add, col_del = st.sidebar.columns([4, 1, 1])
             
             current = st.session_state["deck"].get(card_info['card_id'], 0)
-            is_unlimited = card_info['card_id'] in UNLIMITED_CARDS
+            # 💡 修正: 上限枚数はレギュレーションから（None は無制限、禁止カードは 0）
+            copy_limit = regulation.copy_limit(card_info['card_id'])
+            can_add = copy_limit is None or current < copy_limit
             
             with col_name:
                 # 名前と枚数、IDをコンパクトに表示
@@ -853,8 +517,8 @@ else:
             
             with col_add:
                 if st.button("＋", key=f"add_sidebar_{card_info['card_id']}", width='stretch', 
-                             disabled=(not is_unlimited and current >= 4)):
-                    if is_unlimited or current < 4:
+                             disabled=not can_add):
+                    if can_add:
                         st.session_state["deck"][card_info['card_id']] = current + 1
                         st.rerun()
             with col_del:
@@ -869,11 +533,23 @@ else:
             
             st.sidebar.markdown("---")
     
-    if total_cards > 50:
-        st.sidebar.error("⚠️ 50枚を超えています！")
-    elif total_cards < 50:
-        st.sidebar.info(f"残り {50 - total_cards} 枚を追加できます。")
-    else:
+    metrics.observe_since("sidebar.deck_list", deck_list_started)
+    
+    # 💡 追加: 枚数以外のルール（禁止・制限カード、上限枚数、リーダーの色）は deck_rules でまとめて検証する
+    deck_violations = []
+    if leader is not None:
+        deck_violations = [
+            v for v in engine.validate(leader['カードID'], st.session_state["deck"], regulation.format_id)
+            if v.code != DECK_SIZE
+        ]
+    for violation in deck_violations:
+        st.sidebar.error(f"⚠️ {violation.message}")
+    
+    if total_cards > deck_size:
+        st.sidebar.error(f"⚠️ {deck_size}枚を超えています！")
+    elif total_cards < deck_size:
+        st.sidebar.info(f"残り {deck_size - total_cards} 枚を追加できます。")
+    elif not deck_violations:
         st.sidebar.success("✅ デッキが完成しました！")
     
     # デッキ管理
@@ -884,40 +560,15 @@ else:
         st.session_state["deck_view"] = "preview"
         st.rerun()
     
-    SAVE_DIR = "saved_decks"
-    os.makedirs(SAVE_DIR, exist_ok=True)
+    # 💡 修正: 保存先は saved_decks/ のファイルから deck_store に変更
     
     # エクスポート機能（ロジック修正なし）
     if st.sidebar.button("📤 デッキをエクスポート"):
         if leader is None:
             st.sidebar.warning("リーダーを選択してください。")
         else:
-            export_lines = []
-            if st.session_state["deck_name"]:
-                export_lines.append(f"# {st.session_state['deck_name']}")
-            export_lines.append(f"1x{leader['カードID']}")
-            
-            deck_cards_sorted = []
-            for card_id, count in st.session_state["deck"].items():
-                # 💡 修正: is_parallel=False のカード情報を優先して取得
-                card_row_base = df[(df["カードID"] == card_id) & (df["is_parallel"] == False)]
-                if card_row_base.empty:
-                    card_row = df[df["カードID"] == card_id].iloc[0]
-                else:
-                    card_row = card_row_base.iloc[0]
-                    
-                base_priority, type_rank, _, _ = card_row["ソートキー"]
-                deck_cards_sorted.append({
-                    "card_id": card_id,
-                    "count": count,
-                    "new_sort_key": (type_rank, card_row["コスト数値"], base_priority, card_id),
-                })
-            deck_cards_sorted.sort(key=lambda x: x["new_sort_key"])
-            
-            for card_info in deck_cards_sorted:
-                export_lines.append(f"{card_info['count']}x{card_info['card_id']}")
-            
-            export_text = "\n".join(export_lines)
+            # 💡 修正: テキスト化は deck_codec に共通化（並び順はプレビューと同じ）
+            export_text = engine.format_deck(st.session_state['deck_name'], leader['カードID'], st.session_state["deck"])
             st.sidebar.text_area("エクスポートされたデッキ", export_text, height=200)
             st.sidebar.download_button(
                 label="📥 テキストファイルとしてダウンロード",
@@ -927,26 +578,65 @@ else:
             )
     
     # デッキ画像生成 (キャッシュのおかげで高速化)
+    # 💡 追加: QRコードの形式（短縮形式はこのアプリ専用だが、QRコードが小さく読み取りやすい）
+    compact_qr = st.sidebar.checkbox(
+        "QRコードを短縮形式にする", value=True, key="compact_qr",
+        help="オフにすると、一般のQRリーダーでも読めるテキスト形式のデッキリストを入れます（QRコードは大きくなります）。"
+    )
+    # 💡 追加: 画像の形式。PNG は劣化しないが数MBになりエンコードも遅い。JPEG / WebP は数分の1の大きさで、
+    # 「サイズ上限を指定」は上限に収まるまで JPEG の画質を下げる（それでも収まらなければ縮小する）
+    image_format = st.sidebar.selectbox(
+        "画像の形式", list(OUTPUT_FORMATS), format_func=lambda f: OUTPUT_FORMATS[f][0], key="image_format"
+    )
+    image_quality = None
+    image_max_bytes = None
+    if OUTPUT_FORMATS[image_format][1]:
+        image_quality = st.sidebar.slider(
+            "画質", min_value=40, max_value=100, value=DEFAULT_QUALITY[image_format], step=5, key=f"image_quality_{image_format}"
+        )
+    elif image_format == "budget":
+        image_max_bytes = int(st.sidebar.number_input(
+            "サイズの上限 (KB)", min_value=100, max_value=10000, value=DEFAULT_MAX_BYTES // 1000, step=100, key="image_max_kb"
+        )) * 1000
+
+    # 💡 修正: 生成したデッキを覚えておき、再実行でもプレビューとダウンロードボタンを出し続ける
+    # （デッキ・デッキ名・QRコードの形式が変わったら消す。画像の形式だけ変えた場合はキャッシュ済みの画像からエンコードし直す）
+    deck_image_key = None
+    if leader is not None:
+        deck_image_key = (
+            leader["カードID"], leader.get("画像URL"), tuple(sorted(st.session_state["deck"].items())),
+            st.session_state.get("deck_name", ""), compact_qr
+        )
     if st.sidebar.button("🖼️ デッキ画像を生成"):
         if leader is None:
             st.sidebar.warning("リーダーを選択してください。")
         else:
-            with st.spinner("画像を生成中...（初回はカードダウンロードが同期処理のため時間がかかる場合があります）"):
-                deck_name = st.session_state.get("deck_name", "")
-                deck_img = create_deck_image(leader, st.session_state["deck"], df, deck_name) # 💡 dfを渡す
-                buf = io.BytesIO()
-                deck_img.save(buf, format="PNG")
-                buf.seek(0)
-                # 💡 修正: use_column_width=True を use_container_width=True に置き換え
-                st.sidebar.image(deck_img, caption="デッキ画像（QRコード付き）", use_container_width=True) 
-                
-                file_name = f"{deck_name}_deck.png" if deck_name else "deck_image.png"
-                st.sidebar.download_button(
-                    label="📥 画像をダウンロード",
-                    data=buf,
-                    file_name=file_name,
-                    mime="image/png"
-                )
+            st.session_state["deck_image_key"] = deck_image_key
+    if st.session_state["deck_image_key"] != deck_image_key:
+        st.session_state["deck_image_key"] = None
+
+    if st.session_state["deck_image_key"] is not None:
+        with st.spinner("画像を生成中...（初回はカード画像のダウンロードに時間がかかる場合があります）"):
+            deck_name = st.session_state.get("deck_name", "")
+            encoded, preview = encode_deck_image(
+                leader, st.session_state["deck"], engine.card_signature, deck_name,
+                compact_qr, image_format, image_quality, image_max_bytes
+            )
+        # 💡 修正: 表示は縮小した JPEG にする（フル解像度の PIL 画像を渡すと、再実行のたびに PNG にエンコードして送る）
+        width, height = encoded.size
+        st.sidebar.image(
+            preview.data,
+            caption=f"デッキ画像（QRコード付き）{encoded.format} {width}x{height}・{format_size(len(encoded.data))}",
+            use_container_width=True
+        )
+
+        file_name = f"{deck_name}_deck{encoded.extension}" if deck_name else f"deck_image{encoded.extension}"
+        st.sidebar.download_button(
+            label="📥 画像をダウンロード",
+            data=encoded.data,
+            file_name=file_name,
+            mime=encoded.mime_type
+        )
     
     # インポート機能（OpenCV対応で修正）
     st.sidebar.markdown("---")
@@ -961,61 +651,72 @@ else:
     
     if uploaded_qr is not None:
         try:
-            # 💡 OpenCVで画像を読み込み
-            file_bytes = np.asarray(bytearray(uploaded_qr.read()), dtype=np.uint8)
-            qr_image_cv = cv2.imdecode(file_bytes, cv2.IMREAD_COLOR)
-
-            detector = cv2.QRCodeDetector()
-            # 💡 QRコード検出とデータ取得
-            qr_data, points, straight_qrcode = detector.detectAndDecode(qr_image_cv)
+            # 💡 修正: 縮小したグレースケール画像 → ROI → タイルの順に読む（deck_qr）。1枚の写真に複数のQRコードがあってもよい
+            # 結果はアップロード内容のハッシュごとにキャッシュするので、ボタン操作などの再実行では読み直さない
+            qr_bytes = uploaded_qr.getvalue()
+            qr_texts = read_qr_codes(hashlib.sha256(qr_bytes).hexdigest(), qr_bytes)
             
-            if qr_data:
-                st.sidebar.success("QRコードを読み取りました！")
-                
-                lines = [line.strip() for line in qr_data.strip().split("\n") if line.strip()]
-                
-                imported_deck_name = ""
-                start_idx = 0
-                if lines and lines[0].startswith("#"):
-                    imported_deck_name = lines[0][1:].strip()
-                    start_idx = 1
+            # 💡 修正: デッキリストの解析は deck_codec に共通化（存在しないカードIDの行は読み飛ばす）
+            # 短縮形式・テキスト形式のどちらのQRコードも読める
+            qr_decks = []
+            for qr_data in qr_texts:
+                try:
+                    imported = engine.decode_deck_code(qr_data)
+                except DeckParseError as e:
+                    st.sidebar.error(str(e))
+                    continue
+                # 💡 修正: is_parallel=False のカードを優先して取得（card_lookup で O(1)）
+                leader_row = card_lookup.row(df, imported.leader_id)
+                if leader_row is None:
+                    st.sidebar.error(f"リーダーカード {imported.leader_id} が見つかりません。")
+                    continue
+                qr_decks.append((imported, leader_row))
+            
+            def import_qr_deck(imported, leader_row):
+                st.session_state["leader"] = leader_row.to_dict()
+                st.session_state["deck"] = dict(imported.cards)
+                st.session_state["deck_name"] = imported.name
                 
-                if start_idx < len(lines):
-                    first_line = lines[start_idx]
-                    
-                    if "x" not in first_line:
-                        raise ValueError("デッキリスト形式が不正です（リーダー行に'x'がない）。")
-                        
-                    leader_count, leader_id = first_line.split("x")
-                        
-                    # 💡 修正: is_parallel=False のカードを優先して取得
-                    leader_row = df[(df["カードID"] == leader_id) & (df["is_parallel"] == False)]
-                    if leader_row.empty:
-                        leader_row = df[df["カードID"] == leader_id]
-                        
-                    if not leader_row.empty:
-                        st.session_state["leader"] = leader_row.iloc[0].to_dict()
-                        st.session_state["deck"] = {}
-                        st.session_state["deck_name"] = imported_deck_name
-                        
-                        for line in lines[start_idx + 1:]:
-                            if "x" in line:
-                                count, card_id = line.split("x")
-                                count = int(count)
-                                # 💡 修正: 通常版のカードIDが存在するかチェック
-                                if card_id in df["カードID"].values: # 通常版、パラレル版問わず存在すればOK
-                                    st.session_state["deck"][card_id] = count
-                        
-                        st.session_state["deck_view"] = "preview"
-                        st.sidebar.success("デッキをインポートしました！")
+                st.session_state["deck_view"] = "preview"
+                st.sidebar.success("デッキをインポートしました！")
+                st.session_state["qr_upload_key"] += 1 
+                st.rerun()
+            
+            if not qr_texts:
+                st.sidebar.warning("QRコードが検出されませんでした。")
+            elif len(qr_decks) == 1:
+                st.sidebar.success("QRコードを読み取りました！")
+                import_qr_deck(*qr_decks[0])
+            elif qr_decks:
+                # 💡 追加: 複数のデッキ（大会のデッキシートなど）は、1つ選んで読み込むか、まとめてローカル保存する
+                st.sidebar.success(f"{len(qr_decks)} 個のデッキのQRコードを読み取りました！")
+                qr_labels = [
+                    f"{i + 1}. {imported.name or '（名前なし）'} / {leader_row['カード名']}（{sum(imported.cards.values())}枚）"
+                    for i, (imported, leader_row) in enumerate(qr_decks)
+                ]
+                selected_qr = st.sidebar.selectbox(
+                    "読み込むデッキ", range(len(qr_decks)), format_func=qr_labels.__getitem__, key="qr_deck_choice"
+                )
+                col_qr_load, col_qr_save = st.sidebar.columns(2)
+                if col_qr_load.button("📥 このデッキを読み込む", key="qr_import_one"):
+                    import_qr_deck(*qr_decks[selected_qr])
+                if col_qr_save.button("💾 すべて保存", key="qr_save_all"):
+                    # 💡 修正: 保存できない名前（「/」を含むなど）のデッキは飛ばして残りを保存し、どれを飛ばしたかを表示する
+                    rejected = []
+                    for i, (imported, leader_row) in enumerate(qr_decks):
+                        qr_deck_name = imported.name or f"QRインポート_{i + 1}"
+                        try:
+                            save_deck(qr_deck_name, imported.leader_id, imported.cards)
+                        except ValueError as e:
+                            rejected.append((qr_deck_name, str(e)))
+                    saved_count = len(qr_decks) - len(rejected)
+                    if saved_count:
+                        st.sidebar.success(f"{saved_count} 個のデッキを保存しました。")
+                    for qr_deck_name, message in rejected:
+                        st.sidebar.error(f"デッキ「{qr_deck_name}」は保存できませんでした: {message}")
+                    if not rejected:
                         st.session_state["qr_upload_key"] += 1 
                         st.rerun()
-                    else:
-                        st.sidebar.error(f"リーダーカード {leader_id} が見つかりません。")
-                else:
-                    st.sidebar.error("デッキリストが空か、リーダーが特定できませんでした。")
-            else:
-                st.sidebar.warning("QRコードが検出されませんでした。")
         except Exception as e:
             # 💡 OpenCVのエラーもキャッチできるように修正
             st.sidebar.error(f"QRコード読み取りエラー: {str(e)}")
@@ -1031,46 +732,25 @@ else:
             st.sidebar.warning("デッキリストを入力してください。")
         else:
             try:
-                lines = [line.strip() for line in import_text.strip().split("\n") if line.strip()]
-                if not lines:
-                    st.sidebar.error("有効なデッキリストがありません。")
+                # 💡 修正: デッキリストの解析は deck_codec に共通化（存在しないカードIDの行は読み飛ばす）
+                imported = engine.parse_deck(import_text)
+                leader_id = imported.leader_id
+                     
+                # 💡 修正: is_parallel=False のカードを優先して取得（card_lookup で O(1)）
+                leader_row = card_lookup.row(df, leader_id)
+                    
+                if leader_row is None:
+                    st.sidebar.error(f"リーダーカード {leader_id} が見つかりません。")
                 else:
-                    start_idx = 0
-                    imported_deck_name = ""
-                    if lines[0].startswith("#"):
-                        imported_deck_name = lines[0][1:].strip()
-                        start_idx = 1
+                    st.session_state["leader"] = leader_row.to_dict()
+                    st.session_state["deck"] = dict(imported.cards)
+                    st.session_state["deck_name"] = imported.name
                     
-                    if start_idx < len(lines):
-                        first_line = lines[start_idx]
-                        if "x" not in first_line:
-                             raise ValueError("デッキリスト形式が不正です（リーダー行に'x'がない）。")
-                             
-                        leader_count, leader_id = first_line.split("x")
-                             
-                        # 💡 修正: is_parallel=False のカードを優先して取得
-                        leader_row = df[(df["カードID"] == leader_id) & (df["is_parallel"] == False)]
-                        if leader_row.empty:
-                            leader_row = df[df["カードID"] == leader_id]
-                            
-                        if leader_row.empty:
-                            st.sidebar.error(f"リーダーカード {leader_id} が見つかりません。")
-                        else:
-                            st.session_state["leader"] = leader_row.iloc[0].to_dict()
-                            st.session_state["deck"] = {}
-                            st.session_state["deck_name"] = imported_deck_name
-                            
-                            for line in lines[start_idx + 1:]:
-                                if "x" in line:
-                                    count, card_id = line.split("x")
-                                    count = int(count)
-                                    # 💡 修正: 通常版のカードIDが存在するかチェック
-                                    if card_id in df["カードID"].values: # 通常版、パラレル版問わず存在すればOK
-                                        st.session_state["deck"][card_id] = count
-                            
-                            st.session_state["deck_view"] = "preview"
-                            st.sidebar.success("デッキをインポートしました！")
-                            st.rerun()
+                    st.session_state["deck_view"] = "preview"
+                    st.sidebar.success("デッキをインポートしました！")
+                    st.rerun()
+            except DeckParseError as e:
+                st.sidebar.error(str(e))
             except Exception as e:
                 st.sidebar.error(f"インポートエラー: {str(e)}")
     
@@ -1086,94 +766,60 @@ else:
         elif leader is None:
             st.sidebar.warning("リーダーを選択してください。")
         else:
-            save_lines = []
-            if current_deck_name:
-                save_lines.append(f"# {current_deck_name}")
-            save_lines.append(f"1x{leader['カードID']}")
-            
-            deck_cards_sorted = []
-            for card_id, count in st.session_state["deck"].items():
-                # 💡 修正: is_parallel=False のカード情報を優先して取得
-                card_row_base = df[(df["カードID"] == card_id) & (df["is_parallel"] == False)]
-                if card_row_base.empty:
-                    card_row = df[df["カードID"] == card_id].iloc[0]
-                else:
-                    card_row = card_row_base.iloc[0]
-                    
-                base_priority, type_rank, _, _ = card_row["ソートキー"]
-                deck_cards_sorted.append({
-                    "card_id": card_id,
-                    "count": count,
-                    "new_sort_key": (type_rank, card_row["コスト数値"], base_priority, card_id),
-                })
-            deck_cards_sorted.sort(key=lambda x: x["new_sort_key"])
-            
-            for card_info in deck_cards_sorted:
-                save_lines.append(f"{card_info['count']}x{card_info['card_id']}")
-                
-            save_text = "\n".join(save_lines)
-            
-            path = os.path.join(SAVE_DIR, f"{current_deck_name}.txt")
-            with open(path, "w", encoding="utf-8") as f:
-                f.write(save_text)
-            st.sidebar.success(f"デッキ「{current_deck_name}」を保存しました。")
-            st.rerun() # 保存後に選択肢を更新するためにリロード
-    
-    saved_files = [f[:-4] for f in os.listdir(SAVE_DIR) if f.endswith(".txt")]
+            # 💡 修正: 保存は deck_store に（書き込みはアトミック。並び順はプレビューと同じ）
+            try:
+                save_deck(current_deck_name, leader['カードID'], st.session_state["deck"])
+            except ValueError as e:
+                st.sidebar.error(f"デッキ「{current_deck_name}」は保存できませんでした: {e}")
+            else:
+                st.sidebar.success(f"デッキ「{current_deck_name}」を保存しました。")
+                st.rerun() # 保存後に選択肢を更新するためにリロード
     
     st.sidebar.markdown("---")
     st.sidebar.subheader("📂 デッキの読み込みと削除")
     
+    # 💡 修正: 一覧は毎回ディレクトリを走査せず、ストアの索引から引く（新しく保存した順）
+    # 保存数が多くても選びやすいよう、デッキ名・リーダーの色で絞り込める
+    col_query, col_color = st.sidebar.columns([2, 1])
+    with col_query:
+        saved_query = st.text_input("デッキ名で絞り込み", key="saved_deck_query")
+    with col_color:
+        saved_color = st.selectbox("色", ["すべて"] + color_order, key="saved_deck_color")
+    saved_files = [
+        summary.name for summary in deck_store.list_decks(
+            color=None if saved_color == "すべて" else saved_color, query=saved_query or None, order=ORDER_BY_UPDATED
+        )
+    ]
+    # 💡 追加: 禁止・制限カードの変更などでルールに合わなくなったデッキには ⚠️ を付ける
+    saved_violations = get_saved_deck_violations(
+        deck_store.fingerprint(), regulation, engine.card_signature
+    )
+    
     # デッキ読み込み
     col_load, col_del = st.sidebar.columns([3, 1])
     
     with col_load:
-        selected_load = st.selectbox("読み込みまたは削除するデッキ", ["選択なし"] + saved_files, key="select_deck_to_manage")
+        selected_load = st.selectbox(
+            "読み込みまたは削除するデッキ", ["選択なし"] + saved_files, key="select_deck_to_manage",
+            format_func=lambda name: f"⚠️ {name}" if name in saved_violations else name
+        )
     
     if selected_load != "選択なし":
         # 読み込みボタン
         if st.sidebar.button("📥 読み込む", key="load_saved_deck"):
-            path = os.path.join(SAVE_DIR, f"{selected_load}.txt")
-            try:
-                with open(path, "r", encoding="utf-8") as f:
-                    loaded_text = f.read()
-            except FileNotFoundError:
-                st.sidebar.error(f"ファイル {selected_load}.txt が見つかりません。")
-                st.rerun()
-                
-            lines = [line.strip() for line in loaded_text.strip().split("\n") if line.strip()]
+            # 💡 修正: ストアから読み込む（SQLite ならテキストの解析は不要。存在しないカードは読み飛ばす）
+            loaded = deck_store.load(selected_load, known_ids=card_lookup)
             
-            imported_deck_name = ""
-            start_idx = 0
-            if lines and lines[0].startswith("#"):
-                imported_deck_name = lines[0][1:].strip()
-                start_idx = 1
-            
-            if start_idx < len(lines):
-                first_line = lines[start_idx]
-                if "x" not in first_line:
-                    st.sidebar.error("読み込みファイルの内容が不正です。")
-                    st.rerun()
-
-                leader_count, leader_id = first_line.split("x")
+            if loaded is not None:
+                leader_id = loaded.leader_id
                 
-                # 💡 修正: is_parallel=False のカードを優先して取得
-                leader_row = df[(df["カードID"] == leader_id) & (df["is_parallel"] == False)]
-                if leader_row.empty:
-                    leader_row = df[df["カードID"] == leader_id]
-                    
-                if not leader_row.empty:
-                    st.session_state["leader"] = leader_row.iloc[0].to_dict()
-                    st.session_state["deck"] = {}
-                    st.session_state["deck_name"] = imported_deck_name
+                # 💡 修正: is_parallel=False のカードを優先して取得（card_lookup で O(1)）
+                leader_row = card_lookup.row(df, leader_id)
                     
-                    for line in lines[start_idx + 1:]:
-                        if "x" in line:
-                            count, card_id = line.split("x")
-                            count = int(count)
-                            # 💡 修正: 通常版のカードIDが存在するかチェック
-                            if card_id in df["カードID"].values: # 通常版、パラレル版問わず存在すればOK
-                                st.session_state["deck"][card_id] = count
+                if leader_row is not None:
+                    st.session_state["leader"] = leader_row.to_dict()
+                    st.session_state["deck"] = dict(loaded.cards)
+                    st.session_state["deck_name"] = loaded.name
                     
                     st.session_state["deck_view"] = "preview"
                     st.sidebar.success(f"デッキ「{selected_load}」を読み込みました。")
@@ -1188,14 +834,13 @@ else:
         # 💡 追加: 削除ボタン
         with col_del:
             if st.button("❌ 削除", key="delete_saved_deck"):
-                path = os.path.join(SAVE_DIR, f"{selected_load}.txt")
                 try:
-                    os.remove(path)
-                    st.sidebar.success(f"デッキ「{selected_load}」を削除しました。")
-                    st.session_state["deck_view"] = "leader" # 削除後は初期画面に戻す
-                    st.rerun() # ファイルリストを更新するためにリロード
-                except FileNotFoundError:
-                    st.sidebar.error(f"ファイル {selected_load}.txt が見つかりません。")
+                    if deck_store.delete(selected_load):
+                        st.sidebar.success(f"デッキ「{selected_load}」を削除しました。")
+                        st.session_state["deck_view"] = "leader" # 削除後は初期画面に戻す
+                        st.rerun() # ファイルリストを更新するためにリロード
+                    else:
+                        st.sidebar.error(f"デッキ「{selected_load}」が見つかりません。")
                 except Exception as e:
                     st.sidebar.error(f"削除エラー: {str(e)}")
             
@@ -1232,7 +877,7 @@ else:
             leaders = leaders[leaders["is_parallel"] == False]
         # "both" の場合はフィルタリングしない
         
-        leaders = leaders.sort_values(by=["ソートキー", "コスト数値", "カードID"], ascending=[True, True, True])
+        leaders = leaders.sort_values(by=SORT_KEY_COLUMNS + ["コスト数値", "カードID"], kind="stable")
         
         # 💡 モバイルでも見やすいように3列に固定
         cols = st.columns(3)
@@ -1240,11 +885,8 @@ else:
             card_id = row['カードID'] # 💡 追加: card_idを取得
             
             # 💡 修正: カスタムカードの画像URLを使用するロジックを追加
-            image_url = row['画像URL']
-            if pd.notna(image_url) and str(image_url).startswith(("http", "https")):
-                 img_url = str(image_url)
-            else:
-                 img_url = f"https://www.onepiece-cardgame.com/images/cardlist/card/{card_id}.png"
+            # 💡 修正: 一覧表示は縮小済みのサムネイルを使う（未作成なら元画像のURL）
+            img_url = card_thumbnail_source(card_id, row['画像URL'])
                  
             with cols[idx % 3]:
                 caption_text = f"{row['カード名']} ({card_id})"
@@ -1270,22 +912,14 @@ else:
         # リーダー表示
         col1, col2 = st.columns([1, 3])
         with col1:
-            # 💡 修正: is_parallel=False のカード情報を優先して取得
-            leader_display = df[(df["カードID"] == leader['カードID']) & (df["is_parallel"] == False)]
-            if leader_display.empty:
-                leader_display = df[df["カードID"] == leader['カードID']]
-                
-            if not leader_display.empty:
-                leader_row = leader_display.iloc[0]
-            else:
+            # 💡 修正: is_parallel=False のカード情報を優先して取得（card_lookup で O(1)）
+            leader_row = card_lookup.get(leader['カードID'])
+            if leader_row is None:
                 leader_row = leader
                 
             # 💡 修正: カスタムカードの画像URLを使用するロジックを追加
-            image_url = leader_row['画像URL']
-            if pd.notna(image_url) and str(image_url).startswith(("http", "https")):
-                 leader_img_url = str(image_url)
-            else:
-                 leader_img_url = f"https://www.onepiece-cardgame.com/images/cardlist/card/{leader['カードID']}.png"
+            # 💡 修正: 一覧表示は縮小済みのサムネイルを使う（未作成なら元画像のURL）
+            leader_img_url = card_thumbnail_source(leader['カードID'], leader_row['画像URL'])
                  
             # 💡 修正: use_column_width=True を use_container_width=True に置き換え
             st.image(leader_img_url, use_container_width=True) 
@@ -1308,14 +942,10 @@ else:
         if st.session_state["deck"]:
             deck_cards_sorted = []
             for card_id, count in st.session_state["deck"].items():
-                # 💡 修正: is_parallel=False のカード情報を優先して取得
-                card_row_base = df[(df["カードID"] == card_id) & (df["is_parallel"] == False)]
-                if card_row_base.empty:
-                    card_row = df[df["カードID"] == card_id].iloc[0]
-                else:
-                    card_row = card_row_base.iloc[0]
+                # 💡 修正: is_parallel=False のカード情報を優先して取得（card_lookup で O(1)）
+                card_row = card_lookup[card_id]
                     
-                base_priority, type_rank, sub_priority, multi_flag = card_row["ソートキー"]
+                base_priority, type_rank = card_row["色順位"], card_row["タイプ順位"]
                 deck_cards_sorted.append({
                     "card_id": card_id,
                     "count": count,
@@ -1333,11 +963,8 @@ else:
             for card_info in deck_cards_sorted:
                 
                 # 💡 修正: カスタムカードの画像URLを使用するロジックを追加
-                image_url = card_info['image_url']
-                if pd.notna(image_url) and str(image_url).startswith(("http", "https")):
-                     card_img_url = str(image_url)
-                else:
-                     card_img_url = f"https://www.onepiece-cardgame.com/images/cardlist/card/{card_info['card_id']}.png"
+                # 💡 修正: 一覧表示は縮小済みのサムネイルを使う（未作成なら元画像のURL）
+                card_img_url = card_thumbnail_source(card_info['card_id'], card_info['image_url'])
                      
                 with deck_cols[col_idx % 3]:
                     # 💡 修正: use_column_width=True を use_container_width=True に置き換え
@@ -1352,6 +979,31 @@ else:
         else:
             st.info("デッキにカードが追加されていません")
         
+        # 💡 追加: 保存済みデッキとの比較（疎行列の索引で、デッキ数が多くてもすぐに出る）
+        with st.expander("📊 保存済みデッキとの比較"):
+            deck_index = get_deck_index(deck_store.fingerprint())
+            if len(deck_index) == 0:
+                st.info("保存済みのデッキがありません。")
+            else:
+                st.markdown("**似ているデッキ**")
+                similar_decks = deck_index.similar(st.session_state["deck"], k=5, exclude=st.session_state.get("deck_name"))
+                if not similar_decks:
+                    st.caption("共通するカードのあるデッキはありません。")
+                for result in similar_decks:
+                    similar_leader = card_lookup.get(result.leader_id)
+                    similar_leader_name = similar_leader["カード名"] if similar_leader is not None else result.leader_id
+                    st.markdown(f"{result.score:.0%}　{result.name}（{similar_leader_name}）")
+                
+                st.markdown("**このリーダーのデッキでよく使われるカード**")
+                common_cards = deck_index.common_cards(leader['カードID'], k=10)
+                if not common_cards:
+                    st.caption("このリーダーの保存済みデッキはありません。")
+                for card in common_cards:
+                    card_record = card_lookup.get(card.card_id)
+                    card_name = card_record["カード名"] if card_record is not None else card.card_id
+                    in_deck = "（デッキに入っています）" if card.card_id in st.session_state["deck"] else ""
+                    st.markdown(f"{card.deck_share:.0%}　{card_name} *<small>({card.card_id})</small>* 平均 {card.avg_count:.1f} 枚{in_deck}", unsafe_allow_html=True)
+        
         st.markdown("---")
         
         col1, col2 = st.columns(2)
@@ -1390,27 +1042,39 @@ else:
 
         # UIの再構築：カード検索モードと同等のフィルタ
         # 💡 フィルタUIは3列を維持（コンテンツが多いため）
+        # 💡 修正: 選択肢は前計算したものを使い、リーダーの色・ほかの条件を満たす件数を付ける（検索モードと同じ）
+        facet_options = card_index.facet_options
+        with metrics.span("deck.facets"):
+            deck_facets = card_index.facet_counts(
+                types=st.session_state.get("deck_types", current_filter["types"]),
+                costs=st.session_state.get("deck_costs", current_filter["costs"]),
+                counters=st.session_state.get("deck_counters", current_filter["counters"]),
+                attributes=st.session_state.get("deck_attributes", current_filter["attributes"]),
+                blocks=st.session_state.get("deck_blocks", current_filter["blocks"]),
+                feature_selected=st.session_state.get("deck_features", current_filter["features"]),
+                series_ids=st.session_state.get("deck_series_ids", current_filter["series_ids"]),
+                free_words=st.session_state.get("deck_free", current_filter["free_words"]),
+                leader_colors=leader_colors, parallel_mode=st.session_state["parallel_filter_deck"]
+            )
+        
         col_a, col_b, col_c = st.columns(3)
         with col_a:
             # 💡 修正: default=[] により初期選択をなしにする
-            deck_types = st.multiselect("タイプ", ["CHARACTER", "EVENT", "STAGE"], default=current_filter["types"], key="deck_types")
-            deck_costs = st.multiselect("コスト", sorted(df["コスト数値"].unique()), default=current_filter["costs"], key="deck_costs")
+            deck_types = st.multiselect("タイプ", ["CHARACTER", "EVENT", "STAGE"], default=current_filter["types"], format_func=facet_label(deck_facets["types"]), key="deck_types")
+            deck_costs = st.multiselect("コスト", facet_options["costs"], default=current_filter["costs"], format_func=facet_label(deck_facets["costs"]), key="deck_costs")
         with col_b:
-            deck_counters = st.multiselect("カウンター", sorted(df["カウンター"].unique()), default=current_filter["counters"], key="deck_counters")
-            all_deck_attributes = sorted({attr for lst in df["属性リスト"] for attr in lst if attr})
-            deck_attributes = st.multiselect("属性", all_deck_attributes, default=current_filter["attributes"], key="deck_attributes")
+            deck_counters = st.multiselect("カウンター", facet_options["counters"], default=current_filter["counters"], format_func=facet_label(deck_facets["counters"]), key="deck_counters")
+            deck_attributes = st.multiselect("属性", facet_options["attributes"], default=current_filter["attributes"], format_func=facet_label(deck_facets["attributes"]), key="deck_attributes")
         with col_c:
-            all_deck_features = sorted({f for lst in df["特徴リスト"] for f in lst if f})
-            deck_features = st.multiselect("特徴", all_deck_features, default=current_filter["features"], key="deck_features")
-            all_series_ids = sorted([s for s in df["シリーズID"].unique() if s != "-"])
-            deck_series_ids = st.multiselect("入手シリーズ", all_series_ids, default=current_filter["series_ids"], key="deck_series_ids")
+            deck_features = st.multiselect("特徴", facet_options["feature_selected"], default=current_filter["features"], format_func=facet_label(deck_facets["feature_selected"]), key="deck_features")
+            deck_series_ids = st.multiselect("入手シリーズ", facet_options["series_ids"], default=current_filter["series_ids"], format_func=facet_label(deck_facets["series_ids"]), key="deck_series_ids")
             
         # 1行で配置
         col_d, col_e = st.columns([3, 1])
         with col_d:
             deck_free = st.text_input("フリーワード（カード名/特徴/テキスト/トリガー）", value=current_filter["free_words"], key="deck_free")
         with col_e:
-            deck_blocks = st.multiselect("ブロックアイコン", sorted(df["ブロックアイコン"].unique()), default=current_filter["blocks"], key="deck_blocks")
+            deck_blocks = st.multiselect("ブロックアイコン", facet_options["blocks"], default=current_filter["blocks"], format_func=facet_label(deck_facets["blocks"]), key="deck_blocks")
 
         # 💡 修正 2B: パラレルカードフィルタをコールバック方式に変更して安定化
         radio_options = ["通常カードのみ", "パラレルカードのみ", "両方表示"]
@@ -1441,20 +1105,22 @@ else:
         }
         
         # フィルタの自動適用
-        st.session_state["deck_results"] = filter_cards(
-            df, 
-            colors=[], # リーダーの色で自動的にフィルタされる
-            types=deck_types, 
-            costs=deck_costs, 
-            counters=deck_counters, 
-            attributes=deck_attributes, 
-            blocks=deck_blocks, 
-            feature_selected=deck_features, 
-            free_words=deck_free, 
-            series_ids=deck_series_ids,
-            leader_colors=leader_colors, # リーダーの色を渡してフィルタリング
-            parallel_mode=st.session_state["parallel_filter_deck"] # 💡 修正: パラレルフィルタの適用
-        )
+        with metrics.span("deck.filter"):
+            st.session_state["deck_results"] = filter_cards(
+                df, 
+                colors=[], # リーダーの色で自動的にフィルタされる
+                types=deck_types, 
+                costs=deck_costs, 
+                counters=deck_counters, 
+                attributes=deck_attributes, 
+                blocks=deck_blocks, 
+                feature_selected=deck_features, 
+                free_words=deck_free, 
+                series_ids=deck_series_ids,
+                leader_colors=leader_colors, # リーダーの色を渡してフィルタリング
+                parallel_mode=st.session_state["parallel_filter_deck"], # 💡 修正: パラレルフィルタの適用
+                card_index=card_index # 💡 追加: 転置インデックスで検索
+            )
         
         color_cards = st.session_state["deck_results"]
         
@@ -1475,35 +1141,37 @@ else:
         st.write(f"表示中のカード：{len(color_cards)} 枚")
         st.markdown("---")
         
+        # 💡 修正: 全件ではなく表示中のページだけを描画する（カードごとにボタンが2つあるため特に効く）
+        deck_token = [st.session_state["deck_filter"], leader_colors, st.session_state["parallel_filter_deck"]]
+        start, stop, page, page_count = get_page_range(len(color_cards), "deck_page", deck_token)
+        render_pager("deck_page", start, stop, len(color_cards), page, page_count, "top")
+        
         # 💡 修正 2B-3: 固定の3列ではなく、選択された列数を使用
         card_cols = st.columns(cols_count)
-        for idx, (_, card) in enumerate(color_cards.iterrows()):
-            card_id = card["カードID"]
-            
+        grid_started = metrics.clock()
+        # 💡 修正: iterrows() ではなく必要な列だけを itertuples() で読む
+        page_rows = color_cards.iloc[start:stop][["カードID", "画像URL", "is_parallel"]]
+        for idx, (card_id, image_url, is_parallel) in enumerate(page_rows.itertuples(index=False, name=None), start=start):
             # 💡 修正: カスタムカードの画像URLを使用するロジックを追加
-            image_url = card['画像URL']
-            if pd.notna(image_url) and str(image_url).startswith(("http", "https")):
-                 img_url = str(image_url)
-            else:
-                 img_url = f"https://www.onepiece-cardgame.com/images/cardlist/card/{card_id}.png"
+            # 💡 修正: 一覧表示は縮小済みのサムネイルを使う（未作成なら元画像のURL）
+            img_url = card_thumbnail_source(card_id, image_url)
             
             with card_cols[idx % cols_count]: # 💡 修正: 選択された列数を使用
                 current_count = st.session_state["deck"].get(card_id, 0)
-                caption_text = f"({current_count}/4枚)"
+                copy_limit = regulation.copy_limit(card_id)
+                caption_text = f"({current_count}/{copy_limit}枚)" if copy_limit is not None else f"({current_count}枚)"
                 
                 # 💡 追加: パラレルカードにマーク
-                if card['is_parallel']:
+                if is_parallel:
                     caption_text = "✨P " + caption_text
                 
                 # 💡 修正: use_column_width=True を use_container_width=True に置き換え
                 st.image(img_url, caption=caption_text, use_container_width=True) 
                 
-                is_unlimited = card_id in UNLIMITED_CARDS
-                
                 # ＋ボタンを配置（画面幅いっぱいになる）
-                if st.button("＋", key=f"add_deck_{card_id}_{idx}", type="primary", width='stretch', disabled=(not is_unlimited and current_count >= 4)):
+                if st.button("＋", key=f"add_deck_{card_id}_{idx}", type="primary", width='stretch', disabled=(copy_limit is not None and current_count >= copy_limit)):
                     count = st.session_state["deck"].get(card_id, 0)
-                    if is_unlimited or count < 4:
+                    if copy_limit is None or count < copy_limit:
                         st.session_state["deck"][card_id] = count + 1
                         st.rerun()
                 
@@ -1513,4 +1181,13 @@ else:
                         st.session_state["deck"][card_id] -= 1
                         if st.session_state["deck"][card_id] == 0:
                             del st.session_state["deck"][card_id]
-                        st.rerun()
\ No newline at end of file
+                        st.rerun()
+        metrics.observe_since("deck.render_grid", grid_started)
+
+# ===============================
+# 🛠️ 計測（管理者用）
+# ===============================
+# 💡 追加: DECK_METRICS=1 で起動したときだけ、プロセス内の集計をサイドバーに表示する
+metrics.observe_since("app.rerun", rerun_started)
+if metrics.is_enabled():
+    render_metrics_panel()
@@ -0,0 +1,132 @@
+"""保存済みデッキのデッキ画像をまとめて生成するコマンド
+
+    python render_decks.py [入力ディレクトリ] [-o 出力ディレクトリ] [-j プロセス数] [--format jpeg] [--quality 85]
+
+入力ディレクトリを省略するとアプリのデッキストア（deck_store）の全デッキ、指定するとその中の *.txt を描画する。
+
+アプリと同じく data/ ディレクトリで実行する。各プロセスはカードテーブル（スナップショット）を
+1回だけ読み込み、カード画像のキャッシュ（image_cache/ と thumbnails/）は全プロセスで共有する。
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from deck_engine import DeckEngine
+from deck_image_encode import DEFAULT_FORMAT, OUTPUT_FORMATS
+
+DEFAULT_OUTPUT_DIR = "deck_images"
+
+# ワーカープロセスごとの DeckEngine
+_worker_engine = None
+
+
+def _init_worker():
+    global _worker_engine
+    engine = DeckEngine()
+    if engine.card_index is None:
+        raise RuntimeError("カードリストのCSVが見つかりません。data/ ディレクトリで実行してください。")
+    _worker_engine = engine
+
+
+def render_deck_file(source, output_dir, compact_qr=True, output_format=DEFAULT_FORMAT, quality=None, max_bytes=None):
+    """1デッキ分の画像を描画して output_format（"png" / "jpeg" / "webp" / "budget"）で保存する
+
+    source はデッキテキストのパス、またはデッキストアから読んだ DeckList。
+    (入力, 出力パス, 秒数, エラーメッセージ) を返す。失敗した場合は出力パスが None。
+    """
+    start = time.perf_counter()
+    try:
+        engine = _worker_engine
+        card_lookup = engine.card_lookup
+        if isinstance(source, str):
+            with open(source, "r", encoding="utf-8") as f:
+                deck = engine.parse_deck(f.read())
+            base_name = os.path.splitext(os.path.basename(source))[0]
+        else:
+            deck = source._replace(cards={k: v for k, v in source.cards.items() if k in card_lookup})
+            base_name = source.name
+        leader = card_lookup.get(deck.leader_id)
+        if leader is None:
+            raise ValueError(f"リーダーカード {deck.leader_id} が見つかりません。")
+
+        img = engine.render_deck_image(leader, deck.cards, deck.name, compact_qr)
+        encoded = engine.encode_deck_image(img, output_format, quality=quality, max_bytes=max_bytes)
+        out_path = os.path.join(output_dir, base_name + encoded.extension)
+        with open(out_path, "wb") as f:
+            f.write(encoded.data)
+        return source, out_path, time.perf_counter() - start, None
+    except Exception as e:
+        return source, None, time.perf_counter() - start, str(e)
+
+
+def render_decks(sources, output_dir, jobs=None, compact_qr=True, output_format=DEFAULT_FORMAT, quality=None, max_bytes=None):
+    """デッキ（ファイルのパス or DeckList）をまとめて描画し、終わった順に render_deck_file の結果を返すジェネレータ
+
+    jobs が 1 の場合はプロセスを起動せずにこのプロセスで順に描画する。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    jobs = jobs or os.cpu_count() or 1
+    if jobs == 1 or len(sources) <= 1:
+        _init_worker()
+        for source in sources:
+            yield render_deck_file(source, output_dir, compact_qr, output_format, quality, max_bytes)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(sources)), initializer=_init_worker) as executor:
+        futures = [
+            executor.submit(render_deck_file, source, output_dir, compact_qr, output_format, quality, max_bytes)
+            for source in sources
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="保存済みデッキのデッキ画像をまとめて生成します。")
+    parser.add_argument("input_dir", nargs="?", default=None, help="デッキテキスト (*.txt) のディレクトリ（省略時はデッキストアの全デッキ）")
+    parser.add_argument("-o", "--output-dir", default=DEFAULT_OUTPUT_DIR, help="画像の出力先")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="プロセス数（既定: CPU数）")
+    parser.add_argument("--text-qr", action="store_true", help="QRコードを短縮形式ではなくテキスト形式にする")
+    parser.add_argument("--format", choices=list(OUTPUT_FORMATS), default=DEFAULT_FORMAT,
+                        help="画像の形式（budget は --max-kb 以内に収まるように JPEG の画質を下げる）")
+    parser.add_argument("--quality", type=int, default=None, help="JPEG / WebP の画質（1〜100）")
+    parser.add_argument("--max-kb", type=int, default=None, help="--format budget のサイズ上限 (KB)")
+    args = parser.parse_args(argv)
+
+    if args.input_dir is None:
+        store = DeckEngine().deck_store
+        sources = [store.load(summary.name) for summary in store.list_decks()]
+        if not sources:
+            print("デッキストアに保存済みのデッキがありません。", file=sys.stderr)
+            return 1
+    else:
+        sources = sorted(glob.glob(os.path.join(args.input_dir, "*.txt")))
+        if not sources:
+            print(f"{args.input_dir} にデッキファイル (*.txt) がありません。", file=sys.stderr)
+            return 1
+
+    started = time.perf_counter()
+    failed = 0
+    max_bytes = args.max_kb * 1000 if args.max_kb else None
+    results = render_decks(
+        sources, args.output_dir, args.jobs, compact_qr=not args.text_qr,
+        output_format=args.format, quality=args.quality, max_bytes=max_bytes
+    )
+    for source, out_path, elapsed, error in results:
+        name = os.path.basename(source) if isinstance(source, str) else source.name
+        if error is None:
+            print(f"{elapsed:7.2f}s  {name} -> {out_path}")
+        else:
+            failed += 1
+            print(f"{elapsed:7.2f}s  {name} [エラー] {error}", file=sys.stderr)
+
+    total = time.perf_counter() - started
+    print(f"{len(sources) - failed} / {len(sources)} 件を生成しました（合計 {total:.2f}s、1件あたり {total / len(sources):.2f}s）")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""テストから data/ のモジュールを import できるようにする（アプリと同じく data/ 直下のモジュールを使う）"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# テスト用のカードテーブルの値の候補（CSV の列と同じ書き方）
+_TYPES = ["CHARACTER"] * 6 + ["EVENT", "STAGE", "LEADER"]
+_COLORS = ["赤", "緑", "青", "紫", "黒", "黄", "赤/緑", "青/紫", "黒/黄", "-"]
+_FEATURES = ["麦わらの一味", "超新星", "海軍", "王下七武海", "ＦＩＬＭ", "-"]
+_ATTRIBUTES = ["打", "斬", "特", "射", "知", "-"]
+_WORDS = ["【登場時】", "【ブロッカー】", "ドン!!", "KO", "手札", "Trash", "パワー+1000", "レスト"]
+
+
+def make_card_row(rnd, card_id, is_parallel=False):
+    """CSV 1行分のカード（card_data.derive_columns にかける前の列）"""
+    card_type = rnd.choice(_TYPES)
+    return {
+        "カード名": f"カード{card_id}",
+        "カードID": card_id,
+        "カードコード": card_id,
+        "タイプ": card_type,
+        "レアリティ": rnd.choice(["C", "UC", "R", "SR"]),
+        "コスト": "-" if card_type == "LEADER" else str(rnd.randint(0, 10)),
+        "属性": "/".join(rnd.sample(_ATTRIBUTES, rnd.randint(1, 2))),
+        "パワー": rnd.choice([0, 1000, 5000]),
+        "カウンター": rnd.choice([0, 1000, 2000]),
+        "色": rnd.choice(_COLORS),
+        "ブロックアイコン": rnd.randint(1, 3),
+        "特徴": "/".join(rnd.sample(_FEATURES, rnd.randint(1, 2))),
+        "テキスト": " ".join(rnd.sample(_WORDS, 3)),
+        "トリガー": rnd.choice(["-", "【トリガー】このカードを登場させる。"]),
+        "入手情報": rnd.choice(["ブースターパック【OP-01】", "スタートデッキ【ST-01】", "プロモ", "-"]),
+        "画像URL": None,
+        "is_parallel": is_parallel,
+    }
+
+
+def write_cards_csv(path, card_ids, seed=0):
+    """メインのカードリストと同じ列の CSV を書く（画像URL・is_parallel は読み込み時に足される）"""
+    import pandas as pd
+
+    rnd = random.Random(seed)
+    rows = [make_card_row(rnd, card_id) for card_id in card_ids]
+    pd.DataFrame(rows).drop(columns=["画像URL", "is_parallel"]).to_csv(path, index=False)
+
+
+@pytest.fixture
+def make_card_table():
+    """make_card_table(card_ids, seed) → CSV から読み込んだときと同じ列の合成カードテーブル
+
+    カードIDの末尾が "_p" のカードはパラレル版（基本IDは "_p" を除いたもの）にする。
+    """
+    import pandas as pd
+
+    from card_data import derive_columns, normalize_dtypes
+
+    def make(card_ids, seed=0):
+        rnd = random.Random(seed)
+        rows = [
+            make_card_row(rnd, card_id.removesuffix("_p"), card_id.endswith("_p"))
+            for card_id in card_ids
+        ]
+        # 0行でも列はそろえる
+        columns = list(make_card_row(rnd, "-"))
+        return normalize_dtypes(derive_columns(pd.DataFrame(rows, columns=columns)))
+
+    return make
+
+
+def solid_png(color, size=(600, 838)):
+    """単色の PNG のバイト列（スタブサーバーの画像の差し替え用）"""
+    from io import BytesIO
+
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.new("RGB", size, color).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture
+def image_server():
+    """カード画像のスタブサーバー（benchmark.py と同じもの）。server._images[パス] で返す画像を差し替えられる"""
+    from benchmark import StubImageServer
+
+    with StubImageServer() as server:
+        yield server
+
+
+@pytest.fixture
+def image_cache(tmp_path, image_server):
+    """スタブサーバーから取得する CardImageCache（毎回再検証する）"""
+    from benchmark import redirect_session
+    from card_image_cache import CardImageCache
+
+    cache = CardImageCache(cache_dir=str(tmp_path / "image_cache"), revalidate_after=0)
+    redirect_session(cache.session, image_server.base_url)
+    return cache
+
+
+@pytest.fixture
+def thumbnail_store(tmp_path, image_cache):
+    from card_thumbnails import ThumbnailStore
+
+    return ThumbnailStore(image_cache, thumb_dir=str(tmp_path / "thumbnails"))
@@ -0,0 +1,51 @@
+"""benchmark: 計測の前に入力と結果を確かめる処理（間違った入力で別のものを測らない）"""
+import pytest
+
+from benchmark import check_parsed_decks, run_benchmarks, sample_decks
+from card_data import MAIN_CARDS_CSV
+from card_index import CardIndex
+from conftest import write_cards_csv
+from deck_codec import format_deck_text, iter_decks
+
+CARD_IDS = [f"OP01-{i:03d}" for i in range(1, 201)]
+
+
+@pytest.fixture
+def decks(make_card_table):
+    df = make_card_table(CARD_IDS, seed=4)
+    card_index = CardIndex(df)
+    return card_index.lookup, sample_decks(df, card_index, 30)
+
+
+def test_sample_decks_are_legal(decks):
+    lookup, sampled = decks
+    assert len(sampled) == 30
+    for name, leader_id, cards in sampled:
+        assert lookup[leader_id]["タイプ"] == "LEADER"
+        assert sum(cards.values()) == 50 and max(cards.values()) <= 4
+        leader_colors = str(lookup[leader_id]["色"]).split("/")
+        assert all(any(c in str(lookup[card_id]["色"]) for c in leader_colors) for card_id in cards)
+
+
+def test_check_parsed_decks(decks):
+    lookup, sampled = decks
+    batch_text = "\n\n".join(format_deck_text(n, l, c, lookup) for n, l, c in sampled)
+    check_parsed_decks(iter_decks(batch_text.splitlines(), known_ids=lookup), sampled)
+    check_parsed_decks(iter_decks(batch_text, known_ids=lookup), sampled)
+
+    # 1文字ずつの「行」を読んだ結果（以前のベンチマークの誤り）や、一部が欠けた結果は通さない
+    with pytest.raises(RuntimeError):
+        check_parsed_decks(iter_decks(iter(batch_text), known_ids=lookup), sampled)
+    with pytest.raises(RuntimeError):
+        check_parsed_decks(list(iter_decks(batch_text, known_ids=lookup))[:-1], sampled)
+    with pytest.raises(RuntimeError):
+        check_parsed_decks(iter_decks(batch_text, known_ids={l for _, l, _ in sampled}), sampled)
+
+
+def test_run_parse_batch(tmp_path, monkeypatch):
+    """合成のカードリストで deck.parse_batch を実行する（結果の確認を通って計測される）"""
+    monkeypatch.chdir(tmp_path)
+    write_cards_csv(MAIN_CARDS_CSV, CARD_IDS, seed=4)
+    results = run_benchmarks(selected=["deck.parse_batch"], quick=True)
+    assert "deck.parse_batch" in results
+    assert results["deck.parse_batch"]["params"] == {"decks": 200}
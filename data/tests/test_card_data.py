@@ -0,0 +1,121 @@
+"""card_data: スナップショット (.npz) の保存・読み込みと、使えないスナップショットのときの CSV からの構築"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import card_data
+from card_data import MAIN_CARDS_CSV, load_card_table, load_snapshot, save_snapshot
+from card_index import _POSTING_ATTRS, CardIndex
+from conftest import write_cards_csv
+
+CARD_IDS = [f"OP01-{i:03d}" for i in range(1, 41)] + ["OP01-003_p"]
+SIGNATURE = {"test": 1}
+
+
+def assert_same_index(loaded, index):
+    assert loaded.size == index.size
+    for name in ["rank", "is_parallel", "is_leader"]:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(index, name))
+    for attr in ["color_postings"] + _POSTING_ATTRS:
+        expected = getattr(index, attr)
+        actual = getattr(loaded, attr)
+        assert list(actual) == list(expected), attr
+        for key, positions in expected.items():
+            assert actual[key].dtype == positions.dtype
+            np.testing.assert_array_equal(actual[key], positions)
+    assert loaded.text_index.texts == index.text_index.texts
+    assert loaded.text_index.postings.keys() == index.text_index.postings.keys()
+    for gram, positions in index.text_index.postings.items():
+        np.testing.assert_array_equal(loaded.text_index.postings[gram], positions)
+    assert loaded.lookup.variants == index.lookup.variants
+    assert loaded.facet_options == index.facet_options
+    for filters in [{}, {"colors": ["赤"]}, {"free_words": "ドン!!"}, {"feature_selected": ["海軍"], "parallel_mode": "all"}]:
+        assert loaded.filter_positions(**filters).tolist() == index.filter_positions(**filters).tolist()
+
+
+@pytest.fixture
+def table(make_card_table):
+    df = make_card_table(CARD_IDS, seed=5)
+    # 数値と文字列が混在する列（JSON で保存する列）
+    df["混在"] = [i if i % 3 else "-" for i in range(len(df))]
+    return df
+
+
+def test_snapshot_round_trip(tmp_path, table):
+    path = str(tmp_path / "snap.npz")
+    index = CardIndex(table)
+    slices = {MAIN_CARDS_CSV: (0, len(table))}
+    save_snapshot(table, index, SIGNATURE, path, slices)
+
+    # pickle を含まない（allow_pickle=False で全配列を読める）
+    with np.load(path, allow_pickle=False) as npz:
+        assert all(npz[name].dtype != object for name in npz.files)
+
+    df, loaded, loaded_slices = load_snapshot(SIGNATURE, path)
+    pd.testing.assert_frame_equal(df, table)
+    assert df.dtypes.to_dict() == table.dtypes.to_dict()
+    assert loaded_slices == slices
+    assert_same_index(loaded, index)
+
+
+def test_snapshot_rejects_other_signature(tmp_path, table):
+    path = str(tmp_path / "snap.npz")
+    save_snapshot(table, CardIndex(table), SIGNATURE, path)
+    assert load_snapshot({"test": 2}, path) is None
+    assert load_snapshot(SIGNATURE, str(tmp_path / "missing.npz")) is None
+
+
+def test_snapshot_rejects_broken_files(tmp_path, table):
+    path = str(tmp_path / "snap.npz")
+    with open(path, "wb") as f:
+        f.write(b"not a snapshot")
+    assert load_snapshot(SIGNATURE, path) is None
+
+    # 途中で切れたファイル
+    save_snapshot(table, CardIndex(table), SIGNATURE, path)
+    with open(path, "rb") as f:
+        content = f.read()
+    with open(path, "wb") as f:
+        f.write(content[:len(content) // 2])
+    assert load_snapshot(SIGNATURE, path) is None
+
+    # 索引の配列を pickle が必要な配列に差し替えたファイルは読まない
+    save_snapshot(table, CardIndex(table), SIGNATURE, path)
+    with np.load(path, allow_pickle=False) as npz:
+        arrays = {name: npz[name] for name in npz.files}
+    arrays["ix_rank"] = np.array([object()] * len(table), dtype=object)
+    with open(path, "wb") as f:
+        np.savez(f, **arrays)
+    assert load_snapshot(SIGNATURE, path) is None
+
+
+def test_load_card_table_falls_back_to_csv(tmp_path, monkeypatch):
+    # 元CSVは作業ディレクトリからの相対パスなので、一時ディレクトリで読み込む
+    monkeypatch.chdir(tmp_path)
+    write_cards_csv(MAIN_CARDS_CSV, CARD_IDS[:30])
+    snapshot = "snap.npz"
+    df, index = load_card_table(snapshot_path=snapshot)
+    assert os.path.exists(snapshot)
+    built = card_data.build_card_table()
+    pd.testing.assert_frame_equal(df, built)
+
+    # スナップショットから読んでも同じ
+    cached_df, cached_index = load_card_table(snapshot_path=snapshot)
+    pd.testing.assert_frame_equal(cached_df, built)
+    assert_same_index(cached_index, index)
+
+    # 壊れたスナップショットは CSV から作り直して保存し直す
+    with open(snapshot, "wb") as f:
+        f.write(b"broken")
+    rebuilt_df, rebuilt_index = load_card_table(snapshot_path=snapshot)
+    pd.testing.assert_frame_equal(rebuilt_df, built)
+    assert_same_index(rebuilt_index, index)
+    assert load_snapshot(card_data.source_signature(), snapshot) is not None
+
+    # CSV が変わったら古いスナップショットは使わない
+    write_cards_csv(MAIN_CARDS_CSV, CARD_IDS[:35], seed=1)
+    stale_df, stale_index = load_card_table(snapshot_path=snapshot)
+    assert len(stale_df) == 35 and stale_index.size == 35
+    pd.testing.assert_frame_equal(stale_df, card_data.build_card_table())
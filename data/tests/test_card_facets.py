@@ -0,0 +1,107 @@
+"""card_index: ファセットの件数 (facet_counts) が、カードテーブルを1行ずつ数えた件数と同じになるか"""
+import re
+
+import pytest
+
+from card_index import FACET_POSTINGS, FREE_WORD_COLUMNS, INDEXED_COLORS, CardIndex
+
+CARD_IDS = [f"OP01-{i:03d}" for i in range(1, 121)] + [f"OP01-{i:03d}_p" for i in range(1, 121, 7)]
+
+FILTERS = [
+    {},
+    {"parallel_mode": "all"},
+    {"parallel_mode": "parallel"},
+    {"colors": ["赤", "青"]},
+    {"colors": ["赤"], "types": ["CHARACTER", "EVENT"], "costs": [2, 3, 4]},
+    {"counters": [1000], "blocks": [1, 2], "attributes": ["斬", "特"]},
+    {"feature_selected": ["海軍", "超新星"], "series_ids": ["OP-01", "その他"]},
+    {"leader_colors": ["緑", "黄"], "parallel_mode": "all"},
+    {"types": ["CHARACTER"], "free_words": "ドン!! 手札"},
+    {"free_words": "ko"},
+    {"free_words": "ブロッカー|trash", "costs": [0, 1, 2, 3]},
+    {"free_words": "存在しない"},
+]
+
+
+def row_values(row, facet):
+    """その行がファセット facet で持つ値の集合（色は部分一致、属性・特徴はリストの各要素）"""
+    if facet == "colors":
+        return {c for c in INDEXED_COLORS if c in str(row["色"])}
+    if facet == "attributes":
+        return set(row["属性リスト"])
+    if facet == "feature_selected":
+        return set(row["特徴リスト"])
+    column = {"types": "タイプ", "costs": "コスト数値", "counters": "カウンター", "blocks": "ブロックアイコン",
+              "series_ids": "シリーズID"}[facet]
+    return {row[column]}
+
+
+def matches_free_words(row, free_words):
+    for keyword in free_words.split():
+        if "|" in keyword:
+            if not any(re.search(keyword, str(row[c]), re.IGNORECASE) for c in FREE_WORD_COLUMNS):
+                return False
+        elif not any(keyword.lower() in str(row[c]).lower() for c in FREE_WORD_COLUMNS):
+            return False
+    return True
+
+
+def matches_base(row, parallel_mode="normal", leader_colors=None, free_words="", **facet_filters):
+    """ファセット以外の条件（パラレル・リーダーの色・フリーワード）"""
+    if parallel_mode != "all" and row["is_parallel"] != (parallel_mode == "parallel"):
+        return False
+    if leader_colors and (row["タイプ"] == "LEADER" or not any(c in str(row["色"]) for c in leader_colors)):
+        return False
+    return matches_free_words(row, free_words)
+
+
+def reference_counts(df, index, filters):
+    facet_filters = {facet: filters[facet] for facet in FACET_POSTINGS if filters.get(facet)}
+    rows = [row for _, row in df.iterrows() if matches_base(row, **filters)]
+    counts = {}
+    for facet in FACET_POSTINGS:
+        # 自分のファセットの選択は除き、ほかのファセットの選択はすべて満たす行
+        others = [
+            row for row in rows
+            if all(row_values(row, other) & set(values) for other, values in facet_filters.items() if other != facet)
+        ]
+        counts[facet] = {value: sum(value in row_values(row, facet) for row in others) for value in index.facet_options[facet]}
+    return counts
+
+
+@pytest.fixture
+def table(make_card_table):
+    df = make_card_table(CARD_IDS, seed=5)
+    return df, CardIndex(df)
+
+
+def test_facet_options(table):
+    df, index = table
+    for facet in FACET_POSTINGS:
+        present = set().union(*(row_values(row, facet) for _, row in df.iterrows()))
+        present -= {"", "-"} if facet in ("attributes", "feature_selected", "series_ids") else set()
+        assert set(index.facet_options[facet]) == present, facet
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_facet_counts_match_reference(table, filters):
+    df, index = table
+    assert index.facet_counts(**filters) == reference_counts(df, index, filters)
+
+
+@pytest.mark.parametrize("filters", FILTERS)
+def test_facet_count_is_result_size_when_selected(table, filters):
+    """選択肢の件数は、そのファセットでその値だけを選んだときの検索結果の件数"""
+    _, index = table
+    counts = index.facet_counts(**filters)
+    for facet, values in counts.items():
+        for value, count in values.items():
+            assert len(index.filter_positions(**{**filters, facet: [value]})) == count, (facet, value)
+
+
+def test_selected_facets_only(table):
+    _, index = table
+    filters = FILTERS[4]
+    counts = index.facet_counts(["types", "costs"], **filters)
+    assert list(counts) == ["types", "costs"]
+    assert counts == {facet: index.facet_counts(**filters)[facet] for facet in ["types", "costs"]}
@@ -0,0 +1,122 @@
+"""card_image_cache: ディスクキャッシュの LRU 削除と ETag による再検証"""
+import os
+import time
+from urllib.parse import urlsplit
+
+import pytest
+
+from benchmark import redirect_session
+from card_image_cache import CardImageCache, content_digest, run_concurrently
+from conftest import solid_png
+
+URL = "https://example.com/images/OP01-001.png"
+
+
+@pytest.fixture
+def requests_log(monkeypatch):
+    """キャッシュのセッションが送ったリクエストを (If-None-Match, ステータス) で記録する"""
+    def attach(cache):
+        log = []
+        real_get = cache.session.get
+
+        def get(url, headers=None, **kwargs):
+            response = real_get(url, headers=headers, **kwargs)
+            log.append(((headers or {}).get("If-None-Match"), response.status_code))
+            return response
+
+        monkeypatch.setattr(cache.session, "get", get)
+        return log
+    return attach
+
+
+def make_cache(tmp_path, image_server, name="cache", **kwargs):
+    cache = CardImageCache(cache_dir=str(tmp_path / name), **kwargs)
+    redirect_session(cache.session, image_server.base_url)
+    return cache
+
+
+def test_fresh_entry_is_not_requested_again(tmp_path, image_server, requests_log):
+    cache = make_cache(tmp_path, image_server, revalidate_after=3600)
+    log = requests_log(cache)
+    content = cache.fetch("OP01-001", URL)
+    assert content == image_server.image_for(urlsplit(URL).path)
+    assert cache.fetch("OP01-001", URL) == content
+    assert log == [(None, 200)]
+    meta = cache.get_meta("OP01-001", URL)
+    assert meta["etag"] and meta["digest"] == content_digest(content)
+    assert cache.is_fresh(meta)
+
+
+def test_revalidates_with_etag(tmp_path, image_server, requests_log):
+    cache = make_cache(tmp_path, image_server, revalidate_after=0)
+    log = requests_log(cache)
+    content = cache.fetch("OP01-001", URL)
+    checked_at = cache.get_meta("OP01-001", URL)["checked_at"]
+    etag = cache.get_meta("OP01-001", URL)["etag"]
+
+    # 変わっていなければ 304 で、保存済みの画像をそのまま使う
+    assert cache.fetch("OP01-001", URL) == content
+    assert log == [(None, 200), (etag, 304)]
+    assert cache.get_meta("OP01-001", URL)["checked_at"] >= checked_at
+
+    # 変わっていれば新しい画像に置き換える
+    new = image_server._images[urlsplit(URL).path] = solid_png((0, 0, 255))
+    assert cache.fetch("OP01-001", URL) == new
+    assert log[-1] == (etag, 200)
+    meta = cache.get_meta("OP01-001", URL)
+    assert meta["digest"] == content_digest(new) and meta["etag"] != etag
+    assert cache.get("OP01-001", URL)[0] == new
+
+
+def test_stale_entry_is_used_when_offline(tmp_path):
+    # スタブサーバーに向けていないキャッシュ（接続できないURL）
+    cache = CardImageCache(cache_dir=str(tmp_path / "offline"), revalidate_after=0)
+    url = "http://127.0.0.1:9/OP01-001.png"
+    assert cache.fetch("OP01-001", url, timeout=1) is None
+    cache.put("OP01-001", url, b"cached", etag='"x"')
+    assert cache.fetch("OP01-001", url, timeout=1) == b"cached"
+
+
+def test_lru_eviction(tmp_path):
+    cache = CardImageCache(cache_dir=str(tmp_path / "lru"), max_bytes=1000, revalidate_after=3600)
+    for card_id in ["A", "B", "C"]:
+        cache.put(card_id, URL, card_id.encode() * 300)
+    now = time.time()
+    for card_id, mtime in [("A", now - 300), ("B", now - 200), ("C", now - 100)]:
+        bin_path, _ = cache._paths(cache.make_key(card_id, URL))
+        os.utime(bin_path, (mtime, mtime))
+
+    # キャッシュから返すと最後に使われた時刻が更新されるので、A ではなく B が最も古くなる
+    assert cache.fetch("A", URL) == b"A" * 300
+    cache.put("D", URL, b"D" * 300)
+    assert cache.get("B", URL) == (None, None)
+    assert not os.path.exists(cache._paths(cache.make_key("B", URL))[1])
+    for card_id in ["A", "C", "D"]:
+        assert cache.get(card_id, URL)[0] == card_id.encode() * 300
+    assert cache._total_bytes == 900
+
+    # 上限を超えたら、上限の 9割 (_EVICT_LOW_WATERMARK) に収まるまで古い順に消す（次に古い C だけで足りる）
+    cache.put("E", URL, b"E" * 300)
+    assert [card_id for card_id in "ACDE" if cache.get(card_id, URL)[0] is not None] == ["A", "D", "E"]
+    # 新しく開いたキャッシュも同じ合計から始まる
+    assert CardImageCache(cache_dir=cache.cache_dir)._total_bytes == cache._total_bytes == 900
+
+
+def test_replacing_entry_keeps_total(tmp_path):
+    cache = CardImageCache(cache_dir=str(tmp_path / "total"))
+    cache.put("A", URL, b"a" * 100)
+    cache.put("A", URL, b"a" * 40)
+    assert cache._total_bytes == 40
+
+
+def test_fetch_many(tmp_path, image_server):
+    cache = make_cache(tmp_path, image_server)
+    items = [(f"OP01-00{i}", f"https://example.com/images/OP01-00{i}.png") for i in range(1, 6)]
+    contents = cache.fetch_many(items)
+    assert list(contents) == [card_id for card_id, _ in items]
+    assert all(contents[card_id] == image_server.image_for(urlsplit(url).path) for card_id, url in items)
+
+
+def test_run_concurrently_keeps_order():
+    assert run_concurrently(lambda x: x * 2, range(20), max_workers=4) == [x * 2 for x in range(20)]
+    assert run_concurrently(lambda x: x, [], max_workers=4) == []
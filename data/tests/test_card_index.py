@@ -0,0 +1,110 @@
+"""card_index: カードIDの辞書 (CardLookup) と、一部の行を差し替えた索引 (replace_rows) が作り直した索引と同じになるか"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from card_data import normalize_dtypes
+from card_index import _POSTING_ATTRS, CardIndex, CardLookup
+
+BASE_IDS = [f"OP01-{i:03d}" for i in range(1, 61)] + ["OP01-005_p", "OP01-030_p"]
+
+# 差し替え後の行（既存のカードIDのパラレル版・通常版も混ぜる）
+PART_IDS = [f"OP02-{i:03d}" for i in range(1, 16)] + ["OP01-002_p", "OP01-050", "OP02-003_p"]
+
+FILTERS = [
+    {},
+    {"parallel_mode": "all"},
+    {"parallel_mode": "parallel"},
+    {"colors": ["赤", "青"]},
+    {"types": ["CHARACTER"], "costs": [2, 3, 4]},
+    {"counters": [1000], "blocks": [1, 2]},
+    {"attributes": ["斬"], "feature_selected": ["海軍", "超新星"]},
+    {"series_ids": ["OP-01", "その他"]},
+    {"leader_colors": ["緑"], "parallel_mode": "all"},
+    {"free_words": "ドン!! 手札"},
+    {"free_words": "kO"},
+    {"free_words": "ブロッカー|trash"},
+    {"free_words": "カードop02"},
+]
+
+
+def postings_of(postings):
+    # 差し替えで空になったリストはキーごと消える（作り直した索引にはそもそも無い）ので、空のリストは比べない
+    return {key: positions.tolist() for key, positions in postings.items() if len(positions)}
+
+
+def assert_same_index(patched, fresh):
+    assert patched.size == fresh.size
+    np.testing.assert_array_equal(patched.rank, fresh.rank)
+    np.testing.assert_array_equal(patched.is_parallel, fresh.is_parallel)
+    np.testing.assert_array_equal(patched.is_leader, fresh.is_leader)
+    assert patched._color_texts == fresh._color_texts
+    for attr in ["color_postings"] + _POSTING_ATTRS:
+        assert postings_of(getattr(patched, attr)) == postings_of(getattr(fresh, attr)), attr
+    assert patched.text_index.texts == fresh.text_index.texts
+    assert postings_of(patched.text_index.postings) == postings_of(fresh.text_index.postings)
+    assert patched.lookup.variants == fresh.lookup.variants
+    assert patched.facet_options == fresh.facet_options
+    for filters in FILTERS:
+        assert patched.filter_positions(**filters).tolist() == fresh.filter_positions(**filters).tolist(), filters
+        assert patched.facet_counts(**filters) == fresh.facet_counts(**filters), filters
+
+
+@pytest.fixture
+def base_df(make_card_table):
+    return make_card_table(BASE_IDS, seed=3)
+
+
+@pytest.mark.parametrize("start, stop, part_size", [
+    (40, 50, 15), # 増える
+    (40, 50, 3), # 減る
+    (40, 50, 0), # 空になる
+    (0, 10, 10), # 先頭
+    (50, 62, 18), # 末尾
+    (62, 62, 5), # 末尾に追加
+])
+def test_replace_rows_matches_rebuild(make_card_table, base_df, start, stop, part_size):
+    part_df = make_card_table(PART_IDS[:part_size], seed=start + part_size)
+    new_df = normalize_dtypes(pd.concat([base_df.iloc[:start], part_df, base_df.iloc[stop:]], ignore_index=True))
+
+    index = CardIndex(base_df)
+    # 差し替え前の索引のキャッシュが新しい索引に持ち越されないこと
+    index.filter_positions(**FILTERS[0])
+    patched = index.replace_rows(start, stop, new_df)
+    assert_same_index(patched, CardIndex(new_df))
+    assert patched.filter_cache_info()[2] == len(FILTERS)
+
+
+def test_replace_rows_keeps_original(make_card_table, base_df):
+    index = CardIndex(base_df)
+    before = index.filter_positions(colors=["赤"]).tolist()
+    new_df = normalize_dtypes(pd.concat([base_df.iloc[:10], make_card_table(PART_IDS, seed=9)], ignore_index=True))
+    index.replace_rows(10, len(base_df), new_df)
+    assert_same_index(index, CardIndex(base_df))
+    assert index.filter_positions(colors=["赤"]).tolist() == before
+
+
+def test_lookup_prefers_normal_version(make_card_table):
+    df = make_card_table(["OP01-001_p", "OP01-001", "OP01-002_p"])
+    lookup = CardLookup(df)
+    assert len(lookup) == 2 and "OP01-001" in lookup and "OP01-003" not in lookup
+    assert lookup["OP01-001"].pos == 1 and not lookup["OP01-001"].is_parallel
+    assert [r.pos for r in lookup.variants_of("OP01-001")] == [1, 0]
+    # パラレル版しか無いカードはパラレル版
+    assert lookup["OP01-002"].pos == 2
+    assert lookup.row(df, "OP01-001").equals(df.iloc[1])
+    assert lookup.get("OP01-003") is None and lookup.row(df, "OP01-003") is None
+    assert lookup.variants_of("OP01-003") == ()
+
+
+def test_record_reads_like_a_row(make_card_table):
+    df = make_card_table(["OP01-001"])
+    record = CardLookup(df)["OP01-001"]
+    assert record["カード名"] == record.get("カード名") == df.iloc[0]["カード名"]
+    assert record[0] == 0
+    # namedtuple のメソッド名は列ではない
+    for key in ["count", "index", "_fields", "存在しない列"]:
+        assert record.get(key) is None
+        assert record.get(key, "-") == "-"
+        with pytest.raises(KeyError):
+            record[key]
@@ -0,0 +1,153 @@
+"""card_thumbnails: サムネイルの作成、元画像が差し替わったときの作り直し、サイズ上限、取得待ちのキュー"""
+import json
+import os
+import time
+from io import BytesIO
+from urllib.parse import urlsplit
+
+import pytest
+from PIL import Image
+
+import card_thumbnails
+from benchmark import redirect_session
+from card_image_cache import CardImageCache, content_digest
+from card_thumbnails import THUMBNAIL_VARIANTS, ThumbnailStore, resolve_image_url
+from conftest import solid_png
+
+CARD_IDS = ["OP01-001", "OP01-002", "OP01-003", "OP01-004"]
+
+
+def url_of(card_id):
+    return resolve_image_url(card_id)
+
+
+def color_of(content):
+    img = Image.open(BytesIO(content)).convert("RGB")
+    return img.getpixel((img.width // 2, img.height // 2))
+
+
+def set_image(server, card_id, color):
+    content = server._images[urlsplit(url_of(card_id)).path] = solid_png(color)
+    return content
+
+
+def test_build_all_variants(thumbnail_store):
+    card_id = CARD_IDS[0]
+    built = thumbnail_store.build(card_id, url_of(card_id))
+    assert set(built) == set(THUMBNAIL_VARIANTS)
+    for name, spec in THUMBNAIL_VARIANTS.items():
+        assert thumbnail_store.get_bytes(card_id, url_of(card_id), name) == built[name]
+        assert thumbnail_store.get_image(card_id, url_of(card_id), name).size == spec.size
+    assert thumbnail_store.has_all(card_id, url_of(card_id))
+    assert thumbnail_store.get_bytes(CARD_IDS[1], url_of(CARD_IDS[1]), "grid") is None
+
+
+def test_rebuilt_when_source_changes(image_server, thumbnail_store):
+    card_id, url = CARD_IDS[0], url_of(CARD_IDS[0])
+    old = set_image(image_server, card_id, (255, 0, 0))
+    thumbnail_store.build(card_id, url, ["deck", "grid"])
+    assert thumbnail_store.source_digest(card_id, url) == content_digest(old)
+    # 元画像が変わっていなければ作り直さない
+    assert thumbnail_store.refresh(card_id, url) is False
+
+    new = set_image(image_server, card_id, (0, 0, 255))
+    assert thumbnail_store.refresh(card_id, url) is True
+    assert thumbnail_store.source_digest(card_id, url) == content_digest(new)
+    for name in ["deck", "grid"]:
+        assert color_of(thumbnail_store.get_bytes(card_id, url, name))[2] > 200
+    # 作っていなかったバリアントは作らない
+    assert not os.path.exists(thumbnail_store._path(card_id, url, "leader"))
+    assert thumbnail_store.refresh(card_id, url) is False
+
+
+def test_build_drops_variants_of_old_source(image_server, thumbnail_store):
+    card_id, url = CARD_IDS[0], url_of(CARD_IDS[0])
+    set_image(image_server, card_id, (255, 0, 0))
+    thumbnail_store.build(card_id, url)
+    set_image(image_server, card_id, (0, 255, 0))
+    thumbnail_store.build(card_id, url, ["grid"])
+    # 古い版から作ったバリアントは残さない（次に使うときに新しい版から作る）
+    assert thumbnail_store.get_bytes(card_id, url, "deck") is None
+    assert color_of(thumbnail_store.get_bytes(card_id, url, "grid"))[1] > 200
+    thumbnail_store.get_image(card_id, url, "deck")
+    assert color_of(thumbnail_store.get_bytes(card_id, url, "deck"))[1] > 200
+
+
+def test_stale_thumbnail_is_served_then_rebuilt(image_server, thumbnail_store, monkeypatch):
+    # スレッドが使えない環境では、再検証はその場で行う（返すのは再検証前のサムネイル）
+    monkeypatch.setattr(card_thumbnails, "THREADS_AVAILABLE", False)
+    card_id, url = CARD_IDS[0], url_of(CARD_IDS[0])
+    set_image(image_server, card_id, (255, 0, 0))
+    thumbnail_store.build(card_id, url, ["grid"])
+    set_image(image_server, card_id, (0, 0, 255))
+    # image_cache は毎回再検証する設定（revalidate_after=0）なので、期限はすぐに切れる
+    assert color_of(thumbnail_store.get_bytes(card_id, url, "grid"))[0] > 200
+    assert color_of(thumbnail_store.get_bytes(card_id, url, "grid"))[2] > 200
+
+
+def test_size_limit_evicts_least_recently_used(image_server, tmp_path, image_cache):
+    urls = [url_of(card_id) for card_id in CARD_IDS]
+    for i, card_id in enumerate(CARD_IDS):
+        set_image(image_server, card_id, (60 * i, 0, 0))
+    scratch = ThumbnailStore(image_cache, thumb_dir=str(tmp_path / "scratch"))
+    sizes = [sum(len(data) for data in scratch.build(card_id, url).values()) for card_id, url in zip(CARD_IDS, urls)]
+    # 4枚目で上限を超え、最も古い1枚を消せば削除後の目標 (_EVICT_LOW_WATERMARK) に収まる上限
+    max_bytes = int((sizes[0] + sizes[2] + sizes[3]) / card_thumbnails._EVICT_LOW_WATERMARK) + 1
+    assert sum(sizes) > max_bytes >= sum(sizes[:3])
+
+    store = ThumbnailStore(image_cache, thumb_dir=str(tmp_path / "bounded"), max_bytes=max_bytes)
+    for card_id, url in zip(CARD_IDS[:3], urls):
+        store.build(card_id, url)
+    # 使われた時刻: 0 が最新、1 が最も古い
+    now = time.time()
+    for card_id, url, mtime in zip(CARD_IDS, urls, [now + 100, now - 100, now + 10]):
+        for name in THUMBNAIL_VARIANTS:
+            os.utime(store._path(card_id, url, name), (mtime, mtime))
+
+    store.build(CARD_IDS[3], urls[3])
+    assert not any(os.path.exists(store._path(CARD_IDS[1], urls[1], name)) for name in THUMBNAIL_VARIANTS)
+    assert not os.path.exists(store._meta_path(CARD_IDS[1], urls[1]))
+    for i in [0, 2, 3]:
+        assert store.has_all(CARD_IDS[i], urls[i])
+    total = sum(size for _, _, size in store._scan_entries())
+    assert total <= store.max_bytes
+    assert store._total_bytes == total
+    # 新しく作ったストアも同じ合計から始まる
+    assert ThumbnailStore(image_cache, thumb_dir=store.thumb_dir)._total_bytes == total
+
+
+def test_queue_stays_bounded(tmp_path, image_server, monkeypatch):
+    # ワーカーを起動しない（キューに積まれたものがそのまま残る）
+    monkeypatch.setattr(card_thumbnails, "IMAGE_FETCH_MAX_WORKERS", 0)
+    cache = CardImageCache(cache_dir=str(tmp_path / "image_cache"), revalidate_after=3600)
+    redirect_session(cache.session, image_server.base_url)
+    store = ThumbnailStore(cache, thumb_dir=str(tmp_path / "thumbnails"))
+    items = [(card_id, url_of(card_id)) for card_id in CARD_IDS]
+
+    # 同じカードを何度 prefetch しても、取得待ちは1件ずつ
+    for _ in range(5):
+        store.prefetch(items + items[:2])
+    assert store._queue.qsize() == len(items)
+
+    # 再検証は期限ごとに1回だけ積む
+    card_id, url = items[0]
+    store.build(card_id, url, ["grid"])
+    for _ in range(50):
+        store.get_bytes(card_id, url, "grid")
+    assert store._queue.qsize() == len(items)
+    store._check_after[(card_id, url)] = 0
+    for _ in range(50):
+        store.get_bytes(card_id, url, "grid")
+    assert store._queue.qsize() == len(items) + 1
+
+
+def test_invalidate_removes_meta(thumbnail_store):
+    card_id, url = CARD_IDS[0], url_of(CARD_IDS[0])
+    thumbnail_store.build(card_id, url)
+    meta_path = thumbnail_store._meta_path(card_id, url)
+    with open(meta_path, "r", encoding="utf-8") as f:
+        assert json.load(f)["card_id"] == card_id
+    thumbnail_store.invalidate(card_id, url)
+    assert not os.path.exists(meta_path)
+    assert thumbnail_store.source_digest(card_id, url) is None
+    assert thumbnail_store._total_bytes == 0
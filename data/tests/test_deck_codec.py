@@ -0,0 +1,141 @@
+"""deck_codec: テキスト形式・短縮形式（カード辞書 + base45）の読み書き"""
+import random
+
+import pytest
+
+import deck_codec
+from deck_codec import (
+    COMPACT_PREFIX, CardDictionary, DeckParseError, base45_decode, base45_encode, decode_compact,
+    decode_deck_code, encode_compact, encode_deck_code, format_deck_text, iter_decks, parse_deck_text,
+)
+
+CARD_IDS = [f"OP01-{i:03d}" for i in range(1, 121)] + ["ST01-001", "P-001"]
+
+
+@pytest.fixture
+def dictionary(monkeypatch):
+    """テスト用のカード辞書を既定の辞書にする（card_dictionary.txt は読まない）"""
+    dictionary = CardDictionary(CARD_IDS)
+    monkeypatch.setattr(deck_codec, "_card_dictionary", dictionary)
+    return dictionary
+
+
+def sample_deck(seed=0):
+    rnd = random.Random(seed)
+    cards = {card_id: rnd.randint(1, 4) for card_id in rnd.sample(CARD_IDS[1:], 15)}
+    return "テストデッキ🏴‍☠️", CARD_IDS[0], cards
+
+
+@pytest.mark.parametrize("length", [0, 1, 2, 3, 17, 64])
+def test_base45_round_trip(length):
+    data = bytes(random.Random(length).randrange(256) for _ in range(length))
+    text = base45_encode(data)
+    assert base45_decode(text) == data
+    assert all(c in "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ $%*+-./:" for c in text)
+
+
+@pytest.mark.parametrize("text", ["a", "GGW", "0", "::::"])
+def test_base45_rejects_invalid_text(text):
+    with pytest.raises(ValueError):
+        base45_decode(text)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_compact_round_trip(dictionary, seed):
+    name, leader_id, cards = sample_deck(seed)
+    code = encode_compact(name, leader_id, cards, dictionary)
+    assert code.startswith(COMPACT_PREFIX)
+    assert decode_compact(code, dictionary=dictionary) == (name, leader_id, cards, [])
+
+
+def test_compact_counts_beyond_four(dictionary):
+    cards = {CARD_IDS[1]: 1, CARD_IDS[2]: 4, CARD_IDS[3]: 5, CARD_IDS[4]: 67}
+    code = encode_compact("", CARD_IDS[0], cards, dictionary)
+    assert decode_compact(code, dictionary=dictionary).cards == cards
+    assert encode_compact("", CARD_IDS[0], {CARD_IDS[1]: 68}, dictionary) is None
+
+
+def test_compact_code_survives_dictionary_append(dictionary):
+    """辞書は追記のみなので、古い辞書で作ったコードは新しい辞書でも同じデッキになる"""
+    name, leader_id, cards = sample_deck()
+    code = encode_compact(name, leader_id, cards, dictionary)
+    extended = dictionary.extended(["OP09-001", "OP09-002", CARD_IDS[5]])
+    assert extended.card_ids[:dictionary.version] == dictionary.card_ids
+    assert extended.version == dictionary.version + 2
+    assert decode_compact(code, dictionary=extended) == (name, leader_id, cards, [])
+
+
+def test_compact_needs_new_enough_dictionary(dictionary):
+    code = encode_compact(*sample_deck(), dictionary=dictionary.extended(["OP09-001"]))
+    with pytest.raises(DeckParseError):
+        decode_compact(code, dictionary=dictionary)
+
+
+def test_compact_skips_unknown_cards_on_decode(dictionary):
+    name, leader_id, cards = sample_deck()
+    missing = sorted(cards)[0]
+    known = set(CARD_IDS) - {missing}
+    deck = decode_compact(encode_compact(name, leader_id, cards, dictionary), known_ids=known, dictionary=dictionary)
+    assert deck.cards == {k: v for k, v in cards.items() if k != missing}
+    assert [error.line for error in deck.errors] == [f"{cards[missing]}x{missing}"]
+
+
+@pytest.mark.parametrize("code", [COMPACT_PREFIX, COMPACT_PREFIX + "0", COMPACT_PREFIX + "ab"])
+def test_compact_rejects_broken_code(dictionary, code):
+    with pytest.raises(DeckParseError):
+        decode_compact(code, dictionary=dictionary)
+
+
+def test_compact_truncated_code(dictionary):
+    code = encode_compact(*sample_deck(), dictionary=dictionary)
+    with pytest.raises(DeckParseError):
+        decode_compact(code[:len(COMPACT_PREFIX) + 6], dictionary=dictionary)
+
+
+def test_deck_code_falls_back_to_text_for_unknown_ids(dictionary):
+    name, leader_id, cards = sample_deck()
+    cards = dict(cards, **{"CUSTOM-001": 2})
+    assert encode_compact(name, leader_id, cards, dictionary) is None
+    code = encode_deck_code(name, leader_id, cards)
+    assert not code.startswith(COMPACT_PREFIX)
+    assert code == format_deck_text(name, leader_id, cards)
+    assert decode_deck_code(code) == (name, leader_id, cards, [])
+
+
+def test_deck_code_text_format_when_not_compact(dictionary):
+    name, leader_id, cards = sample_deck()
+    code = encode_deck_code(name, leader_id, cards, compact=False)
+    assert code == format_deck_text(name, leader_id, cards)
+    assert decode_deck_code(code) == decode_deck_code(encode_deck_code(name, leader_id, cards))
+
+
+def test_parse_deck_text_records_unknown_and_malformed_lines():
+    text = "# デッキ\n1xOP01-001\n4xOP01-002\n2xNOPE-001\nいい加減な行\n\n3x OP01-003"
+    deck = parse_deck_text(text, known_ids=set(CARD_IDS))
+    assert deck.name == "デッキ"
+    assert deck.leader_id == "OP01-001"
+    assert deck.cards == {"OP01-002": 4, "OP01-003": 3}
+    assert [error.line_no for error in deck.errors] == [4, 5]
+
+
+def test_parse_deck_text_without_leader():
+    with pytest.raises(DeckParseError):
+        parse_deck_text("# 名前だけ\n")
+
+
+def test_iter_decks_multiple_decks():
+    decks = [sample_deck(seed) for seed in range(4)]
+    decks[2] = ("", decks[2][1], decks[2][2])
+    text = "\n\n".join(format_deck_text(*deck) for deck in decks)
+    expected = [(name, leader_id, cards, []) for name, leader_id, cards in decks]
+    assert list(iter_decks(text.splitlines())) == expected
+    # 文字列をそのまま渡しても行ごとに読む
+    assert list(iter_decks(text)) == expected
+
+
+def test_iter_decks_header_separated():
+    text = "# A\n1xOP01-001\n4xOP01-002\n# B\n1xOP01-003\n\n2xOP01-004"
+    assert [(d.name, d.leader_id, d.cards) for d in iter_decks(text, blank_separates=False)] == [
+        ("A", "OP01-001", {"OP01-002": 4}),
+        ("B", "OP01-003", {"OP01-004": 2}),
+    ]
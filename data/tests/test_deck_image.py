@@ -0,0 +1,57 @@
+"""deck_image: リーダーごとの上部レイヤーのキャッシュ"""
+from urllib.parse import urlsplit
+
+import pytest
+
+import deck_image
+from card_image_cache import CardImageCache
+from card_thumbnails import ThumbnailStore, resolve_image_url
+from conftest import solid_png
+
+LEADER_ID = "ST01-001"
+LAYOUT = (("赤",), 2150, 548, (50, 0), (782, 548))
+
+
+@pytest.fixture(autouse=True)
+def clear_header_cache():
+    deck_image.clear_deck_header_cache()
+    yield
+    deck_image.clear_deck_header_cache()
+
+
+def render_header(store):
+    colors, width, height, pos, size = LAYOUT
+    return deck_image.render_deck_header(colors, LEADER_ID, resolve_image_url(LEADER_ID), width, height, pos, size, store)
+
+
+def test_header_is_cached(thumbnail_store):
+    header = render_header(thumbnail_store)
+    assert render_header(thumbnail_store) is header
+    # 別の ThumbnailStore でも同じ版の画像なら同じレイヤー（ストアはキーに含めない）
+    other = ThumbnailStore(thumbnail_store.image_cache, thumb_dir=thumbnail_store.thumb_dir)
+    assert render_header(other) is header
+    assert not any(isinstance(part, ThumbnailStore) for key in deck_image._deck_headers for part in key)
+
+
+def test_header_follows_rebuilt_thumbnail(image_server, thumbnail_store):
+    url = resolve_image_url(LEADER_ID)
+    header = render_header(thumbnail_store)
+
+    # 元画像が差し替わり、サムネイルが作り直されたら、URLが同じでもレイヤーを作り直す
+    image_server._images[urlsplit(url).path] = solid_png((0, 0, 255))
+    assert thumbnail_store.refresh(LEADER_ID, url)
+    rebuilt = render_header(thumbnail_store)
+    assert rebuilt is not header
+    _, _, _, (x, y), (w, h) = LAYOUT
+    assert rebuilt.getpixel((x + w // 2, y + h // 2))[:3] == (0, 0, 255)
+    # 古い版のレイヤーは残さない
+    assert len(deck_image._deck_headers) == 1
+
+
+def test_missing_leader_is_not_cached(tmp_path):
+    # スタブサーバーに向けていないキャッシュで、接続できないURLを取得する
+    store = ThumbnailStore(CardImageCache(cache_dir=str(tmp_path / "offline")), thumb_dir=str(tmp_path / "thumbs"))
+    colors, width, height, pos, size = LAYOUT
+    with pytest.raises(ValueError):
+        deck_image.render_deck_header(colors, LEADER_ID, "http://127.0.0.1:9/none.png", width, height, pos, size, store)
+    assert not deck_image._deck_headers
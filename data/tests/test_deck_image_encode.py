@@ -0,0 +1,103 @@
+"""deck_image_encode: 出力形式ごとのエンコードとサイズ上限、エンコード結果のキャッシュキー"""
+from io import BytesIO
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from card_data import MAIN_CARDS_CSV
+from conftest import write_cards_csv
+from deck_engine import DeckEngine
+from deck_image_encode import (
+    BUDGET_MIN_QUALITY, BUDGET_MIN_SCALE, DEFAULT_MAX_BYTES, DEFAULT_QUALITY, OUTPUT_FORMATS, PREVIEW_WIDTH,
+    encode_image, encode_preview, encode_within, format_size,
+)
+
+
+def photo_like(size, noise=20, seed=0):
+    """グラデーションにノイズを乗せた画像（写真に近く、JPEG で小さくなりにくい）"""
+    width, height = size
+    rng = np.random.default_rng(seed)
+    base = np.linspace(0, 200, width)[None, :, None] + np.zeros((height, 1, 3))
+    return Image.fromarray(np.clip(base + rng.normal(0, noise, (height, width, 3)), 0, 255).astype(np.uint8))
+
+
+def decode(encoded):
+    img = Image.open(BytesIO(encoded.data))
+    img.load()
+    return img
+
+
+@pytest.mark.parametrize("output_format", list(OUTPUT_FORMATS))
+def test_each_format_decodes(output_format):
+    # デッキ画像は RGBA で描画される
+    img = photo_like((430, 410)).convert("RGBA")
+    encoded = encode_image(img, output_format)
+    decoded = decode(encoded)
+    assert decoded.format == encoded.format
+    assert decoded.size == encoded.size == img.size
+    assert decoded.mode == "RGB"
+    assert encoded.mime_type == f"image/{encoded.format.lower()}"
+    assert encoded.extension in (".png", ".jpg", ".webp")
+    if encoded.format == "PNG":
+        assert encoded.quality is None
+        assert decoded.tobytes() == img.convert("RGB").tobytes()
+    elif output_format in DEFAULT_QUALITY:
+        assert encoded.quality == DEFAULT_QUALITY[output_format]
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        encode_image(photo_like((10, 10)), "gif")
+
+
+def test_budget_lowers_quality():
+    # デッキ画像と同じ大きさ。既定の画質では 1MB を超え、画質の下限なら収まる
+    img = photo_like((2150, 2048))
+    assert len(encode_image(img, "jpeg").data) > DEFAULT_MAX_BYTES
+    encoded = encode_image(img, "budget")
+    assert len(encoded.data) <= DEFAULT_MAX_BYTES
+    assert encoded.size == img.size
+    assert BUDGET_MIN_QUALITY <= encoded.quality < DEFAULT_QUALITY["jpeg"]
+    assert decode(encoded).size == img.size
+
+
+def test_budget_shrinks_when_quality_is_not_enough():
+    img = photo_like((800, 600), noise=60)
+    max_bytes = len(encode_within(img, 10 ** 9, quality=BUDGET_MIN_QUALITY).data) // 3
+    encoded = encode_within(img, max_bytes)
+    assert len(encoded.data) <= max_bytes
+    assert encoded.quality == BUDGET_MIN_QUALITY
+    assert encoded.size[0] < img.width
+    assert encoded.size[0] >= round(img.width * BUDGET_MIN_SCALE)
+    assert decode(encoded).size == encoded.size
+
+
+def test_preview():
+    preview = encode_preview(photo_like((2150, 2048)))
+    assert preview.format == "JPEG"
+    assert preview.size == (PREVIEW_WIDTH, round(2048 * PREVIEW_WIDTH / 2150))
+    assert encode_preview(photo_like((300, 200))).size == (300, 200)
+
+
+def test_format_size():
+    assert format_size(1_234_567) == "1.23 MB"
+    assert format_size(456_000) == "456 KB"
+    assert format_size(10) == "1 KB"
+
+
+def test_card_signature_follows_card_table(tmp_path, monkeypatch):
+    """アプリのエンコード結果のキャッシュキー (DeckEngine.card_signature) は、カードテーブルが変わったときだけ変わる"""
+    monkeypatch.chdir(tmp_path)
+    write_cards_csv(MAIN_CARDS_CSV, [f"OP01-{i:03d}" for i in range(1, 21)])
+    engine = DeckEngine(use_snapshot=False)
+    signature = engine.card_signature
+    hash(signature)
+    engine.refresh()
+    assert engine.card_signature == signature
+    assert DeckEngine(use_snapshot=False).card_signature == signature
+
+    write_cards_csv(MAIN_CARDS_CSV, [f"OP01-{i:03d}" for i in range(1, 22)])
+    engine.refresh()
+    assert len(engine.df) == 21
+    assert engine.card_signature != signature
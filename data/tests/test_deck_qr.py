@@ -0,0 +1,62 @@
+"""deck_qr: 1枚の画像に写っている複数のQRコード（写真の一部に小さく写っているものを含む）をすべて読めるか"""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from deck_image import render_qr_code
+from deck_qr import QR_TILE_GRIDS, _iter_tiles, decode_qr_codes, decode_qr_image, fit_within, load_grayscale
+
+
+def photo(size, placements):
+    """背景の上に (内容, 一辺, 左上の座標) のQRコードを貼った PNG のバイト列"""
+    img = Image.new("RGB", size, (200, 190, 170))
+    for text, side, pos in placements:
+        img.paste(render_qr_code.__wrapped__(text, side).convert("RGB"), pos)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("size, placements", [
+    ((1000, 700), [("DK:AAA1", 300, (50, 50)), ("DK:BBB2", 300, (550, 300))]),
+    # スマートフォンの写真くらいの大きさ
+    ((4000, 3000), [("DK:AAA1", 900, (100, 100)), ("DK:BBB2", 900, (2000, 1500)), ("DK:CCC3", 900, (3000, 100))]),
+    # 縮小画像では読めず、タイルに分けて見つかる小さなQRコード
+    ((4000, 3000), [("DK:AAA1", 800, (100, 100)), ("DK:SMALL", 260, (3100, 2300))]),
+])
+def test_decodes_every_qr_code(size, placements):
+    assert sorted(decode_qr_image(photo(size, placements))) == sorted(text for text, _, _ in placements)
+
+
+def test_same_code_is_returned_once():
+    placements = [("DK:AAA1", 300, (50, 50)), ("DK:AAA1", 300, (550, 300))]
+    assert decode_qr_image(photo((1000, 700), placements)) == ["DK:AAA1"]
+
+
+def test_no_qr_code():
+    assert decode_qr_image(photo((800, 600), [])) == []
+    assert decode_qr_codes(np.full((10, 10), 255, dtype=np.uint8)) == []
+    with pytest.raises(ValueError):
+        decode_qr_image(b"not an image")
+
+
+def test_fit_within():
+    gray = load_grayscale(photo((4000, 3000), []))
+    assert gray.shape == (3000, 4000)
+    small, scale = fit_within(gray, 1000)
+    assert small.shape == (750, 1000) and scale == 0.25
+    same, scale = fit_within(gray, 5000)
+    assert same is gray and scale == 1.0
+
+
+@pytest.mark.parametrize("grid", QR_TILE_GRIDS)
+def test_tiles_cover_image(grid):
+    img = np.zeros((2048, 1536), dtype=np.uint8)
+    covered = np.zeros(img.shape, dtype=bool)
+    tiles = list(_iter_tiles(img, grid))
+    assert len(tiles) == grid * grid
+    for tile, x, y in tiles:
+        covered[y:y + tile.shape[0], x:x + tile.shape[1]] = True
+    assert covered.all()
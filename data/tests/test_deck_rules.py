@@ -0,0 +1,129 @@
+"""deck_rules: まとめて検証 (validate_many) がデッキごとの検証・ルールの定義どおりの結果になるか"""
+import random
+
+import pytest
+
+from card_index import INDEXED_COLORS, CardLookup
+from deck_codec import DeckList
+from deck_rules import (
+    BANNED, COLOR_MISMATCH, DECK_SIZE, INVALID_LEADER, LEADER_IN_DECK, RESTRICTED, TOO_MANY_COPIES, UNKNOWN_CARD,
+    DeckValidator, Regulation, get_validator,
+)
+
+CARD_IDS = [f"OP01-{i:03d}" for i in range(1, 81)] + ["OP01-010_p", "OP01-020_p"]
+
+
+@pytest.fixture
+def lookup(make_card_table):
+    return CardLookup(make_card_table(CARD_IDS, seed=1))
+
+
+@pytest.fixture
+def regulation(lookup):
+    leaders = [card_id for card_id, r in lookup.preferred.items() if r["タイプ"] == "LEADER"]
+    others = [card_id for card_id in lookup.preferred if card_id not in leaders]
+    return Regulation.from_dict("test", {
+        "deck_size": 50, "max_copies": 4,
+        "unlimited": [others[0]],
+        "restricted": {others[1]: 1, others[2]: 2},
+        # 禁止リーダーも1枚入れる
+        "banned": [others[3], leaders[0]],
+    })
+
+
+def reference_codes(regulation, lookup, leader_id, cards):
+    """ルールの定義どおりにデッキ1つを1枚ずつ調べた違反の種類（ソート済み）"""
+    codes = []
+    leader = lookup.get(leader_id)
+    valid_leader = leader is not None and leader["タイプ"] == "LEADER"
+    if not valid_leader:
+        codes.append(INVALID_LEADER)
+    elif leader_id in regulation.banned:
+        codes.append(BANNED)
+    leader_colors = [c for c in INDEXED_COLORS if valid_leader and c in str(leader["色"])]
+    restricted = dict(regulation.restricted)
+    for card_id, count in cards.items():
+        if count <= 0:
+            continue
+        record = lookup.get(card_id)
+        if record is None:
+            codes.append(UNKNOWN_CARD)
+            continue
+        limit = regulation.copy_limit(card_id)
+        if limit is not None and count > limit:
+            codes.append(BANNED if limit == 0 else RESTRICTED if card_id in restricted else TOO_MANY_COPIES)
+        if record["タイプ"] == "LEADER":
+            codes.append(LEADER_IN_DECK)
+        if valid_leader and not any(c in str(record["色"]) for c in leader_colors):
+            codes.append(COLOR_MISMATCH)
+    if sum(count for count in cards.values() if count > 0) != regulation.deck_size:
+        codes.append(DECK_SIZE)
+    return sorted(codes)
+
+
+def random_decks(lookup, regulation, count, seed=0):
+    """違反の種類がひととおり出るデッキ（不明なカード・不正なリーダー・0枚の行・ちょうど50枚を含む）"""
+    rnd = random.Random(seed)
+    card_ids = list(lookup.preferred)
+    leaders = [card_id for card_id in card_ids if lookup[card_id]["タイプ"] == "LEADER"]
+    special = [card_id for card_id, _ in regulation.restricted] + sorted(regulation.banned | regulation.unlimited)
+    decks = []
+    for _ in range(count):
+        leader_id = rnd.choice(leaders + ["XX-000", card_ids[1]])
+        pool = card_ids + special * 5 + ["ZZ-999"]
+        cards = {rnd.choice(pool): rnd.randint(0, 6) for _ in range(rnd.randint(0, 16))}
+        if rnd.random() < 0.3:
+            # 合計をちょうど50枚にする
+            cards = {card_id: 1 for card_id in rnd.sample(card_ids, 10)}
+            cards[card_ids[-1]] = 40
+        decks.append((leader_id, cards))
+    return decks
+
+
+def test_validate_many_matches_validate(lookup, regulation):
+    validator = DeckValidator(regulation, lookup)
+    decks = random_decks(lookup, regulation, 500)
+    assert validator.validate_many(decks) == [validator.validate(*deck) for deck in decks]
+
+
+def test_validate_many_matches_rules(lookup, regulation):
+    validator = DeckValidator(regulation, lookup)
+    decks = random_decks(lookup, regulation, 2000, seed=1)
+    results = validator.validate_many(decks)
+    for deck, violations in zip(decks, results):
+        assert sorted(v.code for v in violations) == reference_codes(regulation, lookup, *deck), deck
+    # すべての種類の違反が一度は出ている（テスト用のデッキが偏っていない）
+    assert {v.code for violations in results for v in violations} == {
+        BANNED, RESTRICTED, TOO_MANY_COPIES, DECK_SIZE, COLOR_MISMATCH, LEADER_IN_DECK, UNKNOWN_CARD, INVALID_LEADER,
+    }
+
+
+def test_validate_many_accepts_deck_lists(lookup, regulation):
+    validator = DeckValidator(regulation, lookup)
+    decks = random_decks(lookup, regulation, 50, seed=2)
+    deck_lists = [DeckList(f"デッキ{i}", leader_id, cards, []) for i, (leader_id, cards) in enumerate(decks)]
+    assert validator.validate_many(deck_lists) == validator.validate_many(decks)
+
+
+def test_validate_many_empty(lookup, regulation):
+    assert DeckValidator(regulation, lookup).validate_many([]) == []
+
+
+def test_violation_details(lookup, regulation):
+    validator = DeckValidator(regulation, lookup)
+    (restricted_id, limit), _ = regulation.restricted
+    leader_id = next(
+        card_id for card_id, r in lookup.preferred.items()
+        if r["タイプ"] == "LEADER" and card_id not in regulation.banned
+    )
+    violations = validator.validate(leader_id, {restricted_id: limit + 2})
+    restricted = [v for v in violations if v.code == RESTRICTED]
+    assert restricted == [restricted[0]._replace(card_id=restricted_id, count=limit + 2, limit=limit)]
+    size = [v for v in violations if v.code == DECK_SIZE]
+    assert [(v.card_id, v.count, v.limit) for v in size] == [(None, limit + 2, regulation.deck_size)]
+
+
+def test_get_validator_is_cached(lookup, regulation):
+    validator = get_validator(regulation, lookup)
+    assert get_validator(regulation, lookup) is validator
+    assert get_validator(regulation._replace(max_copies=3), lookup) is not validator
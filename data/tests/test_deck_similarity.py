@@ -0,0 +1,105 @@
+"""deck_similarity: 疎行列で求めた類似度・採用カードが、デッキを1つずつ比べた結果と同じになるか"""
+import math
+import random
+
+import numpy as np
+import pytest
+
+from deck_codec import DeckList
+from deck_similarity import COSINE, JACCARD, DeckIndex
+
+LEADERS = ["ST01-001", "OP01-060", "OP02-001"]
+CARD_IDS = [f"OP01-{i:03d}" for i in range(1, 41)]
+
+
+def random_decks(count, seed=0):
+    rnd = random.Random(seed)
+    decks = []
+    for i in range(count):
+        cards = {card_id: rnd.randint(0, 4) for card_id in rnd.sample(CARD_IDS, rnd.randint(0, 15))}
+        decks.append(DeckList(f"デッキ{i}", rnd.choice(LEADERS), cards, []))
+    return decks
+
+
+def reference_score(a, b, metric):
+    """{カードID: 枚数} 同士の類似度（0枚の行は無いものとして扱う）"""
+    a = {card_id: count for card_id, count in a.items() if count > 0}
+    b = {card_id: count for card_id, count in b.items() if count > 0}
+    if metric == COSINE:
+        dot = sum(count * b.get(card_id, 0) for card_id, count in a.items())
+        denom = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    else:
+        dot = sum(min(count, b.get(card_id, 0)) for card_id, count in a.items())
+        denom = sum(max(a.get(card_id, 0), b.get(card_id, 0)) for card_id in a.keys() | b.keys())
+    return dot / denom if denom else 0.0
+
+
+@pytest.fixture
+def decks():
+    return random_decks(120)
+
+
+@pytest.mark.parametrize("metric", [COSINE, JACCARD])
+def test_scores_match_reference(decks, metric):
+    index = DeckIndex(decks)
+    rnd = random.Random(1)
+    # 索引に無いカード・0枚の行を含むクエリ
+    queries = [deck.cards for deck in decks[:20]] + [{"ZZ-999": 4}, {}, {CARD_IDS[0]: 0, "ZZ-999": 2, CARD_IDS[1]: 3}]
+    queries += [{card_id: rnd.randint(1, 4) for card_id in rnd.sample(CARD_IDS, 10)} for _ in range(10)]
+    for cards in queries:
+        expected = [reference_score(cards, deck.cards, metric) for deck in decks]
+        np.testing.assert_allclose(index.scores(cards, metric), expected, atol=1e-12)
+
+
+@pytest.mark.parametrize("metric", [COSINE, JACCARD])
+def test_similar_is_top_k(decks, metric):
+    index = DeckIndex(decks)
+    for deck in decks[:10]:
+        scores = index.scores(deck.cards, metric)
+        for k in [1, 5, 200]:
+            for leader_id in [None, LEADERS[0], "XX-000"]:
+                expected = sorted(
+                    (-scores[i], i) for i, d in enumerate(decks)
+                    if scores[i] > 0 and d.name != deck.name and leader_id in (None, d.leader_id)
+                )[:k]
+                results = index.similar(deck.cards, k, metric, leader_id=leader_id, exclude=deck.name)
+                assert [(r.name, r.leader_id) for r in results] == [(decks[i].name, decks[i].leader_id) for _, i in expected]
+                assert [r.score for r in results] == [-s for s, _ in expected]
+
+
+def test_similar_finds_itself(decks):
+    index = DeckIndex(decks)
+    deck = next(d for d in decks if any(c > 0 for c in d.cards.values()))
+    top = index.similar(deck.cards, 1)[0]
+    assert top.score == pytest.approx(1.0)
+    with pytest.raises(ValueError):
+        index.scores(deck.cards, "euclid")
+
+
+def test_common_cards_match_reference(decks):
+    index = DeckIndex(decks)
+    for leader_id in LEADERS:
+        leader_decks = [d for d in decks if d.leader_id == leader_id]
+        usage = {}
+        for deck in leader_decks:
+            for card_id, count in deck.cards.items():
+                if count > 0:
+                    usage.setdefault(card_id, []).append(count)
+        expected = sorted(
+            (-len(counts), -sum(counts) / len(counts), card_id) for card_id, counts in usage.items()
+        )[:20]
+        results = index.common_cards(leader_id)
+        assert [r.card_id for r in results] == [card_id for _, _, card_id in expected]
+        for result, (used, avg, _) in zip(results, expected):
+            assert result.deck_share == pytest.approx(-used / len(leader_decks))
+            assert result.avg_count == pytest.approx(-avg)
+    assert index.common_cards("XX-000") == []
+    assert len(index.common_cards(LEADERS[0], k=3)) == 3
+
+
+def test_empty_index():
+    index = DeckIndex([])
+    assert len(index) == 0
+    assert index.scores({CARD_IDS[0]: 4}).tolist() == []
+    assert index.similar({CARD_IDS[0]: 4}) == []
+    assert index.common_cards(LEADERS[0]) == []
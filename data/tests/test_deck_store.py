@@ -0,0 +1,134 @@
+"""deck_store: SQLite / ファイルのデッキストアの読み書きと、従来形式 (saved_decks/) からの取り込み"""
+import os
+
+import pytest
+
+from deck_codec import DeckList, format_deck_text
+from deck_store import ORDER_BY_UPDATED, FileDeckStore, SQLiteDeckStore, check_deck_name
+
+LEADER_COLORS = {"ST01-001": "赤", "OP01-060": "青/紫"}
+
+CARDS = {"OP01-016": 4, "ST01-002": 4, "ST01-004": 2}
+
+
+@pytest.fixture(params=["sqlite", "files"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteDeckStore(str(tmp_path / "decks.sqlite3"), legacy_dir=None)
+    return FileDeckStore(str(tmp_path / "saved_decks"), leader_colors=LEADER_COLORS.get)
+
+
+def write_legacy(directory, file_name, leader_id, cards, header=None):
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, file_name), "w", encoding="utf-8") as f:
+        f.write(format_deck_text(header if header is not None else file_name[:-4], leader_id, cards))
+
+
+@pytest.mark.parametrize("name", ["テスト", "a.b", "デッキ 1", "...", "赤🏴‍☠️"])
+def test_check_deck_name_accepts(name):
+    check_deck_name(name)
+
+
+@pytest.mark.parametrize("name", ["", "   ", "a/b", "a\\b", "a\0b", ".", ".."])
+def test_check_deck_name_rejects(name):
+    with pytest.raises(ValueError):
+        check_deck_name(name)
+
+
+def test_round_trip(store):
+    store.save("赤デッキ", "ST01-001", CARDS, colors="赤")
+    store.save("青紫デッキ", "OP01-060", {"OP01-061": 4}, colors="青/紫")
+    assert store.load("赤デッキ") == DeckList("赤デッキ", "ST01-001", CARDS, [])
+    assert list(store.load("赤デッキ").cards) == list(CARDS)
+    assert store.load("無いデッキ") is None
+
+    assert [s.name for s in store.list_decks()] == ["赤デッキ", "青紫デッキ"]
+    summary = store.list_decks(leader_id="ST01-001")[0]
+    assert (summary.name, summary.colors, summary.card_count) == ("赤デッキ", "赤", 10)
+    assert [s.name for s in store.list_decks(color="紫")] == ["青紫デッキ"]
+    assert [s.name for s in store.list_decks(query="赤")] == ["赤デッキ"]
+    assert store.list_decks(leader_id="ST01-001", color="青") == []
+    assert sorted(d.name for d in store.load_all()) == ["赤デッキ", "青紫デッキ"]
+
+    # 同名のデッキは置き換える
+    store.save("赤デッキ", "ST01-001", {"OP01-016": 1}, colors="赤")
+    assert store.load("赤デッキ").cards == {"OP01-016": 1}
+    assert len(store.list_decks()) == 2
+
+    assert store.delete("赤デッキ") is True
+    assert store.delete("赤デッキ") is False
+    assert store.load("赤デッキ") is None
+    assert [s.name for s in store.list_decks()] == ["青紫デッキ"]
+
+
+def test_load_skips_unknown_cards(store):
+    store.save("デッキ", "ST01-001", CARDS, colors="赤")
+    deck = store.load("デッキ", known_ids={"OP01-016", "ST01-004"})
+    assert deck.cards == {"OP01-016": 4, "ST01-004": 2}
+    assert [(e.line_no, e.line) for e in deck.errors] == [(4, "4xST01-002")]
+
+
+@pytest.mark.parametrize("name", ["a/b", "a\\b", " "])
+def test_save_rejects_invalid_name(store, name):
+    with pytest.raises(ValueError):
+        store.save(name, "ST01-001", CARDS)
+    assert store.list_decks() == []
+
+
+def test_list_decks_by_update_time(tmp_path):
+    store = SQLiteDeckStore(str(tmp_path / "decks.sqlite3"), legacy_dir=None)
+    for name in ["b", "a", "c"]:
+        store.save(name, "ST01-001", CARDS)
+    store.save("a", "ST01-001", CARDS)
+    assert [s.name for s in store.list_decks(order=ORDER_BY_UPDATED)] == ["a", "c", "b"]
+
+
+def test_fingerprint_changes(store):
+    before = store.fingerprint()
+    store.save("デッキ", "ST01-001", CARDS)
+    saved = store.fingerprint()
+    assert saved != before
+    if isinstance(store, FileDeckStore):
+        # ファイルの mtime は同じ時刻に丸められることがあるので、更新したことがわかるようにずらす
+        store.save("デッキ", "ST01-001", {"OP01-016": 1})
+        stat = os.stat(store._path("デッキ"))
+        os.utime(store._path("デッキ"), (stat.st_atime, stat.st_mtime + 1))
+    else:
+        store.save("デッキ", "ST01-001", {"OP01-016": 1})
+    updated = store.fingerprint()
+    assert updated != saved
+    store.delete("デッキ")
+    assert store.fingerprint() not in (saved, updated)
+
+
+def test_legacy_import(tmp_path):
+    legacy_dir = str(tmp_path / "saved_decks")
+    write_legacy(legacy_dir, "赤デッキ.txt", "ST01-001", CARDS)
+    # 中のデッキ名ではなくファイル名で取り込む（中の名前に「/」があっても問題ない）
+    write_legacy(legacy_dir, "青紫.txt", "OP01-060", {"OP01-061": 4}, header="青/紫")
+    # 保存し直せない名前のファイルは飛ばす
+    write_legacy(legacy_dir, "a\\b.txt", "ST01-001", CARDS)
+    write_legacy(legacy_dir, "   .txt", "ST01-001", CARDS)
+    write_legacy(legacy_dir, "...txt", "ST01-001", CARDS)
+    # 読めないファイルも飛ばす
+    with open(os.path.join(legacy_dir, "壊れた.txt"), "w", encoding="utf-8") as f:
+        f.write("これはデッキではありません")
+
+    path = str(tmp_path / "decks.sqlite3")
+    store = SQLiteDeckStore(path, legacy_dir=legacy_dir, leader_colors=LEADER_COLORS.get)
+    assert [(s.name, s.colors, s.card_count) for s in store.list_decks()] == [
+        ("赤デッキ", "赤", 10), ("青紫", "青/紫", 4),
+    ]
+    assert store.load("赤デッキ") == DeckList("赤デッキ", "ST01-001", CARDS, [])
+    assert [s.name for s in store.list_decks(color="紫")] == ["青紫"]
+    # 取り込んだデッキはそのまま保存し直せる
+    for deck in store.load_all():
+        store.save(deck.name, deck.leader_id, deck.cards)
+    # 元のファイルは残す
+    assert os.path.exists(os.path.join(legacy_dir, "a\\b.txt"))
+
+    # 取り込みは1回だけ（消したデッキが次の起動で戻らない）
+    store.delete("赤デッキ")
+    write_legacy(legacy_dir, "新しいデッキ.txt", "ST01-001", CARDS)
+    reopened = SQLiteDeckStore(path, legacy_dir=legacy_dir, leader_colors=LEADER_COLORS.get)
+    assert [s.name for s in reopened.list_decks()] == ["青紫"]
@@ -0,0 +1,94 @@
+"""ngram_index: N-gram 索引の部分一致検索と、行の差し替え (splice_postings) が作り直した索引と同じになるか"""
+import random
+
+import numpy as np
+import pytest
+
+from ngram_index import NgramIndex, pack_postings, splice_postings, unpack_postings
+
+ALPHABET = "ドン!!KOkoアタック・【】 ルフィ"
+
+
+def random_texts(rnd, count):
+    return ["".join(rnd.choice(ALPHABET) for _ in range(rnd.randint(0, 12))) for _ in range(count)]
+
+
+def brute_force(texts, query, positions=None):
+    rows = range(len(texts)) if positions is None else positions
+    return [pos for pos in rows if query.lower() in texts[pos].lower()]
+
+
+def postings_of(postings):
+    return {key: positions.tolist() for key, positions in postings.items() if len(positions)}
+
+
+@pytest.mark.parametrize("n", [1, 2, 3])
+def test_search_matches_substring(n):
+    rnd = random.Random(n)
+    texts = random_texts(rnd, 200)
+    index = NgramIndex(texts, n=n)
+    positions = np.asarray(sorted(rnd.sample(range(len(texts)), 80)), dtype=np.int32)
+    for _ in range(300):
+        text = rnd.choice(texts)
+        start = rnd.randint(0, len(text))
+        # 多くは実在する部分文字列、一部は無い文字列（大文字小文字は無視する）
+        query = text[start:start + rnd.randint(1, 5)].swapcase() if rnd.random() < 0.8 else "".join(rnd.sample(ALPHABET, 3))
+        if not query:
+            continue
+        result = index.search(query)
+        assert result.dtype == np.int32
+        assert result.tolist() == brute_force(texts, query)
+        assert index.search(query, positions).tolist() == brute_force(texts, query, positions.tolist())
+
+
+def test_search_all_and_empty_query():
+    texts = ["モンキー・D・ルフィ", "ロロノア・ゾロ", "ルフィ&ゾロ", ""]
+    index = NgramIndex(texts)
+    assert index.search("ルフィ").tolist() == [0, 2]
+    assert index.search_all(["ルフィ", "ゾロ"]).tolist() == [2]
+    assert index.search_all(["ルフィ", "ナミ"]).tolist() == []
+    assert index.search_all([]).tolist() == [0, 1, 2, 3]
+    assert index.search("").tolist() == [0, 1, 2, 3]
+    assert index.search("d・ル").tolist() == [0]
+    assert len(index) == 4
+    with pytest.raises(ValueError):
+        NgramIndex(texts, n=0)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_replace_rows_matches_rebuild(seed):
+    rnd = random.Random(seed)
+    texts = random_texts(rnd, rnd.randint(0, 40))
+    start = rnd.randint(0, len(texts))
+    stop = rnd.randint(start, len(texts))
+    part = random_texts(rnd, rnd.randint(0, 10))
+    index = NgramIndex(texts)
+    before = postings_of(index.postings)
+
+    patched = index.replace_rows(start, stop, part)
+    fresh = NgramIndex(texts[:start] + part + texts[stop:])
+    assert patched.texts == fresh.texts
+    assert postings_of(patched.postings) == postings_of(fresh.postings)
+    assert all(positions.dtype == np.int32 for positions in patched.postings.values())
+    # 元の索引は変わらない
+    assert postings_of(index.postings) == before
+
+
+def test_splice_postings():
+    postings = {"a": np.array([0, 2, 5], dtype=np.int32), "b": np.array([3], dtype=np.int32), "c": np.array([6], dtype=np.int32)}
+    # 行 [2, 4) を 3行で置き換える（後ろの行は1つずれる）
+    part = {"a": np.array([1], dtype=np.int32), "d": np.array([0, 2], dtype=np.int32)}
+    result = splice_postings(postings, 2, 4, part, 3)
+    assert postings_of(result) == {"a": [0, 3, 6], "c": [7], "d": [2, 4]}
+    # 差し替え範囲より前だけのリストは同じ配列を使い回す
+    unchanged = {"x": np.array([0, 1], dtype=np.int32)}
+    assert splice_postings(unchanged, 2, 4, {}, 0)["x"] is unchanged["x"]
+
+
+def test_pack_round_trip():
+    postings = NgramIndex(["ルフィ", "ゾロ", "ルフィとゾロ"]).postings
+    keys, values, offsets = pack_postings(postings)
+    assert values.dtype == np.int32 and len(offsets) == len(keys) + 1
+    assert postings_of(unpack_postings(keys, values, offsets)) == postings_of(postings)
+    keys, values, offsets = pack_postings({})
+    assert unpack_postings(keys, values, offsets) == {}